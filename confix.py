@@ -5,37 +5,38 @@ A language-agnostic configuration parser.
 Currently supports YAML, JSON, INI and TOML serialization formats.
 """
 
+# Note: confix is imported by short-lived CLI tools so only cheap
+# modules are imported here; format parsers, regexes and logging are
+# imported / compiled on first use.
 import collections
 import contextlib
 import functools
-import inspect
-import json
-import logging
-import multiprocessing
+import math
 import os
-import re
 import sys
 import threading
-import warnings
-
-try:
-    import configparser  # py3
-except ImportError:
-    import ConfigParser as configparser
+import time
+import types
 
 __all__ = [
     # constants
     "version_info", "__version__",
     # functions
-    'register', 'parse', 'parse_with_envvars', 'discard', 'schema',
-    'get_parsed_conf',
+    'register', 'parse', 'parse_with_envvars', 'reload', 'discard', 'schema',
+    'snapshot', 'restore', 'compile_conf', 'generate_module', 'import_conf',
+    'validate_files', 'get', 'get_parsed_conf', 'get_parse_stats',
+    'get_memory_usage', 'add_trace_listener', 'remove_trace_listener',
+    'register_coercer', 'register_parser', 'parse_yaml',
+    # classes
+    'ParseStats', 'SharedConfStore', 'ConfServer', 'ConfClient',
+    'HTTPSource', 'SQLiteSource', 'ValidationResult', 'ValidationReport',
     # validators
     'isemail', 'isin', 'isnotin', 'istrue', 'isurl', 'isip46', 'isip4',
     'isip6',
     # exceptions
     'Error', 'ValidationError', 'AlreadyParsedError', 'NotParsedError',
     'RequiredSettingKeyError', 'TypesMismatchError', 'AlreadyRegisteredError',
-    'UnrecognizedSettingKeyError',
+    'UnrecognizedSettingKeyError', 'InterpolationError',
 ]
 __version__ = '0.2.2'
 __author__ = 'Giampaolo Rodola'
@@ -47,27 +48,88 @@ _PY3 = sys.version_info >= (3, )
 # do "True", "TRUE" etc and ignore "TrUe".
 _STR_BOOL_TRUE = set(("1", "yes", "true", "on"))
 _STR_BOOL_FALSE = set(("0", "no", "false", "off"))
-_EMAIL_RE = re.compile("^.+@.+\..+$")
-# http://stackoverflow.com/a/7995979/376587
-_URL_RE = re.compile(
-    r'^https?://'  # http:// or https://
-    r'(?:(?:[A-Z0-9](?:[A-Z0-9-]{0,61}[A-Z0-9])?\.)+[A-Z]{2,6}\.?|'  # domain
-    r'localhost|'  # localhost
-    r'\d{1,3}\.\d{1,3}\.\d{1,3}\.\d{1,3})'  # or IPv4
-    r'(?::\d+)?'  # optional port
-    r'(?:/?|[/?]\S+)$', re.IGNORECASE)
+# regexes are compiled on first use (see _get_regex())
+_REGEXES = {
+    'email': (r"^.+@.+\..+$", 0),
+    # http://stackoverflow.com/a/7995979/376587
+    'url': (
+        r'^https?://'  # http:// or https://
+        r'(?:(?:[A-Z0-9](?:[A-Z0-9-]{0,61}[A-Z0-9])?\.)+[A-Z]{2,6}\.?|'
+        r'localhost|'  # localhost
+        r'\d{1,3}\.\d{1,3}\.\d{1,3}\.\d{1,3})'  # or IPv4
+        r'(?::\d+)?'  # optional port
+        r'(?:/?|[/?]\S+)$', 'IGNORECASE'),
+    # used to guess the format of nameless streams (see _sniff())
+    'section_header': (r"^\[\[?[\w.\- \"']+\]\]?$", 0),
+    'toml_pair': (
+        r"""^[\w.\-\"']+\s*=\s*(["'\[{\d+\-]|true|false|inf|nan)""", 0),
+    'yaml_start': (r"""^(---|- |[\w\-\"' .]+:(\s|$))""", 0),
+    # "${name}" references and "$$" escapes (see _compile_template())
+    'template': (r"\$(?:\$|\{([^}]*)\})", 0),
+}
+_compiled_regexes = {}
 _DEFAULT = object()
+_timer = getattr(time, 'perf_counter', time.time)
 _threading_lock = threading.Lock()
-_multiprocessing_lock = multiprocessing.Lock()
 _conf_map = {}
+# {section: {key: default_value}} as defined by the conf classes
+_defaults_map = {}
+# {section: {key: coercer}} resolved on first use (see _get_coercers())
+_coercers_map = {}
+# {section: [key, ...]} of the keys whose default is a schema()
+_schema_keys_map = {}
+# {section: function} for classes registered with compiled=True; the
+# function is generated on first parse() (None until then)
+_compiled_map = {}
+# {source: code object}; the generated source only depends on which
+# features the class uses, so there are just a few variants
+_compiled_code = {}
 _parsed = False
-logger = logging.getLogger(__name__)
+# the PID of the process which parsed the configuration
+_parsed_pid = None
+# the arguments passed to the last parse() / parse_with_envvars() call
+_last_parse_kwargs = {}
+# cached fingerprint of the registered conf classes
+_fingerprint = None
+# {"section.key": value} index used by get(); built on first use
+_path_index = None
+_SNAPSHOT_MAGIC = b'CONFIX\x01'
+# extension of the files written by compile_conf()
+_COMPILED_EXT = '.confixc'
+# numeric array.array typecodes accepted by schema(array=...)
+_ARRAY_TYPECODES = 'bBhHiIlLqQfd'
+# {template string: compiled template} (see _compile_template())
+_templates = {}
+# {(section, key): (template, input values, result)} so that reload()
+# only renders templates whose inputs changed
+_interpolation_memo = {}
+_last_stats = None
+_trace_listeners = []
+_logger = None
 
 
 if _PY3:
     basestring = str
     unicode = str
 
+try:
+    from collections.abc import Iterable as _Iterable  # py3
+    from collections.abc import Mapping as _Mapping
+except ImportError:
+    _Iterable = collections.Iterable
+    _Mapping = collections.Mapping
+
+_ROUTINE_TYPES = (types.FunctionType, types.BuiltinFunctionType,
+                  types.MethodType, types.BuiltinMethodType)
+_CLASS_TYPES = (type, types.ClassType) if not _PY3 else (type, )
+
+
+def __getattr__(name):
+    # PEP-562 (py3.7+): 'logger' attribute is created on first access
+    if name == 'logger':
+        return _get_logger()
+    raise AttributeError("module %r has no attribute %r" % (__name__, name))
+
 
 # =============================================================================
 # exceptions
@@ -146,10 +208,15 @@ class UnrecognizedSettingKeyError(Error):
         self.section = section
         self.key = key
         self.new_value = new_value
+        # determined now: by the time the error is printed conf classes
+        # may have been discard()ed
+        self._klass = None
+        if len(_conf_map) == 1:
+            self._klass = next(iter(_conf_map.values()))
 
     def __str__(self):
-        if not _has_multi_conf_classes() and _conf_map:
-            klass = _conf_map[None]
+        klass = self._klass
+        if klass is not None:
             txt = "config class %s.%s" % (klass.__module__, klass.__name__)
         else:
             txt = "any of the config classes"
@@ -193,18 +260,121 @@ class TypesMismatchError(Error):
                             self.new_value, type(self.new_value))
 
 
+class InterpolationError(Error):
+    """Raised when a "${name}" reference in a setting key value can't be
+    resolved (the setting key or env var does not exist or references
+    are circular).
+    """
+
+    def __init__(self, section, key, msg):
+        self.section = section
+        self.key = key
+        self.msg = msg
+
+    def __str__(self):
+        key = "%s.%s" % (self.section, self.key) if self.section else self.key
+        return "can't interpolate setting key %r: %s" % (key, self.msg)
+
+
 # =============================================================================
 # internal utils
 # =============================================================================
 
 
-def _log(s):
-    logger.debug(s)
+def _get_logger():
+    global _logger
+    if _logger is None:
+        import logging
+        _logger = logging.getLogger(__name__)
+    return _logger
+
+
+if sys.version_info < (3, 7):
+    # no PEP-562 module __getattr__ (see above): create it eagerly
+    logger = _get_logger()
 
 
-def _has_multi_conf_classes():
-    """Return True if more than one config class has been register()ed."""
-    return len(_conf_map) > 1
+def _debug_logging():
+    """Return True if the logger is enabled for DEBUG level."""
+    logging = sys.modules.get('logging')
+    if logging is None:
+        # nobody imported (hence configured) logging; avoid importing it
+        return False
+    return _get_logger().isEnabledFor(logging.DEBUG)
+
+
+def _tracing():
+    """Return True if trace events have to be emitted, that is if a
+    trace listener was added or debug logging is enabled. Callers are
+    supposed to check this before building the event (so that tracing
+    costs nothing when disabled).
+    """
+    return bool(_trace_listeners) or _debug_logging()
+
+
+def _trace(event, **fields):
+    """Emit a structured trace event to the listeners added via
+    add_trace_listener() and to the debug logger.
+    """
+    for listener in _trace_listeners:
+        listener(event, fields)
+    if _debug_logging():
+        _get_logger().debug("%s: %s", event, ", ".join(
+            "%s=%r" % (k, v) for k, v in sorted(fields.items())))
+
+
+def _get_regex(name):
+    """Return one of the _REGEXES, compiling it on first use."""
+    try:
+        return _compiled_regexes[name]
+    except KeyError:
+        import re
+        pattern, flag = _REGEXES[name]
+        regex = re.compile(pattern, getattr(re, flag) if flag else 0)
+        _compiled_regexes[name] = regex
+        return regex
+
+
+def _isroutine(obj):
+    """Same as inspect.isroutine() (without importing inspect)."""
+    if isinstance(obj, _ROUTINE_TYPES):
+        return True
+    if isinstance(obj, _CLASS_TYPES):
+        return False
+    # method descriptor
+    tp = type(obj)
+    return hasattr(tp, '__get__') and not hasattr(tp, '__set__')
+
+
+def _to_array(schema_, section, key, value, type_check):
+    """Convert a list of numbers into an array.array of the typecode
+    specified by schema(array=...). The array constructor checks (and
+    converts) all the items in one pass, in C.
+    """
+    import array  # C module, cheap but rarely needed
+    if value is None:
+        return value
+    if isinstance(value, array.array) and value.typecode == schema_.array:
+        return value
+    try:
+        if not isinstance(value, (list, tuple)):
+            raise TypeError
+        return array.array(schema_.array, value)
+    except (TypeError, OverflowError):
+        if type_check:
+            raise TypesMismatchError(section, key, schema_.default, value)
+        return value
+
+
+def _callable_name(fun):
+    """Return a human readable name for a validator function."""
+    if isinstance(fun, functools.partial):
+        fun = fun.func
+    name = getattr(fun, '__name__', None)
+    if name is None:
+        return repr(fun)
+    module = getattr(fun, '__module__', None)
+    return name if module is None else "%s.%s" % (module, name)
 
 
 def _has_sectionless_conf(cmap=None):
@@ -213,11 +383,190 @@ def _has_sectionless_conf(cmap=None):
     return None in cmap
 
 
+def _sizeof(obj, seen):
+    """Return the approximate memory (in bytes) retained by obj and
+    the objects it contains. Objects whose id() is in *seen* are not
+    counted again (so that shared objects are counted once).
+    """
+    if id(obj) in seen:
+        return 0
+    seen.add(id(obj))
+    size = sys.getsizeof(obj)
+    if isinstance(obj, dict):
+        for k, v in obj.items():
+            size += _sizeof(k, seen) + _sizeof(v, seen)
+    elif isinstance(obj, (list, tuple, set, frozenset)):
+        for x in obj:
+            size += _sizeof(x, seen)
+    return size
+
+
+def _after_fork_in_child():
+    """Called in the child process after fork(). Locks may have been
+    held by another thread of the parent at the time of fork() so we
+    recreate them. The parsed configuration (if any) is inherited as-is.
+    """
+    global _threading_lock
+    _threading_lock = threading.Lock()
+
+
+if hasattr(os, 'register_at_fork'):  # py3.7+
+    os.register_at_fork(after_in_child=_after_fork_in_child)
+
+
+def _restore_defaults():
+    """Reset the attributes of all conf classes to the default values
+    they had when they were register()ed.
+    """
+    global _path_index
+    _path_index = None
+    for section, defaults in _defaults_map.items():
+        conf_class = _conf_map[section]
+        for key, value in defaults.items():
+            setattr(conf_class, key, value)
+
+
+_PLAIN_TYPES = frozenset((bool, int, float, str, type(None), list, dict,
+                          tuple))
+
+
+def _class_defaults(klass):
+    """Same as dict(klass) for a register()ed class but linear: it
+    looks at the __dict__ of the classes in the MRO instead of sorting
+    dir().
+    """
+    ret = {}
+    seen = set()
+    for base in klass.__mro__:
+        if base is object:
+            continue
+        for key in vars(base):
+            if key in seen or key.startswith('_'):
+                continue
+            seen.add(key)
+            try:
+                value = getattr(klass, key)
+            except AttributeError:
+                continue
+            # fast path for the most common types
+            if type(value) in _PLAIN_TYPES or not _isroutine(value):
+                ret[key] = value
+    return ret
+
+
+def _class_values(section):
+    """Return the current {key: value} of a conf class. Faster than
+    dict(conf_class) as setting keys are known already.
+    """
+    conf_class = _conf_map[section]
+    return dict((key, getattr(conf_class, key))
+                for key in _defaults_map[section])
+
+
+def _get_schema_keys(section):
+    """Return the setting keys of *section* whose default value is a
+    schema(), so that run_last_schemas() does not have to look at all
+    the keys.
+    """
+    try:
+        return _schema_keys_map[section]
+    except KeyError:
+        keys = [k for k, v in _defaults_map[section].items()
+                if isinstance(v, schema)]
+        _schema_keys_map[section] = keys
+        return keys
+
+
+def _get_values():
+    """Return the current {section: {key: value}} of all conf classes."""
+    return dict((section, _class_values(section)) for section in _conf_map)
+
+
+def _set_values(values):
+    """Set the {section: {key: value}} values on the conf classes."""
+    global _path_index
+    _path_index = None
+    for section, dct in values.items():
+        conf_class = _conf_map[section]
+        for key, value in dct.items():
+            setattr(conf_class, key, value)
+
+
+def _apply_values(values):
+    """Set the {section: {key: value}} values of an already validated
+    configuration (e.g. coming from another process) on the conf
+    classes and mark configuration as parsed, without running the parse
+    pipeline. As the values don't come from parse(), reload() has
+    nothing to re-parse afterwards (unless a conf_file is passed to it).
+    """
+    global _parsed, _parsed_pid
+    for section, dct in values.items():
+        if section not in _defaults_map:
+            raise UnrecognizedSettingKeyError(None, section, dct)
+        defaults = _defaults_map[section]
+        for key, value in dct.items():
+            if key not in defaults:
+                raise UnrecognizedSettingKeyError(section, key, value)
+    _set_values(values)
+    _last_parse_kwargs.clear()
+    _parsed = True
+    _parsed_pid = os.getpid()
+
+
+def _schema_fingerprint():
+    """Return a digest identifying the registered conf classes (their
+    sections, setting keys and default value types), used to verify
+    that a serialized configuration matches the conf classes it is
+    loaded into.
+    """
+    global _fingerprint
+    if _fingerprint is None:
+        import hashlib
+        h = hashlib.sha1()
+        for section in sorted(_defaults_map, key=lambda x: x or ''):
+            h.update(("[%s]" % section).encode('utf8'))
+            defaults = _defaults_map[section]
+            for key in sorted(defaults):
+                value = defaults[key]
+                typecode = ''
+                if isinstance(value, schema):
+                    typecode = value.array or ''
+                    value = value.default
+                h.update(("%s:%s%s;" % (key, type(value).__name__,
+                                        typecode)).encode('utf8'))
+        _fingerprint = h.digest()
+    return _fingerprint
+
+
+def _dump_snapshot():
+    import pickle
+    return _SNAPSHOT_MAGIC + _schema_fingerprint() + pickle.dumps(
+        _get_values(), pickle.HIGHEST_PROTOCOL)
+
+
+def _load_snapshot(data):
+    """Deserialize bytes returned by _dump_snapshot() and return a
+    {section: {key: value}} dict.
+    """
+    import pickle
+    if not data.startswith(_SNAPSHOT_MAGIC):
+        raise Error("not a confix snapshot")
+    start = len(_SNAPSHOT_MAGIC)
+    fingerprint = _schema_fingerprint()
+    if data[start:start + len(fingerprint)] != fingerprint:
+        raise Error("snapshot was taken with different configuration "
+                    "classes than the ones currently registered")
+    return pickle.loads(data[start + len(fingerprint):])
+
+
 @contextlib.contextmanager
 def _lock_ctx():
+    # Configuration state is per-process (a forked child gets a copy of
+    # it and recreates the lock, see _after_fork_in_child()), so a
+    # thread lock is enough; a multiprocessing lock would also import
+    # multiprocessing, pickle and socket on the first register().
     with _threading_lock:
-        with _multiprocessing_lock:
-            yield
+        yield
 
 
 # =============================================================================
@@ -240,7 +589,7 @@ def isin(seq):
                 "expected a value amongst %r, got %r" % (seq, value))
         return True
 
-    if not isinstance(seq, collections.Iterable):
+    if not isinstance(seq, _Iterable):
         raise TypeError("%r is not iterable" % (seq))
     if not seq:
         raise ValueError("%r sequence can't be empty" % (seq))
@@ -255,7 +604,7 @@ def isnotin(seq):
                 "expected a value not in %r sequence, got %r" % (seq, value))
         return True
 
-    if not isinstance(seq, collections.Iterable):
+    if not isinstance(seq, _Iterable):
         raise TypeError("%r is not iterable".format(seq))
     if not seq:
         raise ValueError("%r sequence can't be empty".format(seq))
@@ -266,7 +615,7 @@ def isemail(value):
     """Assert value is a valid email."""
     if not isinstance(value, basestring):
         raise ValidationError("expected a string, got %r" % value)
-    if re.match(_EMAIL_RE, value) is None:
+    if _get_regex('email').match(value) is None:
         raise ValidationError("not a valid email")
     return True
 
@@ -278,7 +627,7 @@ def isurl(value):
     """
     if not isinstance(value, basestring):
         raise ValidationError("expected a string, got %r" % value)
-    if re.match(_URL_RE, value) is None:
+    if _get_regex('url').match(value) is None:
         raise ValidationError("not a valid URL")
     return True
 
@@ -337,9 +686,59 @@ def isip6(value):
 # =============================================================================
 
 
-def parse_yaml(file):
+def parse_yaml(file, document=None):
+    """Parse a YAML file. If it contains multiple documents, *document*
+    selects one, either by index (int) or as a (key, value) tuple
+    matching the first document whose top level *key* is equal to
+    *value*, e.g. ('env', 'prod'). The stream is parsed lazily: only
+    the selected document is constructed into Python objects and the
+    documents which follow it are not read at all.
+    """
     import yaml  # requires pip install pyyaml
-    return yaml.load(file)
+    # PyYAML >= 5.1 wants an explicit Loader
+    loader_class = getattr(yaml, 'FullLoader', yaml.Loader)
+    if document is None:
+        return yaml.load(file, Loader=loader_class)
+    if isinstance(document, int):
+        if document < 0:
+            raise ValueError("negative YAML document index %r" % document)
+    elif not (isinstance(document, tuple) and len(document) == 2):
+        raise TypeError("document must be an int or a (key, value) tuple")
+    loader = loader_class(file)
+    try:
+        index = 0
+        while loader.check_node():
+            node = loader.get_node()
+            if isinstance(document, int):
+                found = index == document
+            else:
+                found = _yaml_node_matches(loader, node, *document)
+            if found:
+                return loader.construct_document(node)
+            index += 1
+    finally:
+        loader.dispose()
+    raise Error("no YAML document matching %r in %r" % (
+        document, getattr(file, 'name', file)))
+
+
+def _yaml_node_matches(loader, node, key, value):
+    """Return True if the composed (not yet constructed) YAML document
+    *node* is a mapping whose *key* is equal to *value*. Only that
+    value is constructed.
+    """
+    import yaml
+    if not isinstance(node, yaml.MappingNode):
+        return False
+    for key_node, value_node in node.value:
+        if (isinstance(key_node, yaml.ScalarNode) and
+                key_node.value == key):
+            try:
+                return loader.construct_object(value_node, deep=True) == value
+            finally:
+                loader.constructed_objects = {}
+                loader.recursive_objects = {}
+    return False
 
 
 def parse_toml(file):
@@ -348,6 +747,7 @@ def parse_toml(file):
 
 
 def parse_json(file):
+    import json
     content = file.read()
     if not content.strip():
         # empty JSON file; do not explode in order to be consistent with
@@ -357,8 +757,17 @@ def parse_json(file):
 
 
 def parse_ini(file):
+    try:
+        import configparser  # py3
+    except ImportError:
+        import ConfigParser as configparser
     config = configparser.ConfigParser()
-    config.read(file.name)
+    # read from the file object rather than its name, which may not
+    # be a path on disk (e.g. HTTPSource)
+    if hasattr(config, 'read_file'):  # py3
+        config.read_file(file)
+    else:
+        config.readfp(file)
     ret = {}
     for section, values in config._sections.items():
         ret[section] = {}
@@ -368,29 +777,923 @@ def parse_ini(file):
     return ret
 
 
+# {file extension: parser or "module:function" string (imported on
+# first use)}
+_parsers = {'.yaml': parse_yaml,
+            '.yml': parse_yaml,
+            '.toml': parse_toml,
+            '.json': parse_json,
+            '.ini': parse_ini}
+_entry_points_loaded = False
+_ENTRY_POINTS_GROUP = 'confix.parsers'
+# number of chars read from nameless streams in order to guess their
+# format
+_SNIFF_SIZE = 1024
+
+# {Content-Type: file extension} used by HTTPSource
+_content_types = {
+    'application/json': '.json',
+    'application/yaml': '.yaml',
+    'application/x-yaml': '.yaml',
+    'text/yaml': '.yaml',
+    'text/x-yaml': '.yaml',
+    'application/toml': '.toml',
+    'text/x-toml': '.toml',
+}
+
+
+def _sniff_lines(head):
+    """Return the non blank, non comment lines of *head*, excluding
+    the last one if it was truncated.
+    """
+    lines = head.splitlines()
+    if len(head) >= _SNIFF_SIZE:
+        lines = lines[:-1]
+    return [x.strip() for x in lines
+            if x.strip() and not x.lstrip().startswith(('#', ';'))]
+
+
+def _sniff_json(head):
+    head = head.lstrip()
+    if head.startswith('{'):
+        return True
+    lines = _sniff_lines(head)
+    return (head.startswith('[') and bool(lines) and
+            not _get_regex('section_header').match(lines[0]))
+
+
+def _sniff_toml(head):
+    lines = _sniff_lines(head)
+    if not lines:
+        return False
+    for line in lines:
+        if _get_regex('section_header').match(line):
+            continue
+        if not _get_regex('toml_pair').match(line):
+            return False
+    return True
+
+
+def _sniff_ini(head):
+    lines = _sniff_lines(head)
+    return bool(lines) and bool(_get_regex('section_header').match(lines[0]))
+
+
+def _sniff_yaml(head):
+    lines = _sniff_lines(head)
+    return bool(lines) and bool(_get_regex('yaml_start').match(lines[0]))
+
+
+# [(file extension, sniff function)] tried in order against the first
+# chars of nameless streams; user defined ones come first
+_sniffers = [('.json', _sniff_json),
+             ('.toml', _sniff_toml),
+             ('.ini', _sniff_ini),
+             ('.yaml', _sniff_yaml)]
+
+
+def _normalize_ext(ext):
+    return ext if ext.startswith('.') else '.' + ext
+
+
+def _import_object(path):
+    """Import and return an object given a "module:attr" string."""
+    import importlib
+    modname, _, attrs = path.partition(':')
+    obj = importlib.import_module(modname)
+    for attr in attrs.split('.') if attrs else ():
+        obj = getattr(obj, attr)
+    return obj
+
+
+def _load_entry_points():
+    """Add the parsers advertised by installed packages via the
+    "confix.parsers" entry point group (name is the file extension,
+    value is "module:function"). Parsers registered via
+    register_parser() take precedence. This is done once, only when
+    a file extension is not known, as listing entry points is slow.
+    """
+    global _entry_points_loaded
+    if _entry_points_loaded:
+        return
+    _entry_points_loaded = True
+    try:
+        from importlib import metadata  # py3.8+
+    except ImportError:
+        try:
+            import pkg_resources
+        except ImportError:
+            return
+        eps = [(ep.name, "%s:%s" % (ep.module_name, '.'.join(ep.attrs)))
+               for ep in pkg_resources.iter_entry_points(_ENTRY_POINTS_GROUP)]
+    else:
+        eps = metadata.entry_points()
+        if hasattr(eps, 'select'):  # py3.10+
+            eps = eps.select(group=_ENTRY_POINTS_GROUP)
+        else:
+            eps = eps.get(_ENTRY_POINTS_GROUP, [])
+        eps = [(ep.name, ep.value) for ep in eps]
+    for name, value in eps:
+        _parsers.setdefault(_normalize_ext(name), value)
+
+
+def _get_parser(ext):
+    """Return the parser for a file extension, importing it if it was
+    registered as a "module:function" string. Raise KeyError if the
+    extension is not supported.
+    """
+    try:
+        parser = _parsers[ext]
+    except KeyError:
+        _load_entry_points()
+        parser = _parsers[ext]
+    if isinstance(parser, basestring):
+        parser = _parsers[ext] = _import_object(parser)
+    return parser
+
+
+def _sniff(file):
+    """Guess the format of a stream with no file name (or no known
+    extension) by looking at its first chars. Return a (file extension,
+    file) tuple; the returned file is a new one if *file* is not
+    seekable. The extension is None if the format was not recognized.
+    """
+    import io
+    try:
+        seekable = file.seekable()
+    except (AttributeError, ValueError):
+        seekable = False
+    if seekable:
+        pos = file.tell()
+        head = file.read(_SNIFF_SIZE)
+        file.seek(pos)
+    else:
+        content = file.read()
+        head = content[:_SNIFF_SIZE]
+    if isinstance(head, bytes):
+        head = head.decode('utf8', 'replace')
+        # parsers want text
+        if seekable:
+            content = file.read()
+        file = io.StringIO(content.decode('utf8'))
+    elif not seekable:
+        file = io.StringIO(content)
+    for ext, fun in _sniffers:
+        if fun(head):
+            return ext, file
+    return None, file
+
+
+def register_parser(ext, parser, sniff=None, content_types=()):
+    """Register a parser for files with a given extension (e.g. ".hcl"),
+    overriding the existing one, if any.
+    *parser* is a function accepting a file object and returning a
+    dict, or a "module:function" string, in which case the module is
+    imported only when such a file is parsed for the first time (so
+    that it doesn't slow down "import confix").
+    *sniff* is an optional function which is passed the first chars
+    (str) of a stream with no name or extension and returns True if
+    the content is in this format.
+    *content_types* is a list of MIME types associated with this format
+    (see HTTPSource).
+    Parsers can also be provided by installed packages via the
+    "confix.parsers" entry point group.
+    """
+    ext = _normalize_ext(ext)
+    with _lock_ctx():
+        _parsers[ext] = parser
+        if sniff is not None:
+            _sniffers[:] = [x for x in _sniffers if x[0] != ext]
+            _sniffers.insert(0, (ext, sniff))
+        for content_type in content_types:
+            _content_types[content_type.lower()] = ext
+
+
+# =============================================================================
+# config sources
+# =============================================================================
+
+
+class HTTPSource(object):
+    """A configuration file served over HTTP(S) which can be passed to
+    parse() as *conf_file*.
+    The connection is kept open and reused. The ETag / Last-Modified
+    headers of the last response are sent back as If-None-Match /
+    If-Modified-Since so that, if the configuration did not change,
+    the server replies with "304 Not Modified" and reload() does not
+    deserialize and validate the configuration again.
+    The file format is determined by the Content-Type of the response
+    (or the extension of the URL path).
+    If *cache_file* is specified the last successfully fetched body is
+    stored there and used if the server can't be reached (e.g. on
+    startup).
+    """
+
+    def __init__(self, url, cache_file=None, timeout=10.0, headers=None):
+        try:
+            from urllib.parse import urlsplit  # py3
+        except ImportError:
+            from urlparse import urlsplit
+        try:
+            import http.client as httplib  # py3
+        except ImportError:
+            import httplib
+        self._httplib = httplib
+        # errors meaning the server can't be reached
+        self._errors = (EnvironmentError, httplib.HTTPException)
+        parts = urlsplit(url)
+        if parts.scheme not in ('http', 'https'):
+            raise ValueError("unsupported URL scheme %r" % parts.scheme)
+        self.url = url
+        self.cache_file = cache_file
+        self.timeout = timeout
+        self.headers = dict(headers or {})
+        self._scheme = parts.scheme
+        self._netloc = parts.netloc
+        self._path = parts.path or '/'
+        if parts.query:
+            self._path += '?' + parts.query
+        self._url_name = parts.path
+        self._conn = None
+        self._pid = None
+        self._body = None
+        self._etag = None
+        self._last_modified = None
+        self._content_type = None
+        # True if the body was fetched by poll() but not parsed yet
+        self._pending = False
+        if cache_file is not None:
+            self._load_cache()
+
+    def __repr__(self):
+        return "<%s url=%r>" % (self.__class__.__name__, self.url)
+
+    # --- internal
+
+    def _connect(self):
+        httplib = self._httplib
+        if self._scheme == 'https':
+            klass = httplib.HTTPSConnection
+        else:
+            klass = httplib.HTTPConnection
+        return klass(self._netloc, timeout=self.timeout)
+
+    def _request(self):
+        headers = {'Accept': ', '.join(sorted(_content_types)) + ', */*'}
+        headers.update(self.headers)
+        if self._body is not None:
+            if self._etag:
+                headers['If-None-Match'] = self._etag
+            if self._last_modified:
+                headers['If-Modified-Since'] = self._last_modified
+        # a kept-alive connection may have been closed by the server
+        # in the meantime: in that case retry once with a new one
+        for attempt in (0, 1):
+            # connections can't be shared with forked children
+            if self._conn is None or self._pid != os.getpid():
+                self._conn = self._connect()
+                self._pid = os.getpid()
+            try:
+                self._conn.request('GET', self._path, headers=headers)
+                resp = self._conn.getresponse()
+                body = resp.read()
+            except self._errors:
+                self._conn.close()
+                self._conn = None
+                if attempt:
+                    raise
+            else:
+                if resp.getheader('connection', '').lower() == 'close':
+                    self._conn.close()
+                    self._conn = None
+                return resp, body
+
+    def _load_cache(self):
+        import json
+        try:
+            with open(self.cache_file, 'r') as f:
+                data = json.load(f)
+        except (IOError, OSError, ValueError):
+            return
+        if data.get('url') != self.url:
+            return
+        self._body = data['body'].encode('utf8')
+        self._etag = data.get('etag')
+        self._last_modified = data.get('last_modified')
+        self._content_type = data.get('content_type')
+
+    def _save_cache(self):
+        import json
+        data = dict(url=self.url, etag=self._etag,
+                    last_modified=self._last_modified,
+                    content_type=self._content_type,
+                    body=self._body.decode('utf8'))
+        tmp = self.cache_file + '.tmp'
+        with open(tmp, 'w') as f:
+            json.dump(data, f)
+        getattr(os, 'replace', os.rename)(tmp, self.cache_file)
+
+    # --- source protocol
+
+    def poll(self):
+        """Send a (conditional) GET request. Return True if a new
+        configuration was received or False if the server replied with
+        "304 Not Modified".
+        If the server can't be reached and a cached body is available
+        return False, else raise Error.
+        """
+        try:
+            resp, body = self._request()
+        except self._errors as err:
+            if self._body is not None:
+                if _tracing():
+                    _trace('source_error', source=self, error=err)
+                return False
+            raise Error("can't fetch %s: %s" % (self.url, err))
+        if resp.status == 304:
+            return False
+        if resp.status != 200:
+            if self._body is not None:
+                return False
+            raise Error("can't fetch %s: HTTP status %s %s" % (
+                self.url, resp.status, resp.reason))
+        self._body = body
+        self._etag = resp.getheader('etag')
+        self._last_modified = resp.getheader('last-modified')
+        self._content_type = resp.getheader('content-type')
+        self._pending = True
+        if self.cache_file is not None:
+            self._save_cache()
+        return True
+
+    def open(self):
+        """Return the configuration as a file object whose name has
+        the extension matching its Content-Type, so that the parser can
+        be picked up by parse().
+        """
+        import io
+        if not self._pending:
+            self.poll()
+        self._pending = False
+        content_type = (self._content_type or '').split(';')[0].strip()
+        ext = _content_types.get(content_type.lower())
+        file = io.StringIO(self._body.decode('utf8'))
+        if ext is not None:
+            file.name = 'http' + ext
+        else:
+            file.name = self._url_name
+        return file
+
+    def close(self):
+        """Close the HTTP connection."""
+        if self._conn is not None:
+            self._conn.close()
+            self._conn = None
+
+
+class _SQLiteMapping(_Mapping):
+    """A read-only dict-like setting value whose items are looked up
+    in the SQLite database (via the primary key index) on access, see
+    SQLiteSource.
+    """
+
+    def __init__(self, source, section, key):
+        self._source = source
+        self._section = section
+        self._key = key
+
+    def __repr__(self):
+        return "<%s %s.%s>" % (self.__class__.__name__,
+                               self._section or '', self._key)
+
+    def _query(self, sql, *args):
+        return self._source._query(
+            sql, (self._section or '', self._key) + args)
+
+    def __getitem__(self, subkey):
+        import json
+        rows = self._query(
+            "SELECT value FROM confix_maps "
+            "WHERE section = ? AND key = ? AND subkey = ?", subkey)
+        if not rows:
+            raise KeyError(subkey)
+        return json.loads(rows[0][0])
+
+    def __contains__(self, subkey):
+        return bool(self._query(
+            "SELECT 1 FROM confix_maps "
+            "WHERE section = ? AND key = ? AND subkey = ?", subkey))
+
+    def __iter__(self):
+        rows = self._query(
+            "SELECT subkey FROM confix_maps "
+            "WHERE section = ? AND key = ? ORDER BY subkey")
+        return iter([x[0] for x in rows])
+
+    def __len__(self):
+        return self._query(
+            "SELECT COUNT(*) FROM confix_maps "
+            "WHERE section = ? AND key = ?")[0][0]
+
+    def __eq__(self, other):
+        if isinstance(other, _SQLiteMapping):
+            return (self._source is other._source and
+                    self._section == other._section and
+                    self._key == other._key)
+        return _Mapping.__eq__(self, other)
+
+    def __ne__(self, other):
+        return not self == other
+
+    __hash__ = None
+
+    def __reduce__(self):
+        # pickled (e.g. by snapshot()) as a plain dict
+        return (dict, (dict(self.items()), ))
+
+
+class SQLiteSource(object):
+    """A configuration stored in a SQLite database which can be passed
+    to parse() as *conf_file*, meant for very large configurations.
+    Setting keys live in an indexed table, one row per key, holding
+    JSON encoded values. Dict values written with write(lazy=...) are
+    stored one row per item and are loaded as read-only Mappings which
+    query the database on access, so they are never fully loaded in
+    memory. They are accepted where the default value is a dict.
+    """
+
+    _SCHEMA = """
+        CREATE TABLE IF NOT EXISTS confix_values (
+            section TEXT NOT NULL,
+            key TEXT NOT NULL,
+            value TEXT NOT NULL,
+            PRIMARY KEY (section, key));
+        CREATE TABLE IF NOT EXISTS confix_maps (
+            section TEXT NOT NULL,
+            key TEXT NOT NULL,
+            subkey TEXT NOT NULL,
+            value TEXT NOT NULL,
+            PRIMARY KEY (section, key, subkey));
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._conn = None
+        self._pid = None
+        self._data_version = None
+        self._lock = threading.Lock()
+
+    def __repr__(self):
+        return "<%s path=%r>" % (self.__class__.__name__, self.path)
+
+    # --- internal
+
+    def _get_conn(self):
+        # connections can't be shared with forked children
+        if self._conn is None or self._pid != os.getpid():
+            import sqlite3
+            self._conn = sqlite3.connect(self.path, check_same_thread=False)
+            self._conn.executescript(self._SCHEMA)
+            self._pid = os.getpid()
+        return self._conn
+
+    def _query(self, sql, args=()):
+        with self._lock:
+            return self._get_conn().execute(sql, args).fetchall()
+
+    def _get_data_version(self):
+        # changes every time another connection commits
+        return self._query("PRAGMA data_version")[0][0]
+
+    # --- source protocol
+
+    def poll(self):
+        """Return True if the database was modified (by another
+        connection) since the configuration was last loaded.
+        """
+        return self._get_data_version() != self._data_version
+
+    def load(self):
+        """Return the configuration as a dict."""
+        import json
+        ret = {}
+        with self._lock:
+            conn = self._get_conn()
+            self._data_version = conn.execute(
+                "PRAGMA data_version").fetchone()[0]
+            for section, key, value in conn.execute(
+                    "SELECT section, key, value FROM confix_values"):
+                dct = ret if not section else ret.setdefault(section, {})
+                dct[key] = json.loads(value)
+            for section, key in conn.execute(
+                    "SELECT DISTINCT section, key FROM confix_maps"):
+                dct = ret if not section else ret.setdefault(section, {})
+                dct[key] = _SQLiteMapping(self, section or None, key)
+        return ret
+
+    def write(self, section, values, lazy=()):
+        """Store the {key: value} *values* of *section* (None for the
+        root section) replacing existing ones. Keys listed in *lazy*
+        must have dict values and are stored one row per item.
+        """
+        import json
+        rows = []
+        map_rows = []
+        section_ = section or ''
+        for key, value in values.items():
+            if key in lazy:
+                if not isinstance(value, dict):
+                    raise TypeError("%r value is not a dict" % key)
+                map_rows.extend((section_, key, str(k), json.dumps(v))
+                                for k, v in value.items())
+            else:
+                rows.append((section_, key, json.dumps(value)))
+        with self._lock:
+            conn = self._get_conn()
+            with conn:  # transaction
+                # a key may have been stored the other way before, and
+                # a lazy map may have had more items
+                for table in ('confix_values', 'confix_maps'):
+                    conn.executemany(
+                        "DELETE FROM %s WHERE section = ? AND key = ?" %
+                        table, [(section_, key) for key in values])
+                conn.executemany(
+                    "INSERT OR REPLACE INTO confix_values VALUES (?, ?, ?)",
+                    rows)
+                conn.executemany(
+                    "INSERT OR REPLACE INTO confix_maps VALUES (?, ?, ?, ?)",
+                    map_rows)
+            # our own commits don't change data_version
+            self._data_version = None
+
+    def close(self):
+        """Close the database connection."""
+        with self._lock:
+            if self._conn is not None:
+                self._conn.close()
+                self._conn = None
+
+
+# =============================================================================
+# coercers
+# =============================================================================
+
+# Coercers convert strings (coming from env vars and INI files) into the
+# type of the default value of a setting key. They are called as
+# fun(raw_value, default_value) and are supposed to raise ValueError or
+# TypeError if the string can't be converted.
+
+
+def _coerce_bool(value, default):
+    lvalue = value.lower()
+    if lvalue in _STR_BOOL_TRUE:
+        return True
+    if lvalue in _STR_BOOL_FALSE:
+        return False
+    raise ValueError("not a boolean: %r" % value)
+
+
+def _coerce_int(value, default):
+    return int(value)
+
+
+def _coerce_float(value, default):
+    return float(value)
+
+
+def _coerce_seq(item_coercer, item_default, seq_type, value, default):
+    # comma separated values; items are coerced to the type of the
+    # first item of the default sequence (if any)
+    if not value.strip():
+        return seq_type()
+    items = [x.strip() for x in value.split(',')]
+    if item_coercer is not None:
+        items = [item_coercer(x, item_default) for x in items]
+    return seq_type(items)
+
+
+def _coerce_dict(value, default):
+    import json
+    ret = json.loads(value)
+    if not isinstance(ret, dict):
+        raise ValueError("not a JSON object: %r" % value)
+    return ret
+
+
+def _coerce_decimal(value, default):
+    import decimal
+    try:
+        return decimal.Decimal(value)
+    except decimal.InvalidOperation:
+        raise ValueError("not a decimal: %r" % value)
+
+
+def _coerce_datetime(value, default):
+    # datetime.fromisoformat() is py3.7+
+    return type(default).fromisoformat(value)
+
+
+def _coerce_path(value, default):
+    return type(default)(value)
+
+
+def _coerce_enum(value, default):
+    # by member name first, then by value
+    klass = type(default)
+    try:
+        return klass[value]
+    except KeyError:
+        return klass(value)
+
+
+# Keys are either types or "module.qualname" strings; the latter avoid
+# importing modules (e.g. decimal) just to check the type of a value.
+_coercers = {
+    bool: _coerce_bool,
+    int: _coerce_int,
+    float: _coerce_float,
+    list: list,  # see _resolve_coercer()
+    tuple: tuple,  # see _resolve_coercer()
+    dict: _coerce_dict,
+    'decimal.Decimal': _coerce_decimal,
+    'datetime.date': _coerce_datetime,
+    'datetime.datetime': _coerce_datetime,
+    'datetime.time': _coerce_datetime,
+    'pathlib.PurePath': _coerce_path,
+    'enum.Enum': _coerce_enum,
+    # these inherit from int, which comes first in the MRO
+    'enum.IntEnum': _coerce_enum,
+    'enum.IntFlag': _coerce_enum,
+}
+
+
+# {type: coercer} lookup cache; cleared by register_coercer()
+_coercers_cache = {}
+
+
+def _resolve_class_name(name):
+    """Return the object named "module.qualname" if its module was
+    imported already, else None (a value can't be an instance of a
+    class whose module was never imported).
+    """
+    parts = name.split('.')
+    for i in range(len(parts) - 1, 0, -1):
+        obj = sys.modules.get('.'.join(parts[:i]))
+        if obj is not None:
+            for attr in parts[i:]:
+                obj = getattr(obj, attr, None)
+            return obj
+    return None
+
+
+def _lookup_coercer(klass):
+    try:
+        return _coercers_cache[klass]
+    except KeyError:
+        pass
+    # A class may be exposed under a name other than its __module__
+    # (e.g. pathlib.PurePath is defined in pathlib._local on Python
+    # 3.13), so "module.qualname" keys are also resolved to classes.
+    named = {}
+    for key, fun in _coercers.items():
+        if isinstance(key, basestring):
+            obj = _resolve_class_name(key)
+            if isinstance(obj, _CLASS_TYPES):
+                named.setdefault(obj, fun)
+    ret = None
+    for base in getattr(klass, '__mro__', (klass, )):
+        if base in _coercers:
+            ret = _coercers[base]
+            break
+        name = "%s.%s" % (base.__module__,
+                          getattr(base, '__qualname__', base.__name__))
+        if name in _coercers:
+            ret = _coercers[name]
+            break
+        if base in named:
+            ret = named[base]
+            break
+    _coercers_cache[klass] = ret
+    return ret
+
+
+def _resolve_coercer(default):
+    """Return the coercer function for a setting key given its default
+    value, or None (strings are left unmodified).
+    """
+    if isinstance(default, schema):
+        default = default.default
+    if default is None:
+        return None
+    fun = _lookup_coercer(type(default))
+    if fun in (list, tuple):
+        item_default = default[0] if default else None
+        item_coercer = None if item_default is None else \
+            _resolve_coercer(item_default)
+        fun = functools.partial(_coerce_seq, item_coercer, item_default, fun)
+    return fun
+
+
+def _get_coercers(section):
+    """Return a {key: coercer} dict for the setting keys of *section*
+    which need to be converted from strings. Coercers are resolved
+    once per registered class.
+    """
+    try:
+        return _coercers_map[section]
+    except KeyError:
+        pass
+    coercers = {}
+    for key, value in _defaults_map[section].items():
+        fun = _resolve_coercer(value)
+        if fun is not None:
+            coercers[key] = fun
+    _coercers_map[section] = coercers
+    return coercers
+
+
+def register_coercer(type_, fun):
+    """Register a function which converts strings coming from env
+    vars and INI files into *type_* (which is the type of the default
+    value of a setting key, or one of its base classes). It is called
+    as fun(raw_value, default_value) and is supposed to raise
+    ValueError or TypeError if the conversion is not possible.
+    *type_* can also be a "module.ClassName" string in order to avoid
+    importing the module (it matches the class defined with that
+    __module__ or exposed under that name by the module).
+    Coercers are resolved once per configuration class, the first
+    time a string value has to be converted, so this is supposed to be
+    called before parse().
+    """
+    if not callable(fun):
+        raise TypeError("%r is not callable" % fun)
+    with _lock_ctx():
+        _coercers[type_] = fun
+        _coercers_cache.clear()
+
+
+# =============================================================================
+# code generation
+# =============================================================================
+
+
+def _validation_error(err, section, key, value):
+    exc = ValidationError(err.msg if err is not None else None)
+    exc.section = section
+    exc.key = key
+    exc.value = value
+    return exc
+
+
+def _section_specs(section):
+    """Return a {key: spec} dict for the setting keys of *section*,
+    where spec is a (default, coerce, types, loose_types, validators,
+    array) tuple:
+
+    - coerce: whether values coming from INI files have to be cast
+    - types: the exact types accepted by the type check (None if the
+      value is not type checked, e.g. schema() or None defaults)
+    - loose_types: types checked via isinstance() if the exact check
+      fails (str and unicode are the same thing on Python 2)
+    - validators: a tuple of (validator, name) pairs
+    - array: whether the value is converted via schema(array=...)
+    """
+    coercers = _get_coercers(section)
+    specs = {}
+    for key, default in _defaults_map[section].items():
+        types = None
+        loose = ()
+        validators = ()
+        array = False
+        if isinstance(default, schema):
+            funs = default.validator
+            if funs is None:
+                funs = ()
+            elif not isinstance(funs, _Iterable):
+                funs = (funs, )
+            validators = tuple((fun, _callable_name(fun)) for fun in funs)
+            array = default.array is not None
+        elif default is not None:
+            types = (type(default), )
+            if not _PY3 and isinstance(default, basestring):
+                loose = (basestring, )
+            elif isinstance(default, dict):
+                # lazily loaded dict (see SQLiteSource)
+                types += (_SQLiteMapping, )
+        specs[key] = (default, key in coercers, types, loose, validators,
+                      array)
+    return specs
+
+
+def _gen_section_source(section):
+    """Return the source code of a function which processes the values
+    of *section* as found in the config file, plus the namespace it
+    needs. The per-key type checks and validators are precomputed in
+    a {key: spec} table (see _section_specs()) and the branches which
+    no key of the class needs (casting, validators, arrays) are left
+    out, so there is no isinstance(schema) check, no method call and
+    no timer call per key (validators aside). The source has the same
+    size whatever the number of keys, so generating it is cheap.
+    The generated function passes the processed values to
+    store(key, value), returns the number of keys processed and passes
+    the validator timings to *stats* in one go at the end.
+    """
+    specs = _section_specs(section)
+    has_coercers = any(spec[1] for spec in specs.values())
+    has_validators = any(spec[4] for spec in specs.values())
+    has_arrays = any(spec[5] for spec in specs.values())
+    ns = dict(_section=section, _specs=specs, _timer=_timer,
+              TypesMismatchError=TypesMismatchError,
+              UnrecognizedSettingKeyError=UnrecognizedSettingKeyError,
+              ValidationError=ValidationError,
+              _validation_error=_validation_error, _to_array=_to_array)
+    lines = [
+        "def process(new_values, type_check, cast, stats, store, "
+        "_specs=_specs, _timer=_timer):",
+        "    started = _timer()",
+        "    times = []",
+        "    add_time = times.append",
+        "    for key, value in new_values.items():",
+        "        try:",
+        "            default, coerce, types, loose, validators, array = "
+        "_specs[key]",
+        "        except KeyError:",
+        "            raise UnrecognizedSettingKeyError(_section, key, value)",
+    ]
+    add = lines.append
+    if has_coercers:
+        add("        if coerce and cast is not None:")
+        add("            value = cast(_section, key, default, value)")
+    add("        if (types is not None and type_check and value is not None "
+        "and")
+    add("                type(value) not in types and")
+    add("                not isinstance(value, loose)):")
+    add("            raise TypesMismatchError(_section, key, default, value)")
+    if has_validators:
+        add("        for fun, name in validators:")
+        add("            t = _timer()")
+        add("            try:")
+        add("                ok = fun(value)")
+        add("            except ValidationError as err:")
+        add("                raise _validation_error(err, _section, key, "
+            "value)")
+        add("            finally:")
+        add("                add_time((name, _timer() - t))")
+        add("            if not ok:")
+        add("                raise _validation_error(None, _section, key, "
+            "value)")
+    if has_arrays:
+        add("        if array:")
+        add("            value = _to_array(default, _section, key, value, "
+            "type_check)")
+    add("        store(key, value)")
+    add("    stats._add_compiled(_timer() - started, times)")
+    add("    return len(new_values)")
+    return "\n".join(lines) + "\n", ns
+
+
+def _compile_section(section):
+    """Generate and compile() the processing function of *section*."""
+    source, ns = _gen_section_source(section)
+    try:
+        code = _compiled_code[source]
+    except KeyError:
+        code = _compiled_code[source] = compile(
+            source, '<confix compiled>', 'exec')
+    exec(code, ns)
+    fun = ns['process']
+    fun.source = source
+    return fun
+
+
 # =============================================================================
 # rest of public API
 # =============================================================================
 
 
 class schema(collections.namedtuple('field',
-             ['default', 'required', 'validator'])):
+             ['default', 'required', 'validator', 'array'])):
 
-    def __new__(cls, default=_DEFAULT, required=False, validator=None):
+    def __new__(cls, default=_DEFAULT, required=False, validator=None,
+                array=None):
         if not required and default is _DEFAULT:
             raise ValueError("specify a default value or set required=True")
+        if array is not None and array not in _ARRAY_TYPECODES:
+            raise ValueError("invalid array typecode %r (must be one of %r)"
+                             % (array, _ARRAY_TYPECODES))
         if validator is not None:
-            if not isinstance(validator, collections.Iterable):
+            if not isinstance(validator, _Iterable):
                 if not callable(validator):
                     raise TypeError("%r is not callable" % validator)
             else:
                 for v in validator:
                     if not callable(v):
                         raise TypeError("%r is not callable" % v)
-        return super(schema, cls).__new__(cls, default, required, validator)
+        return super(schema, cls).__new__(
+            cls, default, required, validator, array)
 
 
-def register(section=None):
+def register(section=None, compiled=False):
     """A decorator which registers a configuration class which will
     be parsed later.
     If `section` is `None` it is assumed that the configuration file
@@ -399,14 +1702,23 @@ def register(section=None):
     All class attributes starting with an underscore will be ignored,
     same for methods, classmethods or any other non-callable type.
     A class decoratored with this method becomes dict()-able.
+    If *compiled* is True a function specialized for this class (with
+    type checks and validators precomputed per key) is generated on
+    first parse() and used instead of the generic processing code; it
+    pays off from roughly 10 keys per class.
     """
     class meta_wrapper(type):
 
         def __iter__(self):
             # this will make the class dict()able
-            for k, v in inspect.getmembers(self):
-                if not k.startswith('_') and not inspect.isroutine(v):
-                    yield (k, v)
+            for k in dir(self):
+                if not k.startswith('_'):
+                    try:
+                        v = getattr(self, k)
+                    except AttributeError:
+                        continue
+                    if not _isroutine(v):
+                        yield (k, v)
 
         def __getitem__(self, key):
             return getattr(self, key)
@@ -430,13 +1742,19 @@ def register(section=None):
         return new_class
 
     def wrapper(klass):
-        if not inspect.isclass(klass):
+        global _fingerprint
+        if not isinstance(klass, _CLASS_TYPES):
             raise TypeError("register decorator is supposed to be used "
                             "against a class (got %r)" % klass)
-        _log("registering %s.%s" % (klass.__module__, klass.__name__))
+        if _tracing():
+            _trace('register', section=section, klass=klass)
         with _lock_ctx():
             new_class = add_metaclass(klass)
             _conf_map[section] = new_class
+            _defaults_map[section] = _class_defaults(new_class)
+            if compiled:
+                _compiled_map[section] = None
+            _fingerprint = None
         return new_class
 
     with _lock_ctx():
@@ -447,6 +1765,7 @@ def register(section=None):
             msg = "configuration class defined after parse(); global " \
                   "configuration will not reflect it and it will remain " \
                   "unparsed"
+            import warnings
             warnings.warn(msg, UserWarning)
             return lambda klass: add_metaclass(klass)
 
@@ -469,44 +1788,453 @@ def register(section=None):
     return wrapper
 
 
-def get_parsed_conf():
-    """Return the whole parsed configuration as a dict.
+class ParseStats(object):
+    """Timings and counters collected while parsing the configuration.
+    An instance of this class is returned by get_parse_stats() and
+    passed to the *stats_callback* of parse() / parse_with_envvars().
+
+    - timings: an ordered dict mapping each phase of the parse pipeline
+      ('open', 'deserialize', 'envvars', 'dedup', 'interpolate',
+      'type_check', 'validators', 'process', 'last_schemas', 'total') to
+      the seconds spent in it.
+      'type_check' and 'validators' are sub-phases of 'process' and
+      'last_schemas'.
+    - validator_timings: a dict mapping each validator name to the
+      cumulative seconds spent running it.
+    - keys_processed: number of setting keys overridden by the config
+      file or env vars.
+    - validators_run: number of validator calls.
+    - dedup_saved_bytes: approximate memory saved by parse(dedup=True)
+      (0 if dedup was not used).
+    """
+
+    __slots__ = ('timings', 'validator_timings', 'keys_processed',
+                 'validators_run', 'dedup_saved_bytes')
+
+    _PHASES = ('open', 'deserialize', 'envvars', 'dedup', 'interpolate',
+               'type_check', 'validators', 'process', 'last_schemas',
+               'total')
+
+    def __init__(self):
+        self.timings = collections.OrderedDict(
+            (phase, 0.0) for phase in self._PHASES)
+        self.validator_timings = {}
+        self.keys_processed = 0
+        self.validators_run = 0
+        self.dedup_saved_bytes = 0
+
+    def __repr__(self):
+        return "<%s total=%.6fs keys_processed=%s validators_run=%s>" % (
+            self.__class__.__name__, self.timings['total'],
+            self.keys_processed, self.validators_run)
+
+    def _add(self, phase, secs):
+        self.timings[phase] += secs
+
+    def _add_validator(self, validator, secs):
+        name = _callable_name(validator)
+        self.validator_timings[name] = \
+            self.validator_timings.get(name, 0.0) + secs
+        self.validators_run += 1
+        self.timings['validators'] += secs
+
+    def _add_compiled(self, secs, times):
+        # Called by the functions generated for register(compiled=True)
+        # classes: *times* is a list of (validator name, secs) pairs and
+        # the time not spent in validators is accounted as type check.
+        vt = self.validator_timings
+        total = 0.0
+        for name, t in times:
+            vt[name] = vt.get(name, 0.0) + t
+            total += t
+        self.validators_run += len(times)
+        self.timings['validators'] += total
+        self.timings['type_check'] += secs - total
+
+    def as_dict(self):
+        """Return stats as a plain (JSON serializable) dict."""
+        return dict(timings=dict(self.timings),
+                    validator_timings=dict(self.validator_timings),
+                    keys_processed=self.keys_processed,
+                    validators_run=self.validators_run,
+                    dedup_saved_bytes=self.dedup_saved_bytes)
+
+
+def get_parse_stats():
+    """Return a ParseStats instance describing the last parse() call.
+    If parse() wasn't called yet it will raise NotParsedError.
+    """
+    with _lock_ctx():
+        if _last_stats is None:
+            raise NotParsedError
+        return _last_stats
+
+
+def _index_dict(index, prefix, dct):
+    for key, value in dct.items():
+        path = "%s.%s" % (prefix, key)
+        index[path] = value
+        if isinstance(value, dict):
+            _index_dict(index, path, value)
+
+
+def _build_path_index():
+    """Return a flat {"section.key": value} dict of the parsed
+    configuration, including nested dict values ("section.key.subkey")
+    and sections themselves ("section" -> dict).
+    """
+    index = {}
+    for section, conf_class in _conf_map.items():
+        values = dict(conf_class)
+        if section is not None:
+            index[section] = values
+        for key, value in values.items():
+            path = key if section is None else "%s.%s" % (section, key)
+            index[path] = value
+            if isinstance(value, dict):
+                _index_dict(index, path, value)
+    return index
+
+
+def get(path, default=_DEFAULT):
+    """Return the value of a setting key given its dotted path, e.g.
+    "section.key" (or just "key" for the root section). Nested dict
+    values can be accessed as "section.key.subkey".
+    If the path does not exist return *default* or raise KeyError if
+    no default is specified.
+    Lookups are served by a flat index which is built on first use
+    after every parse() / reload() / restore() and then shared (values
+    are not copied). Changes made by directly assigning attributes of
+    conf classes are not reflected.
+    If parse() wasn't called yet it will raise NotParsedError.
+    """
+    global _path_index
+    index = _path_index
+    if index is None:
+        with _lock_ctx():
+            if not _parsed:
+                raise NotParsedError
+            if _path_index is None:
+                _path_index = _build_path_index()
+            index = _path_index
+    try:
+        return index[path]
+    except KeyError:
+        if default is _DEFAULT:
+            raise
+        return default
+
+
+def get_memory_usage():
+    """Return the approximate memory (in bytes) retained by the parsed
+    configuration values as a dict in the form:
+
+    {'total': n, 'sections': {section: {'total': n, 'keys': {key: n}}}}
+
+    The root section (if any) is identified by None. Objects shared by
+    multiple keys are accounted to the first key only.
     If parse() wasn't called yet it will raise NotParsedError.
     """
     with _lock_ctx():
         if not _parsed:
             raise NotParsedError
         conf_map = _conf_map.copy()
-    ret = {}
-    # root section
-    if _has_sectionless_conf(conf_map):
-        conf_class = conf_map.pop(None)
-        ret = dict(conf_class)
-    # other sections
+    seen = set()
+    sections = {}
     for section, conf_class in conf_map.items():
-        ret[section] = dict(conf_class)
+        keys = dict((k, _sizeof(v, seen)) for k, v in conf_class)
+        sections[section] = dict(total=sum(keys.values()), keys=keys)
+    return dict(total=sum(x['total'] for x in sections.values()),
+                sections=sections)
+
+
+def get_parsed_conf():
+    """Return the whole parsed configuration as a dict.
+    If parse() wasn't called yet it will raise NotParsedError.
+    """
+    with _lock_ctx():
+        if not _parsed:
+            raise NotParsedError
+        ret = {}
+        # root section
+        if _has_sectionless_conf():
+            ret = _class_values(None)
+        # other sections
+        for section in _conf_map:
+            if section is not None:
+                ret[section] = _class_values(section)
     return ret
 
 
+class _Deduplicator(object):
+    """Intern the keys and string values of a deserialized config and
+    replace equal immutable values (numbers, tuples) with a single
+    shared object, in place. Deserializers (json, yaml, ...) create a
+    new object for every occurrence, so configs made of many similar
+    sections contain a lot of duplicates.
+    """
+
+    def __init__(self):
+        # {(type, value): value}
+        self.memo = {}
+        self.saved = 0
+
+    def value(self, value):
+        tp = type(value)
+        if tp is str:
+            ret = sys.intern(value) if _PY3 else intern(value)  # NOQA
+        elif tp is dict:
+            self.dict(value)
+            return value
+        elif tp is list:
+            for i, x in enumerate(value):
+                value[i] = self.value(x)
+            return value
+        elif tp in (int, float, tuple) or (not _PY3 and tp is long):  # NOQA
+            if tp is tuple:
+                value = tuple([self.value(x) for x in value])
+            try:
+                ret = self.memo.setdefault((self.key(value), value), value)
+            except TypeError:  # unhashable tuple
+                return value
+        else:
+            return value
+        if ret is not value:
+            self.saved += sys.getsizeof(value)
+        return ret
+
+    def key(self, value):
+        """Return what, together with the value itself, identifies
+        *value* in the memo. Equality is not enough: 0.0 == -0.0 and
+        (1, ) == (True, ), so take the sign of floats and the types of
+        tuple items into account. NaNs are never equal so they are
+        never shared.
+        """
+        tp = type(value)
+        if tp is float:
+            return (tp, math.copysign(1.0, value))
+        if tp is tuple:
+            return (tp, tuple([self.key(x) for x in value]))
+        return tp
+
+    def dict(self, dct):
+        items = list(dct.items())
+        dct.clear()
+        for key, value in items:
+            if type(key) is str:
+                new_key = sys.intern(key) if _PY3 else intern(key)  # NOQA
+                if new_key is not key:
+                    self.saved += sys.getsizeof(key)
+                key = new_key
+            dct[key] = self.value(value)
+
+    def dedup(self, dct):
+        """Deduplicate *dct* in place; return the bytes saved."""
+        self.dict(dct)
+        return self.saved
+
+
+def _compile_template(value):
+    """Split a string containing "${name}" references into a list of
+    (literal text, name or None) tuples. Results are cached, so every
+    template is parsed once.
+    """
+    try:
+        return _templates[value]
+    except KeyError:
+        pass
+    parts = []
+    pos = 0
+    text = ''
+    for m in _get_regex('template').finditer(value):
+        text += value[pos:m.start()]
+        pos = m.end()
+        name = m.group(1)
+        if name is None:  # "$$"
+            text += '$'
+            continue
+        name = name.strip()
+        if not name:
+            raise ValueError("empty reference in %r" % value)
+        parts.append((text, name))
+        text = ''
+    parts.append((text + value[pos:], None))
+    if len(_templates) >= 10000:
+        _templates.clear()
+    _templates[value] = parts
+    return parts
+
+
+class _Interpolator(object):
+    """Resolve the "${name}" references of the string values of a
+    deserialized config (and of the string default values of conf
+    classes), in place. *name* is either a setting key of the same
+    section, a setting key of the root section, "section.key" or an
+    env var. References are resolved depth first, so values are
+    rendered in dependency order, and circular references are
+    detected. A value consisting of a single reference takes the
+    value of the referenced key as-is, preserving its type.
+    *values* ({section: {key: value}}, e.g. loaded from a compiled
+    file) take precedence over the default values of conf classes.
+    """
+
+    def __init__(self, new_conf, values=None):
+        self.new_conf = new_conf
+        self.values = values or {}
+        # {(section, key): value}
+        self.resolved = {}
+        # the (section, key) currently being resolved, in order
+        self.stack = []
+        self.count = 0
+
+    def run(self):
+        """Return the number of templates which were rendered (the
+        others came from the memo of the previous parse).
+        """
+        for section, defaults in _defaults_map.items():
+            for key in defaults:
+                self.resolve(section, key)
+        return self.count
+
+    def raw_value(self, section, key):
+        conf = self.new_conf if section is None else \
+            self.new_conf.get(section)
+        if isinstance(conf, dict) and key in conf:
+            return conf[key]
+        values = self.values.get(section)
+        if values is not None and key in values:
+            return values[key]
+        value = _defaults_map[section][key]
+        if isinstance(value, schema):
+            if value.default is _DEFAULT:
+                raise RequiredSettingKeyError(section, key)
+            value = value.default
+        return value
+
+    def resolve(self, section, key):
+        node = (section, key)
+        try:
+            return self.resolved[node]
+        except KeyError:
+            pass
+        value = self.raw_value(section, key)
+        if not isinstance(value, basestring) or '$' not in value:
+            self.resolved[node] = value
+            return value
+        if node in self.stack:
+            path = self.stack[self.stack.index(node):] + [node]
+            raise InterpolationError(section, key, "circular reference %s" % (
+                ' -> '.join("%s.%s" % x if x[0] else x[1] for x in path)))
+        try:
+            parts = _compile_template(value)
+        except ValueError as err:
+            raise InterpolationError(section, key, str(err))
+        self.stack.append(node)
+        try:
+            inputs = [self.lookup(section, key, name)
+                      for _, name in parts if name is not None]
+        finally:
+            self.stack.pop()
+        memo = _interpolation_memo.get(node)
+        if memo is not None and memo[0] == value and memo[1] == inputs:
+            result = memo[2]
+        else:
+            if len(parts) == 2 and not parts[0][0] and not parts[1][0]:
+                # "${name}": keep the type of the referenced value
+                result = inputs[0]
+            else:
+                inputs_ = iter(inputs)
+                result = ''.join(
+                    text if name is None else text + str(next(inputs_))
+                    for text, name in parts)
+            _interpolation_memo[node] = (value, inputs, result)
+            self.count += 1
+        self.resolved[node] = result
+        if section is None:
+            self.new_conf[key] = result
+        else:
+            self.new_conf.setdefault(section, {})[key] = result
+        return result
+
+    def lookup(self, section, key, name):
+        """Return the value referenced by "${name}" from the value of
+        *section*.*key*.
+        """
+        if '.' in name:
+            ref_section, ref_key = name.split('.', 1)
+            if ref_key in _defaults_map.get(ref_section, ()):
+                return self.resolve(ref_section, ref_key)
+        else:
+            for ref_section in (section, None):
+                if name in _defaults_map.get(ref_section, ()):
+                    return self.resolve(ref_section, name)
+        try:
+            return os.environ[name]
+        except KeyError:
+            raise InterpolationError(
+                section, key, "%r is neither a setting key nor an env "
+                "var" % name)
+
+
 class _Parser:
 
     def __init__(self, conf_file=None, file_parser=None, type_check=True,
-                 parse_envvars=False, envvar_case_sensitive=False):
-        """Do all the work."""
-        global _parsed
-        if _parsed:
+                 parse_envvars=False, envvar_case_sensitive=False,
+                 dedup=False, interpolate=False, validate_only=False):
+        """Do all the work.
+        If *validate_only* is True the conf classes and the global
+        parse state are left untouched: the processed values are
+        collected in self.values instead (see validate_files()).
+        """
+        if _parsed and not validate_only:
             raise AlreadyParsedError
+        # {section: {key: value}}
+        self.values = {} if validate_only else None
         self.conf_file = conf_file
         self.file_parser = file_parser
         self.type_check = type_check
         self.envvar_case_sensitive = envvar_case_sensitive
         self.file_ext = None
-
+        # {section: {key: value}} loaded by load_compiled()
+        self.compiled_values = None
+        self.stats = ParseStats()
+        # evaluated once so that per-key tracing costs nothing when
+        # disabled
+        self.tracing = _tracing()
+
+        started = _timer()
         self.new_conf = self.get_conf_from_file()
         if parse_envvars:
+            t = _timer()
             self.update_conf_from_envvars()
+            self.stats._add('envvars', _timer() - t)
+        if dedup:
+            t = _timer()
+            self.stats.dedup_saved_bytes = _Deduplicator().dedup(
+                self.new_conf)
+            self.stats._add('dedup', _timer() - t)
+        if interpolate:
+            t = _timer()
+            rendered = _Interpolator(self.new_conf,
+                                     self.compiled_values).run()
+            self.stats._add('interpolate', _timer() - t)
+            if self.tracing:
+                _trace('interpolate', rendered=rendered)
         self.process_conf(self.new_conf)
+        self.stats._add('total', _timer() - started)
+        if not validate_only:
+            self.set_parsed()
+
+    def set_parsed(self):
+        """Mark configuration as parsed."""
+        global _parsed, _parsed_pid, _last_stats, _path_index
         _parsed = True
+        _parsed_pid = os.getpid()
+        _last_stats = self.stats
+        _path_index = None
+        if self.tracing:
+            _trace('parse', duration=self.stats.timings['total'],
+                   keys_processed=self.stats.keys_processed)
 
     def get_conf_from_file(self):
         """Parse config file (if any) and returns a dict representation
@@ -514,7 +2242,8 @@ class _Parser:
         """
         # no conf file
         if self.conf_file is None:
-            _log("conf file not specified")
+            if self.tracing:
+                _trace('conf_file', conf_file=None)
             if self.file_parser is not None:
                 raise ValueError(
                     "can't specify 'file_parser' option and no 'conf_file'")
@@ -522,53 +2251,125 @@ class _Parser:
                 return {}
 
         # parse conf file
+        t = _timer()
+        if hasattr(self.conf_file, 'load'):
+            # a source which is not a file (e.g. SQLiteSource)
+            if self.tracing:
+                _trace('conf_file', conf_file=self.conf_file)
+            if self.file_parser is not None:
+                raise ValueError("can't specify 'file_parser' option with "
+                                 "%r" % self.conf_file)
+            self.stats._add('open', _timer() - t)
+            t = _timer()
+            try:
+                return self.conf_file.load()
+            finally:
+                self.stats._add('deserialize', _timer() - t)
+        if isinstance(self.conf_file, basestring):
+            name = self.conf_file
+        else:
+            name = getattr(self.conf_file, 'name', None)
+        if (self.file_parser is None and isinstance(name, basestring) and
+                name.endswith(_COMPILED_EXT)):
+            return self.load_compiled()
         if isinstance(self.conf_file, basestring):
             file = open(self.conf_file, 'r')
-            _log("using conf file %s" % (self.conf_file))
+        elif hasattr(self.conf_file, 'poll'):
+            # a source (e.g. HTTPSource)
+            file = self.conf_file.open()
         else:
             file = self.conf_file
-            _log("using conf file-like object %s" % (self.conf_file))
+        if self.tracing:
+            _trace('conf_file', conf_file=self.conf_file)
         with file:
-            pmap = {'.yaml': parse_yaml,
-                    '.yml': parse_yaml,
-                    '.toml': parse_toml,
-                    '.json': parse_json,
-                    '.ini': parse_ini}
             if self.file_parser is None:
-                if not hasattr(file, 'name'):
-                    raise Error("can't determine file format from a file "
+                name = getattr(file, 'name', None)
+                named = (isinstance(name, basestring) and
+                         not name.startswith('<'))
+                parser = None
+                if named:
+                    self.file_ext = os.path.splitext(name)[1]
+                    try:
+                        parser = _get_parser(self.file_ext)
+                    except KeyError:
+                        pass
+                if parser is None:
+                    # a stream with no file name (e.g. "<stdin>" or a
+                    # file descriptor) or a file name with no or an
+                    # unknown extension (e.g. "/dev/stdin"): look at its
+                    # content
+                    self.file_ext, file = _sniff(file)
+                    if self.tracing:
+                        _trace('sniff', file_ext=self.file_ext)
+                    if self.file_ext is None:
+                        if name is None:
+                            raise Error(
+                                "can't determine file format from a file "
                                 "object with no 'name' attribute")
-                try:
-                    self.file_ext = os.path.splitext(file.name)[1]
-                    parser = pmap[self.file_ext]
-                except KeyError:
-                    raise ValueError("don't know how to parse %r (extension "
-                                     "not supported)" % file.name)
+                        if named:
+                            raise ValueError(
+                                "don't know how to parse %r (extension "
+                                "not supported)" % name)
+                        raise ValueError(
+                            "don't know how to parse %r (format not "
+                            "recognized)" % name)
+                    parser = _get_parser(self.file_ext)
                 if self.file_ext == '.ini' and _has_sectionless_conf():
                     raise Error("can't parse ini files if a sectionless "
                                 "configuration class has been registered")
             else:
                 parser = self.file_parser
-            return parser(file) or {}
+            self.stats._add('open', _timer() - t)
+            t = _timer()
+            try:
+                return parser(file) or {}
+            finally:
+                self.stats._add('deserialize', _timer() - t)
+
+    def load_compiled(self):
+        """Load a file written by compile_conf(). Its values were
+        validated already, so they are set on the conf classes right
+        away (no text deserialization, no validators) and an empty
+        dict is returned. Env vars (if any) are processed as usual.
+        """
+        t = _timer()
+        if self.tracing:
+            _trace('conf_file', conf_file=self.conf_file)
+        if isinstance(self.conf_file, basestring):
+            file = open(self.conf_file, 'rb')
+        else:
+            file = self.conf_file
+        with file:
+            data = file.read()
+        self.stats._add('open', _timer() - t)
+        t = _timer()
+        values = self.compiled_values = _load_snapshot(data)
+        if self.values is None:
+            _set_values(values)
+        else:
+            self.values.update(values)
+        self.stats._add('deserialize', _timer() - t)
+        return {}
 
     def update_conf_from_envvars(self):
         """Iterate over all process env vars and return a dict() of
         env vars whose name match they setting keys defined by conf
         class.
         """
-        conf_map = _conf_map.copy()
         env = os.environ.copy()
         env_names = set([x for x in env.keys() if x.isupper()])
-        for section, conf_class in conf_map.items():
-            for key_name in dict(conf_class).keys():
+        for section, defaults in _defaults_map.items():
+            for key_name, default_value in defaults.items():
                 check_name = (
                     key_name.upper() if not self.envvar_case_sensitive
                     else key_name)
                 if check_name in env_names:
-                    default_value = getattr(conf_class, key_name)
                     raw_value = env[key_name.upper()]
                     new_value = self.cast_value(
                         section, key_name, default_value, raw_value)
+                    if self.tracing:
+                        _trace('envvar', section=section, key=key_name,
+                               value=new_value)
                     if section is None:
                         self.new_conf[key_name] = new_value
                     else:
@@ -577,41 +2378,31 @@ class _Parser:
                         self.new_conf[section][key_name] = new_value
 
     def cast_value(self, section, key, default_value, new_value):
-        """Cast a value depending on default value type."""
+        """Cast a string value depending on default value type by using
+        the coercer which was resolved for the setting key.
+        """
+        coercer = _get_coercers(section).get(key)
+        if coercer is None or not isinstance(new_value, basestring):
+            # leave the new value unmodified (str)
+            return new_value
         if isinstance(default_value, schema):
             default_value = default_value.default
-        if isinstance(default_value, bool):
-            if new_value.lower() in _STR_BOOL_TRUE:
-                new_value = True
-            elif new_value.lower() in _STR_BOOL_FALSE:
-                new_value = False
-            else:
-                if self.type_check:
-                    raise TypesMismatchError(
-                        section, key, default_value, new_value)
-        elif isinstance(default_value, int):
-            try:
-                new_value = int(new_value)
-            except ValueError:
-                if self.type_check:
-                    raise TypesMismatchError(
-                        section, key, default_value, new_value)
-        elif isinstance(default_value, float):
-            try:
-                new_value = float(new_value)
-            except ValueError:
-                if self.type_check:
-                    raise TypesMismatchError(
-                        section, key, default_value, new_value)
-        else:
-            # leave the new value unmodified (str)
-            pass
-        return new_value
+        try:
+            return coercer(new_value, default_value)
+        except (ValueError, TypeError):
+            if self.type_check:
+                raise TypesMismatchError(
+                    section, key, default_value, new_value)
+            return new_value
 
     def process_conf(self, new_conf):
+        t = _timer()
         conf_map = _conf_map.copy()
         if not conf_map:
             raise Error("no registered conf classes were found")
+        # trace events are emitted by the generic code only
+        compiled = {} if self.tracing else _compiled_map
+        root_values = {}
         # iterate over file / envvar conf
         for key, new_value in new_conf.items():
             # this should never happen
@@ -626,6 +2417,9 @@ class _Parser:
                 # TODO: turn this into a proper error
                 assert isinstance(new_value, dict), new_value
                 # assert new_value, new_value
+                if section in compiled:
+                    self.process_compiled(section, new_value)
+                    continue
                 for k, nv in new_value.items():
                     self.process_pair(section, k, nv, conf_class)
             else:
@@ -635,9 +2429,33 @@ class _Parser:
                     conf_class = conf_map[None]
                 except KeyError:
                     raise UnrecognizedSettingKeyError(None, key, new_value)
+                if None in compiled:
+                    root_values[key] = new_value
+                    continue
                 self.process_pair(section, key, new_value, conf_class)
+        if root_values:
+            self.process_compiled(None, root_values)
+        self.stats._add('process', _timer() - t)
 
+        t = _timer()
         self.run_last_schemas()
+        self.stats._add('last_schemas', _timer() - t)
+
+    def process_compiled(self, section, new_values):
+        """Process the values of a section registered with
+        compiled=True via its generated function (see
+        _gen_section_source()).
+        """
+        fun = _compiled_map[section]
+        if fun is None:
+            fun = _compiled_map[section] = _compile_section(section)
+        cast = self.cast_value if self.file_ext == '.ini' else None
+        if self.values is None:
+            store = functools.partial(setattr, _conf_map[section])
+        else:
+            store = self.values.setdefault(section, {}).__setitem__
+        self.stats.keys_processed += fun(new_values, self.type_check, cast,
+                                         self.stats, store)
 
     def process_pair(self, section, key, new_value, conf_class):
         """Given a setting key / value pair extracted either from the
@@ -645,14 +2463,16 @@ class _Parser:
         the config class original key value.
         """
         try:
-            # The default value defined in the conf class.
-            default_value = getattr(conf_class, key)
-        except AttributeError:
+            # The default value defined in the conf class (the class
+            # attribute may hold a value loaded by load_compiled()).
+            default_value = _defaults_map[section][key]
+        except KeyError:
             # Conf file defines a key which does not exist in the
             # conf class.
             raise UnrecognizedSettingKeyError(section, key, new_value)
 
         # Cast values for ini files (which only support string type).
+        t = _timer()
         if self.file_ext == '.ini':
             new_value = self.cast_value(section, key, default_value, new_value)
 
@@ -660,18 +2480,26 @@ class _Parser:
         is_schema = isinstance(default_value, schema)
         if not is_schema:
             self.check_type(section, key, default_value, new_value)
+        self.stats._add('type_check', _timer() - t)
 
         # Run validators.
         if is_schema:
             schema_ = default_value
             if schema_.validator is not None:
                 self.run_validators(schema_, section, key, new_value)
+            if schema_.array is not None:
+                new_value = _to_array(schema_, section, key, new_value,
+                                      self.type_check)
 
         # Finally replace key value.
-        sec_key = key if section is None else "%s.%s" % (section, key)
-        _log("overriding setting key %r (value=%r) to new value %r".format(
-            sec_key, default_value, new_value))
-        setattr(conf_class, key, new_value)
+        if self.tracing:
+            _trace('override', section=section, key=key,
+                   old_value=default_value, new_value=new_value)
+        if self.values is None:
+            setattr(conf_class, key, new_value)
+        else:
+            self.values.setdefault(section, {})[key] = new_value
+        self.stats.keys_processed += 1
 
     def check_type(self, section, key, default_value, new_value):
         """Raise TypesMismatchError if config file or env var wants to
@@ -688,21 +2516,22 @@ class _Parser:
                 # On Python 2 we don't want to make a distinction
                 # between str and unicode.
                 pass
+            elif (type(new_value) is _SQLiteMapping and
+                    isinstance(default_value, dict)):
+                # lazily loaded dict (see SQLiteSource)
+                pass
             else:
                 raise TypesMismatchError(
                     section, key, default_value, new_value)
 
-    @staticmethod
-    def run_validators(schema_, section, key, new_value):
+    def run_validators(self, schema_, section, key, new_value):
         """Run schema validators and raise ValidationError on failure."""
         validators = schema_.validator
-        if not isinstance(validators, collections.Iterable):
+        if not isinstance(validators, _Iterable):
             validators = [validators]
         for validator in validators:
             exc = None
-            sec_key = key if section is None else "%s.%s" % (section, key)
-            _log("running validator %r for key %r with value "
-                 "%r".format(validator, sec_key, new_value))
+            t = _timer()
             try:
                 ok = validator(new_value)
             except ValidationError as err:
@@ -710,30 +2539,73 @@ class _Parser:
             else:
                 if not ok:
                     exc = ValidationError()
+            finally:
+                elapsed = _timer() - t
+                self.stats._add_validator(validator, elapsed)
+            if self.tracing:
+                _trace('validator', section=section, key=key,
+                       value=new_value, validator=validator,
+                       duration=elapsed, ok=exc is None)
             if exc is not None:
                 exc.section = section
                 exc.key = key
                 exc.value = new_value
                 raise exc
 
-    @staticmethod
-    def run_last_schemas():
+    def run_last_schemas(self):
         """Iterate over configuration classes in order to collect all
         schemas which were not overwritten by the config file.
         """
-        conf_map = _conf_map.copy()
-        for section, conf_class in conf_map.items():
-            for key, value in conf_class.__dict__.items():
+        for section, conf_class in _conf_map.items():
+            if self.values is not None:
+                values = self.values.setdefault(section, {})
+            for key in _get_schema_keys(section):
+                if self.values is None:
+                    value = getattr(conf_class, key)
+                elif key in values:
+                    continue
+                else:
+                    value = _defaults_map[section][key]
                 if isinstance(value, schema):
                     schema_ = value
                     if schema_.required:
                         raise RequiredSettingKeyError(section, key)
                     if schema_.validator is not None:
-                        _Parser.run_validators(schema_, section, key, value)
-                    setattr(conf_class, key, value.default)
+                        self.run_validators(
+                            schema_, section, key, schema_.default)
+                    value = schema_.default
+                    if schema_.array is not None:
+                        value = _to_array(schema_, section, key, value,
+                                          self.type_check)
+                    if self.values is None:
+                        setattr(conf_class, key, value)
+                    else:
+                        values[key] = value
 
 
-def parse(conf_file=None, file_parser=None, type_check=True):
+def _parse(stats_callback, **kwargs):
+    with _lock_ctx():
+        if (_parsed and _parsed_pid != os.getpid() and
+                kwargs == _last_parse_kwargs):
+            # We're a forked child (e.g. a pre-fork server worker) and
+            # the parent already parsed the configuration with the same
+            # arguments: it is still valid so reuse it instead of paying
+            # the parse cost again. reload() can be used to explicitly
+            # re-parse. Different arguments raise AlreadyParsedError,
+            # same as in the parent.
+            if _tracing():
+                _trace('inherit_parsed', parent_pid=_parsed_pid)
+            stats = _last_stats
+        else:
+            stats = _Parser(**kwargs).stats
+        _last_parse_kwargs.clear()
+        _last_parse_kwargs.update(kwargs)
+    if stats_callback is not None and stats is not None:
+        stats_callback(stats)
+
+
+def parse(conf_file=None, file_parser=None, type_check=True,
+          stats_callback=None, dedup=False, interpolate=False):
     """Parse configuration class(es) replacing values if a
     configuration file is provided.
 
@@ -753,14 +2625,29 @@ def parse(conf_file=None, file_parser=None, type_check=True):
     - (bool) type_check: when `True` raise `TypesMismatchError` in
       case an option specified in the configuration file has a different
       type than the one defined in the configuration class.
+
+    - (callable) stats_callback: if specified it is called once parsing
+      is complete with a `ParseStats` instance as its only argument
+      (e.g. in order to forward timings to a metrics system).
+
+    - (bool) dedup: intern keys and strings and share equal immutable
+      values across the parsed configuration in order to save memory
+      (see `ParseStats.dedup_saved_bytes`).
+
+    - (bool) interpolate: replace "${name}" references in string values
+      with the value of setting key "name" (of the same section or of
+      the root section), "section.key" or env var "name" ("$$" is a
+      literal "$"). Values are resolved before being type checked and
+      validated. Raise `InterpolationError` if a reference can't be
+      resolved.
     """
-    with _lock_ctx():
-        _Parser(conf_file=conf_file, file_parser=file_parser,
-                type_check=type_check)
+    _parse(stats_callback, conf_file=conf_file, file_parser=file_parser,
+           type_check=type_check, dedup=dedup, interpolate=interpolate)
 
 
 def parse_with_envvars(conf_file=None, file_parser=None, type_check=True,
-                       case_sensitive=False):
+                       case_sensitive=False, stats_callback=None,
+                       dedup=False, interpolate=False):
     """Same as parse() but also takes environment variables into account.
     It must be noted that env vars take precedence over the config file
     (if specified).
@@ -773,21 +2660,1147 @@ def parse_with_envvars(conf_file=None, file_parser=None, type_check=True,
     If `case_sensitive` is True then it is supposed that the config
     class(es) define all upper cased setting keys.
     """
+    _parse(stats_callback,
+           conf_file=conf_file,
+           file_parser=file_parser,
+           type_check=type_check,
+           parse_envvars=True,
+           envvar_case_sensitive=case_sensitive,
+           dedup=dedup,
+           interpolate=interpolate)
+
+
+def reload(conf_file=_DEFAULT, file_parser=_DEFAULT, type_check=_DEFAULT,
+           stats_callback=None):
+    """Reset configuration classes to their default values and parse
+    them again. Arguments which are not specified default to the ones
+    passed to the last parse() / parse_with_envvars() call (env vars
+    are taken into account if parse_with_envvars() was used).
+    If the new configuration is not valid the exception is raised and
+    the previous configuration is left in place. Other threads reading
+    the configuration meanwhile keep seeing the old values.
+    In a forked child process this is the way to re-parse the
+    configuration which was inherited from the parent.
+    If the configuration comes from a source which tells it did not
+    change (e.g. HTTPSource getting "304 Not Modified") and no argument
+    is specified, the current configuration is left as-is.
+    If parse() wasn't called yet it will raise NotParsedError.
+    If the configuration was not parsed but set via restore(),
+    SharedConfStore.sync() or import_conf() (with no source file) there
+    is nothing to re-parse, so *conf_file* must be specified, else Error
+    is raised.
+    """
+    with _lock_ctx():
+        if not _parsed:
+            raise NotParsedError
+        if not _last_parse_kwargs and conf_file is _DEFAULT:
+            raise Error("configuration was not parsed from a config file "
+                        "(e.g. it was restore()d); specify conf_file in "
+                        "order to reload() it")
+        kwargs = _last_parse_kwargs.copy()
+        if conf_file is not _DEFAULT:
+            kwargs['conf_file'] = conf_file
+        if file_parser is not _DEFAULT:
+            kwargs['file_parser'] = file_parser
+        if type_check is not _DEFAULT:
+            kwargs['type_check'] = type_check
+        source = kwargs.get('conf_file')
+        if (kwargs == _last_parse_kwargs and hasattr(source, 'poll') and
+                not source.poll()):
+            # e.g. HTTPSource got "304 Not Modified"
+            if _tracing():
+                _trace('source_unchanged', source=source)
+            return
+        # Build the new configuration off to the side and replace the
+        # old one in a single step, so that other threads reading conf
+        # class attributes meanwhile never see default values (or raw
+        # schema()s).
+        parser = _Parser(validate_only=True, **kwargs)
+        values = {}
+        for section, defaults in _defaults_map.items():
+            values[section] = dict(defaults)
+            values[section].update(parser.values.get(section, ()))
+        _set_values(values)
+        parser.set_parsed()
+        stats = parser.stats
+        _last_parse_kwargs.clear()
+        _last_parse_kwargs.update(kwargs)
+    if stats_callback is not None:
+        stats_callback(stats)
+
+
+def snapshot():
+    """Return the parsed configuration serialized as compact bytes
+    which can be passed to restore() in another process (e.g. a
+    "spawn" multiprocessing worker) in order to skip parsing:
+
+    >>> executor = ProcessPoolExecutor(initializer=confix.restore,
+    ...                                initargs=(confix.snapshot(), ))
+
+    The snapshot includes a fingerprint of the registered conf classes.
+    If parse() wasn't called yet it will raise NotParsedError.
+    """
+    with _lock_ctx():
+        if not _parsed:
+            raise NotParsedError
+        return _dump_snapshot()
+
+
+def restore(data):
+    """Set the configuration values contained in a snapshot() onto
+    the registered conf classes (which must be the same ones which
+    were registered when the snapshot was taken), without parsing or
+    validating them again. After this the configuration is considered
+    parsed, replacing the current values (if any).
+    """
+    with _lock_ctx():
+        values = _load_snapshot(data)
+        _restore_defaults()
+        _apply_values(values)
+    if _tracing():
+        _trace('restore', size=len(data))
+
+
+def compile_conf(conf_file, out_file, file_parser=None, type_check=True):
+    """Parse and validate *conf_file* against the registered conf
+    classes, then write the resulting configuration to *out_file*
+    in a compact binary format, including a fingerprint of the conf
+    classes. Passing a file ending with ".confixc" to parse() loads it
+    without deserializing text or running validators (if conf classes
+    changed in the meantime Error is raised).
+    As a side effect the configuration is parsed.
+    If parse() was already called it will raise AlreadyParsedError.
+    """
+    parse(conf_file, file_parser=file_parser, type_check=type_check)
+    with _lock_ctx():
+        data = _dump_snapshot()
+    tmp = out_file + '.tmp'
+    with open(tmp, 'wb') as f:
+        f.write(data)
+    getattr(os, 'replace', os.rename)(tmp, out_file)
+
+
+def _file_hash(path):
+    import hashlib
+    with open(path, 'rb') as f:
+        return hashlib.sha1(f.read()).hexdigest()
+
+
+def _is_literal(value):
+    """Return True if *value* can be written as a Python literal."""
+    import ast
+    try:
+        return ast.literal_eval(repr(value)) == value
+    except (ValueError, SyntaxError):
+        return False
+
+
+def _import_name(name):
+    """Import and return the object named "module.qualname"."""
+    import importlib
+    parts = name.split('.')
+    for i in range(len(parts) - 1, 0, -1):
+        try:
+            obj = importlib.import_module('.'.join(parts[:i]))
+        except ImportError:
+            continue
+        for attr in parts[i:]:
+            obj = getattr(obj, attr)
+        return obj
+    raise ImportError("can't import %r" % name)
+
+
+def _callable_ref(fun):
+    """Return a ("module.qualname", args, kwargs) tuple referencing
+    *fun*, a module level function or a functools.partial() of one
+    with literal arguments, so that it can be written into a generated
+    module. Raise Error if that's not possible.
+    """
+    args, kwargs = (), {}
+    if isinstance(fun, functools.partial):
+        args, kwargs = tuple(fun.args), dict(fun.keywords or {})
+        fun = fun.func
+    name = "%s.%s" % (getattr(fun, '__module__', None),
+                      getattr(fun, '__qualname__',
+                              getattr(fun, '__name__', None)))
+    try:
+        ok = _import_name(name) is fun
+    except (ImportError, AttributeError):
+        ok = False
+    if not ok or not _is_literal((args, kwargs)):
+        raise Error("%r can't be referenced from a generated module (use "
+                    "a module level function or a functools.partial() of "
+                    "one with literal arguments)" % fun)
+    return (name, args, kwargs)
+
+
+def _resolve_callable_ref(ref):
+    """The reverse of _callable_ref()."""
+    name, args, kwargs = ref
+    fun = _import_name(name)
+    if args or kwargs:
+        fun = functools.partial(fun, *args, **kwargs)
+    return fun
+
+
+def generate_module(conf_file, out_file, file_parser=None, type_check=True):
+    """Parse and validate *conf_file* against the registered conf
+    classes, then write a Python module to *out_file* defining the
+    resulting configuration as literal constants:
+
+    - SOURCE: the absolute path of *conf_file*
+    - SOURCE_HASH: the SHA1 of *conf_file* content
+    - FINGERPRINT: a fingerprint of the conf classes
+    - CONF: a {section: {key: value}} dict
+    - PARSE_KWARGS: *file_parser* and *type_check*, used by
+      import_conf() in order to parse *conf_file* again
+
+    Values must be representable as Python literals (str, numbers,
+    bool, None, lists, tuples, dicts), else Error is raised.
+    *file_parser* must be a module level function or a
+    functools.partial() of one with literal arguments.
+    Use import_conf() to load it.
+    As a side effect the configuration is parsed.
+    If parse() was already called it will raise AlreadyParsedError.
+    """
+    import binascii
+    import pprint
+    parse_kwargs = dict(type_check=type_check)
+    if file_parser is not None:
+        parse_kwargs['file_parser'] = _callable_ref(file_parser)
+    parse(conf_file, file_parser=file_parser, type_check=type_check)
+    with _lock_ctx():
+        values = _get_values()
+        fingerprint = binascii.hexlify(_schema_fingerprint()).decode()
+    for section, dct in values.items():
+        for key, value in dct.items():
+            if not _is_literal(value):
+                raise Error("value of setting key %r can't be represented "
+                            "as a Python literal: %r" % (
+                                "%s.%s" % (section, key) if section else key,
+                                value))
+    source = os.path.abspath(conf_file)
+    lines = [
+        "# Generated by confix from %s; do not edit." % source,
+        "# Load it via confix.import_conf().",
+        "",
+        "SOURCE = %r" % source,
+        "SOURCE_HASH = %r" % _file_hash(source),
+        "FINGERPRINT = %r" % fingerprint,
+        "CONF = %s" % pprint.pformat(values),
+        "PARSE_KWARGS = %r" % parse_kwargs,
+        "",
+    ]
+    tmp = out_file + '.tmp'
+    with open(tmp, 'w') as f:
+        f.write("\n".join(lines))
+    getattr(os, 'replace', os.rename)(tmp, out_file)
+
+
+def import_conf(module):
+    """Load the configuration from a module written by
+    generate_module(), given its name or the module object itself.
+    The module is imported (and hence cached as bytecode by Python)
+    and its values are set onto the registered conf classes without
+    parsing or validating them.
+    If the source config file changed since the module was generated
+    (its content hash differs) or the conf classes changed, fall back
+    to parse() the source config file, with the file_parser and
+    type_check arguments passed to generate_module().
+    Return True if the module was used, False if the source config
+    file was parsed instead.
+    If parse() was already called it will raise AlreadyParsedError.
+    """
+    import binascii
+    if isinstance(module, basestring):
+        import importlib
+        module = importlib.import_module(module)
+    parse_kwargs = dict(file_parser=None, type_check=True)
+    parse_kwargs.update(getattr(module, 'PARSE_KWARGS', {}))
+    if parse_kwargs['file_parser'] is not None:
+        parse_kwargs['file_parser'] = _resolve_callable_ref(
+            parse_kwargs['file_parser'])
     with _lock_ctx():
-        _Parser(conf_file=conf_file,
-                file_parser=file_parser,
-                type_check=type_check,
-                parse_envvars=True,
-                envvar_case_sensitive=case_sensitive)
+        if _parsed:
+            raise AlreadyParsedError
+        fingerprint = binascii.hexlify(_schema_fingerprint()).decode()
+        stale = module.FINGERPRINT != fingerprint
+        has_source = False
+        if not stale:
+            try:
+                stale = _file_hash(module.SOURCE) != module.SOURCE_HASH
+                has_source = True
+            except (IOError, OSError):
+                # only the generated module was deployed
+                pass
+        if not stale:
+            _apply_values(module.CONF)
+            if has_source:
+                # so that reload() parses the source config file
+                _last_parse_kwargs.update(
+                    conf_file=module.SOURCE, dedup=False, interpolate=False,
+                    **parse_kwargs)
+    if stale:
+        parse(module.SOURCE, **parse_kwargs)
+    if _tracing():
+        _trace('import_conf', module=module.__name__, stale=stale)
+    return not stale
+
+
+class ValidationResult(collections.namedtuple(
+        'ValidationResult', ['file', 'error', 'error_type', 'duration'])):
+    """The outcome of validating a single file via validate_files():
+
+    - file: the file path
+    - error: the error message or None if the file is valid
+    - error_type: the name of the exception class or None
+    - duration: the seconds it took to validate the file
+    """
+    __slots__ = ()
+
+    @property
+    def ok(self):
+        return self.error is None
+
+
+class ValidationReport(collections.namedtuple(
+        'ValidationReport', ['results', 'elapsed'])):
+    """Returned by validate_files():
+
+    - results: a list of ValidationResult, in the same order as files
+    - elapsed: the total (wall clock) seconds
+    """
+    __slots__ = ()
+
+    @property
+    def failed(self):
+        return [x for x in self.results if not x.ok]
+
+    @property
+    def files_per_sec(self):
+        return len(self.results) / self.elapsed if self.elapsed else 0.0
+
+
+def _list_conf_files(files):
+    """Expand directories into the config files they contain
+    (recursively, sorted), based on the supported extensions.
+    """
+    if isinstance(files, basestring):
+        files = [files]
+    _load_entry_points()
+    exts = tuple(_parsers) + (_COMPILED_EXT, )
+    for path in files:
+        if not os.path.isdir(path):
+            yield path
+            continue
+        for root, dirs, names in os.walk(path):
+            dirs.sort()
+            for name in sorted(names):
+                if name.endswith(exts):
+                    yield os.path.join(root, name)
+
+
+def _validate_init(modules):
+    """Process pool initializer: register the conf classes (not
+    needed with the "fork" start method).
+    """
+    import importlib
+    for name in modules:
+        importlib.import_module(name)
+
+
+def _validate_file(args):
+    path, file_parser, type_check, interpolate = args
+    t = _timer()
+    try:
+        _Parser(conf_file=path, file_parser=file_parser,
+                type_check=type_check, interpolate=interpolate,
+                validate_only=True)
+    except Exception as err:
+        return ValidationResult(path, str(err) or repr(err),
+                                type(err).__name__, _timer() - t)
+    return ValidationResult(path, None, None, _timer() - t)
+
+
+def validate_files(files, modules=(), processes=None, file_parser=None,
+                   type_check=True, interpolate=False):
+    """Validate many config files against the registered conf classes
+    in parallel, by using a pool of *processes* (default: the number
+    of CPUs, 1 means no pool).
+    *files* is a list of file paths and / or directories (which are
+    searched recursively for files with a supported extension).
+    Conf classes and the parse state are left untouched, so this can
+    be used regardless of whether parse() was called.
+    *modules* are the names of the modules which register() the conf
+    classes; they are imported by the worker processes, which is
+    needed if the "spawn" start method is used.
+    Return a ValidationReport.
+    """
+    files = list(_list_conf_files(files))
+    if not _conf_map and not modules:
+        raise Error("no registered conf classes were found")
+    import multiprocessing
+    tasks = [(path, file_parser, type_check, interpolate) for path in files]
+    t = _timer()
+    if processes is None:
+        processes = min(multiprocessing.cpu_count(), len(tasks)) or 1
+    if processes == 1:
+        _validate_init(modules)
+        results = [_validate_file(x) for x in tasks]
+    else:
+        chunksize = max(1, len(tasks) // (processes * 4))
+        pool = multiprocessing.Pool(processes, _validate_init, (modules, ))
+        try:
+            results = pool.map(_validate_file, tasks, chunksize)
+        finally:
+            pool.terminate()
+            pool.join()
+    report = ValidationReport(results, _timer() - t)
+    if _tracing():
+        _trace('validate_files', files=len(results),
+               failed=len(report.failed), duration=report.elapsed)
+    return report
+
+
+def add_trace_listener(fun):
+    """Add a callable which will be called for every trace event
+    emitted by register() and parse() as fun(event, fields), where
+    *event* is the event name (e.g. 'override') and *fields* is a dict
+    of event details (e.g. section, key, old_value, new_value). Events
+    are:
+
+    - register: section, klass
+    - conf_file: conf_file
+    - envvar: section, key, value
+    - override: section, key, old_value, new_value
+    - validator: section, key, value, validator, duration, ok
+    - parse: duration, keys_processed
+    - inherit_parsed: parent_pid
+    - publish: name, version
+    - sync: name, version
+    - restore: size
+    - source_unchanged: source
+    - sniff: file_ext (the format guessed for a nameless stream)
+    - interpolate: rendered (number of templates which were not
+      served by the memo of the previous parse)
+    - import_conf: module, stale
+    - validate_files: files, failed, duration
+    - source_error: source, error
+
+    When no listener is added and the "confix" logger is not enabled
+    for DEBUG level no event is built at all.
+    Listeners are called while holding confix's internal lock, so they
+    are not supposed to call confix functions.
+    """
+    if not callable(fun):
+        raise TypeError("%r is not callable" % fun)
+    with _lock_ctx():
+        _trace_listeners.append(fun)
+
+
+def remove_trace_listener(fun):
+    """Remove a listener previously added via add_trace_listener()."""
+    with _lock_ctx():
+        try:
+            _trace_listeners.remove(fun)
+        except ValueError:
+            raise ValueError("%r is not a trace listener" % fun)
 
 
 def discard():
     """Discard previous configuration (if any)."""
-    global _parsed
+    global _parsed, _parsed_pid, _last_stats, _fingerprint, _path_index
     with _lock_ctx():
+        _path_index = None
         _conf_map.clear()
+        _defaults_map.clear()
+        _coercers_map.clear()
+        _compiled_map.clear()
+        _schema_keys_map.clear()
+        _interpolation_memo.clear()
+        _fingerprint = None
+        _last_parse_kwargs.clear()
         _parsed = False
+        _parsed_pid = None
+        _last_stats = None
+
+
+# =============================================================================
+# multi process support
+# =============================================================================
+
+
+class SharedConfStore(object):
+    """A shared memory segment through which one process publishes the
+    parsed (and validated) configuration to other processes, which pick
+    it up without parsing config files or running validators.
+
+    The segment starts with a sequence counter (incremented on every
+    publish()) followed by the serialized configuration, so checking
+    whether a new version is available is cheap:
+
+    >>> # publisher
+    >>> store = SharedConfStore('myapp', create=True)
+    >>> parse('config.yaml')
+    >>> store.publish()
+    >>> ...
+    >>> reload()
+    >>> store.publish()
+
+    >>> # other processes (same conf classes registered, no parse())
+    >>> store = SharedConfStore('myapp')
+    >>> store.sync()  # call it periodically / before using config
+
+    *size* is the size of the segment in bytes, which can't grow once
+    created. If a publisher dies while writing, readers give up after
+    *timeout* seconds and raise Error (until the next publish()).
+    Requires Python >= 3.8.
+    """
+
+    _HEADER = '<QQ'  # sequence counter, payload length
+    _HEADER_SIZE = 16
+
+    def __init__(self, name, create=False, size=1024 * 1024, timeout=1.0):
+        from multiprocessing import shared_memory  # py3.8+
+        if create:
+            if size <= self._HEADER_SIZE:
+                raise ValueError("size is too small (%r)" % size)
+            self._shm = shared_memory.SharedMemory(
+                name=name, create=True, size=size)
+        else:
+            self._shm = shared_memory.SharedMemory(name=name)
+            # Python < 3.13 tracks (and unlinks on exit!) segments which
+            # were merely attached to; only the creator owns it.
+            try:
+                from multiprocessing import resource_tracker
+                resource_tracker.unregister(self._shm._name, 'shared_memory')
+            except Exception:
+                pass
+        self.name = name
+        self.timeout = timeout
+        self._seen_seq = None
+
+    def __repr__(self):
+        return "<%s name=%r version=%s>" % (
+            self.__class__.__name__, self.name, self.version)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def _read_seq(self):
+        import struct
+        return struct.unpack_from('<Q', self._shm.buf, 0)[0]
+
+    @property
+    def version(self):
+        """The number of times the configuration was published (0 if it
+        was never published).
+        """
+        return self._read_seq() // 2
+
+    def publish(self):
+        """Publish the current (parsed) configuration of this process
+        into the shared memory segment.
+        If parse() wasn't called yet it will raise NotParsedError.
+        """
+        import struct
+        with _lock_ctx():
+            if not _parsed:
+                raise NotParsedError
+            data = _dump_snapshot()
+        buf = self._shm.buf
+        if len(data) > len(buf) - self._HEADER_SIZE:
+            raise Error("serialized configuration (%s bytes) does not fit "
+                        "into shared memory segment %r (%s bytes)" % (
+                            len(data), self.name, len(buf)))
+        # seqlock: an odd counter means a write is in progress
+        seq = self._read_seq()
+        if seq % 2:
+            # a previous publisher died while writing
+            seq += 1
+        struct.pack_into(self._HEADER, buf, 0, seq + 1, len(data))
+        buf[self._HEADER_SIZE:self._HEADER_SIZE + len(data)] = data
+        struct.pack_into('<Q', buf, 0, seq + 2)
+        if _tracing():
+            _trace('publish', name=self.name, version=(seq + 2) // 2)
+
+    def _read(self):
+        """Return a (version, snapshot) tuple of the last published
+        configuration or (0, None) if it was never published.
+        """
+        import struct
+        buf = self._shm.buf
+        deadline = None
+        while True:
+            seq, length = struct.unpack_from(self._HEADER, buf, 0)
+            if seq == 0:
+                return (0, None)
+            if not seq % 2:
+                data = bytes(
+                    buf[self._HEADER_SIZE:self._HEADER_SIZE + length])
+                if self._read_seq() == seq:
+                    return (seq // 2, data)
+            # a write is in progress
+            if deadline is None:
+                deadline = _timer() + self.timeout
+            elif _timer() > deadline:
+                raise Error("shared memory segment %r is still being "
+                            "written after %s secs (the publisher probably "
+                            "died while writing); publish() again" % (
+                                self.name, self.timeout))
+            time.sleep(0)
+
+    def read(self):
+        """Return a (version, {section: {key: value}}) tuple of the last
+        published configuration or (0, None) if it was never published.
+        """
+        version, data = self._read()
+        if data is None:
+            return (version, None)
+        with _lock_ctx():
+            return (version, _load_snapshot(data))
+
+    def sync(self):
+        """Check whether a new configuration version was published and
+        if so apply it to the conf classes of this process (which are
+        then considered parsed). Return True if configuration changed.
+        This is cheap to call when nothing changed (it just reads the
+        sequence counter).
+        """
+        seq = self._read_seq()
+        if seq == self._seen_seq:
+            return False
+        version, data = self._read()
+        if data is None:
+            return False
+        with _lock_ctx():
+            _apply_values(_load_snapshot(data))
+        self._seen_seq = version * 2
+        if _tracing():
+            _trace('sync', name=self.name, version=version)
+        return True
+
+    def close(self):
+        """Close access to the shared memory segment from this process."""
+        self._shm.close()
+
+    def unlink(self):
+        """Destroy the shared memory segment (should be called once by
+        the process which created it).
+        """
+        self._shm.unlink()
+
+
+def _json_default(obj):
+    # array.array (see schema(array=...)) is sent as a list, lazy
+    # mappings as dicts; other
+    # values which are not JSON serializable (e.g. datetime) are sent
+    # as strings
+    if hasattr(obj, 'tolist'):
+        return obj.tolist()
+    if isinstance(obj, _Mapping):  # see SQLiteSource
+        return dict(obj)
+    return str(obj)
+
+
+def _json_dumps_line(obj):
+    import json
+    return (json.dumps(obj, default=_json_default) + '\n').encode('utf8')
+
+
+class ConfServer(object):
+    """A server which owns the configuration (parsing and validation)
+    and serves it over a UNIX domain socket as newline-delimited JSON,
+    so that other processes (sidecars, CLI tools, ...) can get the
+    validated configuration without parsing anything.
+
+    Configuration classes are supposed to be registered and parsed
+    before starting the server. reload() re-parses the configuration
+    and pushes it to all subscribed clients.
+
+    >>> parse('config.yaml')
+    >>> server = ConfServer('/run/myapp/confix.sock')
+    >>> server.start()  # serve in a background thread
+    >>> ...
+    >>> server.reload()  # config file changed
+
+    Protocol: a client sends {"cmd": "get"} and receives
+    {"version": n, "conf": {...}}; if it sends {"cmd": "subscribe"}
+    instead the connection is kept open and a new {"version", "conf"}
+    message is pushed on every reload().
+
+    Writing to a client which doesn't read fails after *send_timeout*
+    seconds, in which case the client is disconnected.
+    """
+
+    def __init__(self, path, send_timeout=5.0):
+        import socket
+        import socketserver  # py3
+        import struct
+        server = self
+
+        class Handler(socketserver.StreamRequestHandler):
+
+            def setup(self):
+                socketserver.StreamRequestHandler.setup(self)
+                # only for sending: subscribers may not send anything
+                # for a long time
+                secs = int(send_timeout)
+                self.request.setsockopt(
+                    socket.SOL_SOCKET, socket.SO_SNDTIMEO,
+                    struct.pack('ll', secs,
+                                int((send_timeout - secs) * 1e6)))
+                # serializes our writes with the ones of _push()
+                self.write_lock = threading.Lock()
+
+            def send(self, data):
+                """Write data; on failure (e.g. send timeout) close the
+                connection and return False.
+                """
+                try:
+                    with self.write_lock:
+                        self.wfile.write(data)
+                    return True
+                except (OSError, ValueError):
+                    server._unsubscribe(self)
+                    try:
+                        self.request.shutdown(socket.SHUT_RDWR)
+                    except OSError:
+                        pass
+                    return False
+
+            def handle(self):
+                import json
+                for line in self.rfile:
+                    try:
+                        cmd = json.loads(line.decode('utf8'))['cmd']
+                    except (ValueError, KeyError, TypeError):
+                        data = _json_dumps_line(
+                            dict(error="invalid request %r" % line))
+                    else:
+                        if cmd == 'get':
+                            data = server._payload()
+                        elif cmd == 'subscribe':
+                            data = server._subscribe(self)
+                        else:
+                            data = _json_dumps_line(
+                                dict(error="unknown command %r" % cmd))
+                    if not self.send(data):
+                        return
+
+            def finish(self):
+                server._unsubscribe(self)
+                socketserver.StreamRequestHandler.finish(self)
+
+        class Server(socketserver.ThreadingMixIn,
+                     socketserver.UnixStreamServer):
+            daemon_threads = True
+
+        _remove_socket(path)  # stale socket
+        self.path = path
+        self.version = 0
+        self._cond_lock = threading.Lock()
+        self._subscribers = []
+        self._cached_payload = None
+        self._thread = None
+        self._server = Server(path, Handler)
+
+    def __repr__(self):
+        return "<%s path=%r version=%s>" % (
+            self.__class__.__name__, self.path, self.version)
+
+    def _payload(self):
+        with self._cond_lock:
+            if self._cached_payload is None:
+                self._cached_payload = _json_dumps_line(
+                    dict(version=self.version, conf=get_parsed_conf()))
+            return self._cached_payload
+
+    def _subscribe(self, handler):
+        """Add a subscriber and return the payload to send it."""
+        payload = self._payload()
+        with self._cond_lock:
+            self._subscribers.append(handler)
+        return payload
+
+    def _unsubscribe(self, handler):
+        with self._cond_lock:
+            if handler in self._subscribers:
+                self._subscribers.remove(handler)
+
+    def _push(self):
+        with self._cond_lock:
+            self.version += 1
+            self._cached_payload = None
+        payload = self._payload()
+        with self._cond_lock:
+            subscribers = self._subscribers[:]
+        # write without holding the lock: a client which doesn't read
+        # must not block reload(), other subscribers and "get"
+        # requests (failing ones are disconnected by send())
+        for handler in subscribers:
+            handler.send(payload)
+
+    def reload(self, **kwargs):
+        """Re-parse configuration via confix.reload() (accepting the
+        same arguments) and push it to subscribed clients.
+        """
+        reload(**kwargs)
+        self._push()
+
+    def serve_forever(self):
+        """Serve requests until shutdown() is called."""
+        get_parsed_conf()  # raise NotParsedError early
+        self._server.serve_forever()
+
+    def start(self):
+        """Serve requests in a background (daemon) thread."""
+        get_parsed_conf()  # raise NotParsedError early
+        self._thread = threading.Thread(target=self._server.serve_forever)
+        self._thread.daemon = True
+        self._thread.start()
+
+    def shutdown(self):
+        """Stop serving and remove the socket file."""
+        if self._thread is not None:
+            self._server.shutdown()
+            self._thread.join()
+            self._thread = None
+        self._server.server_close()
+        with self._cond_lock:
+            del self._subscribers[:]
+        try:
+            _remove_socket(self.path)
+        except Error:
+            pass  # replaced by something else in the meantime
+
+
+def _remove_socket(path):
+    """Remove a UNIX socket file, if it exists. Raise Error if *path*
+    is not a socket.
+    """
+    import stat
+    try:
+        st = os.lstat(path)
+    except OSError:
+        return
+    if not stat.S_ISSOCK(st.st_mode):
+        raise Error("%r exists and is not a socket" % path)
+    os.remove(path)
+
+
+class ConfClient(object):
+    """Client for ConfServer keeping a local cached copy of the
+    configuration (a dict in the same format returned by
+    get_parsed_conf()).
+    If *subscribe* is True a background thread receives the new
+    configuration pushed by the server on reload, else it is fetched
+    once.
+
+    >>> client = ConfClient('/run/myapp/confix.sock')
+    >>> client.conf['ftp']['port']
+    21
+    """
+
+    def __init__(self, path, subscribe=True, timeout=5.0):
+        import socket
+        self.path = path
+        self.version = None
+        self._conf = None
+        self._thread = None
+        self._sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self._sock.settimeout(timeout)
+        self._sock.connect(path)
+        self._rfile = self._sock.makefile('rb')
+        cmd = 'subscribe' if subscribe else 'get'
+        self._sock.sendall(_json_dumps_line(dict(cmd=cmd)))
+        self._update(self._rfile.readline())
+        if subscribe:
+            self._sock.settimeout(None)
+            self._thread = threading.Thread(target=self._recv_loop)
+            self._thread.daemon = True
+            self._thread.start()
+
+    def __repr__(self):
+        return "<%s path=%r version=%s>" % (
+            self.__class__.__name__, self.path, self.version)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def _update(self, line):
+        import json
+        if not line:
+            raise Error("connection closed by confix server")
+        msg = json.loads(line.decode('utf8'))
+        if 'error' in msg:
+            raise Error(msg['error'])
+        if self.version is not None and msg['version'] < self.version:
+            # pushed concurrently by multiple reload()s
+            return
+        # replace the whole dict at once: readers always get a
+        # consistent configuration
+        self._conf = msg['conf']
+        self.version = msg['version']
+
+    def _recv_loop(self):
+        while True:
+            try:
+                line = self._rfile.readline()
+            except (OSError, ValueError):
+                return
+            if not line:
+                return
+            self._update(line)
+
+    @property
+    def conf(self):
+        """The last configuration received from the server."""
+        return self._conf
+
+    def close(self):
+        """Close the connection with the server."""
+        import socket
+        try:
+            self._sock.shutdown(socket.SHUT_RDWR)
+        except OSError:
+            pass
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+        self._rfile.close()
+        self._sock.close()
+
+
+# =============================================================================
+# command line interface
+# =============================================================================
+
+
+def _import_classes(modules):
+    """Import the modules which register() the conf classes."""
+    import importlib
+    for name in modules:
+        importlib.import_module(name)
+    if not _conf_map:
+        if modules:
+            raise Error("no configuration classes were registered by %s" %
+                        ', '.join(modules))
+        raise Error("no configuration classes were registered (use -m)")
+
+
+def _cmd_compile(args):
+    _import_classes(args.modules)
+    out = args.output or os.path.splitext(args.conf_file)[0] + _COMPILED_EXT
+    compile_conf(args.conf_file, out)
+    print("written %s" % out)
+
+
+def _cmd_generate(args):
+    _import_classes(args.modules)
+    generate_module(args.conf_file, args.output)
+    print("written %s" % args.output)
+
+
+def _cmd_validate(args):
+    _import_classes(args.modules)
+    report = validate_files(args.files, modules=args.modules,
+                            processes=args.jobs,
+                            interpolate=args.interpolate)
+    for res in report.results:
+        if not res.ok:
+            print("%s: %s: %s" % (res.file, res.error_type, res.error))
+        elif args.verbose:
+            print("%s: ok" % res.file)
+    print("validated %s files (%s failed) in %.2fs (%.1f files/sec)" % (
+        len(report.results), len(report.failed), report.elapsed,
+        report.files_per_sec))
+    return 1 if report.failed else 0
+
+
+def _cli_parse(args, stats_callback=None):
+    _import_classes(args.modules)
+    fun = parse_with_envvars if args.envvars else parse
+    fun(args.conf_file, stats_callback=stats_callback,
+        interpolate=args.interpolate)
+
+
+def _cmd_dump(args):
+    import json
+    _cli_parse(args)
+    print(json.dumps(get_parsed_conf(), indent=4, sort_keys=True,
+                     default=_json_default))
+
+
+def _cmd_timing(args):
+    _cli_parse(args)
+    stats = get_parse_stats()
+    print("%-16s %12s" % ("phase", "secs"))
+    for phase, secs in stats.timings.items():
+        print("%-16s %12.6f" % (phase, secs))
+    print("")
+    print("keys processed: %s" % stats.keys_processed)
+    print("validators run: %s" % stats.validators_run)
+    if stats.dedup_saved_bytes:
+        print("dedup saved bytes: %s" % stats.dedup_saved_bytes)
+    if stats.validator_timings:
+        print("")
+        print("%-40s %12s" % ("validator", "secs"))
+        timings = sorted(stats.validator_timings.items(),
+                         key=lambda x: x[1], reverse=True)
+        for name, secs in timings[:args.top]:
+            print("%-40s %12.6f" % (name, secs))
+
+
+def _cmd_bench(args):
+    if args.conf_file is None:
+        return _run_bench_suite(args.extra)
+    if args.extra:
+        raise ValueError("unrecognized arguments: %s" % ' '.join(args.extra))
+    if args.number < 1:
+        raise ValueError("--number must be >= 1")
+    runs = []
+    _cli_parse(args, stats_callback=runs.append)
+    for _ in range(args.number - 1):
+        reload(stats_callback=runs.append)
+    print("parsed %s %s times" % (args.conf_file, len(runs)))
+    print("%-16s %12s %12s %12s" % ("phase", "min", "median", "max"))
+    for phase in ParseStats._PHASES:
+        timings = sorted(x.timings[phase] for x in runs)
+        print("%-16s %12.6f %12.6f %12.6f" % (
+            phase, timings[0], timings[len(timings) // 2], timings[-1]))
+
+
+def _run_bench_suite(argv):
+    """Run the benchmark suite (scripts/bench.py) which is only
+    available in a source checkout.
+    """
+    import runpy
+    path = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                        'scripts', 'bench.py')
+    if not os.path.isfile(path):
+        raise Error("the benchmark suite (scripts/bench.py) is available in "
+                    "a source checkout only; specify a configuration file "
+                    "to benchmark it")
+    old_argv = sys.argv
+    sys.argv = [path] + list(argv)
+    try:
+        runpy.run_path(path, run_name='__main__')
+    finally:
+        sys.argv = old_argv
+
+
+def _main(argv=None):
+    """Command line entry point ("python -m confix")."""
+    import argparse
+    parser = argparse.ArgumentParser(
+        prog='confix',
+        description="Validate and process configuration files.")
+    subparsers = parser.add_subparsers(dest='command', metavar='command')
+    subparsers.required = True
+
+    def add_command(name, fun, help):
+        sub = subparsers.add_parser(name, help=help, description=help)
+        sub.add_argument('-m', '--module', action='append', default=[],
+                         dest='modules',
+                         help="module registering the configuration classes "
+                              "(can be repeated)")
+        sub.set_defaults(fun=fun)
+        return sub
+
+    def add_interpolate_option(sub):
+        sub.add_argument('-i', '--interpolate', action='store_true',
+                         help="resolve ${name} references in values")
+
+    sub = add_command(
+        'compile', _cmd_compile,
+        "validate a configuration file and write it in binary format "
+        "(%s) so that parse() can load it without deserializing and "
+        "validating it again" % _COMPILED_EXT)
+    sub.add_argument('conf_file')
+    sub.add_argument('-o', '--output',
+                     help="output file (default: CONF_FILE with %s "
+                          "extension)" % _COMPILED_EXT)
+
+    sub = add_command(
+        'generate', _cmd_generate,
+        "validate a configuration file and write it as a Python module "
+        "of constants which can be loaded via confix.import_conf()")
+    sub.add_argument('conf_file')
+    sub.add_argument('-o', '--output', required=True,
+                     help="output Python file")
+
+    sub = add_command(
+        'validate', _cmd_validate,
+        "validate one or more configuration files (directories are "
+        "searched recursively) in parallel")
+    sub.add_argument('files', nargs='+', metavar='file')
+    sub.add_argument('-j', '--jobs', type=int,
+                     help="number of worker processes (default: number of "
+                          "CPUs)")
+    sub.add_argument('-v', '--verbose', action='store_true',
+                     help="also print valid files")
+    add_interpolate_option(sub)
+
+    def add_parse_command(name, fun, help, conf_file_help=None):
+        sub = add_command(name, fun, help)
+        if conf_file_help is None:
+            sub.add_argument('conf_file')
+        else:
+            sub.add_argument('conf_file', nargs='?', help=conf_file_help)
+        sub.add_argument('-e', '--envvars', action='store_true',
+                         help="take environment variables into account")
+        add_interpolate_option(sub)
+        return sub
+
+    add_parse_command(
+        'dump', _cmd_dump,
+        "parse a configuration file and print the resulting configuration "
+        "(including default values) as JSON")
+
+    sub = add_parse_command(
+        'timing', _cmd_timing,
+        "parse a configuration file and print the time spent in each phase "
+        "of the parse pipeline and by validators")
+    sub.add_argument('--top', type=int, default=10,
+                     help="number of slowest validators to show (default 10)")
+
+    sub = add_parse_command(
+        'bench', _cmd_bench,
+        "parse a configuration file many times and print min / median / "
+        "max timings of each phase of the parse pipeline",
+        conf_file_help="if not specified run the benchmark suite "
+                       "(scripts/bench.py, source checkout only) passing "
+                       "it any extra argument")
+    sub.add_argument('-n', '--number', type=int, default=100,
+                     help="number of times to parse it (default 100)")
+
+    args, extra = parser.parse_known_args(argv)
+    if args.fun is _cmd_bench:
+        args.extra = extra
+    elif extra:
+        parser.error("unrecognized arguments: %s" % ' '.join(extra))
+    # the modules are supposed to be importable from cwd
+    if '' not in sys.path:
+        sys.path.insert(0, '')
+    try:
+        return args.fun(args) or 0
+    except (Error, EnvironmentError, ImportError, ValueError) as err:
+        parser.exit(1, "confix: error: %s\n" % err)
 
 
 if not _PY3:
     del num
+
+
+if __name__ == '__main__':
+    # conf classes are registered against the "confix" module, not
+    # "__main__"
+    import confix
+    sys.exit(confix._main())
@@ -0,0 +1,936 @@
+#!/usr/bin/env python
+
+"""
+Benchmark confix throughput across file formats and config sizes.
+
+A synthetic configuration made of N sections x M keys (a mix of plain
+values and schemas with validators) is generated, serialized in all the
+supported formats and then parsed over and over, measuring parse(),
+parse_with_envvars(), get_parsed_conf() and register() time plus the
+peak memory allocated by parse().
+Results are reproducible as the generated data only depends on the
+command line arguments.
+
+$ python scripts/bench.py
+$ python scripts/bench.py --sections 100 --keys 50 --formats json,yaml
+$ python scripts/bench.py --repeat 20 --json
+
+--memory measures (via tracemalloc) the peak and retained memory
+allocated by parse() and compares them with the size of the raw
+deserialized dict and the size reported by confix.get_memory_usage():
+
+$ python scripts/bench.py --memory --sections 200 --keys 200
+
+--import-time measures "import confix" via "python -X importtime", then
+register() + parse() of a small JSON file in the same interpreter, and
+fails (exit code 1) if either exceeds its budget or if any of the modules
+which are supposed to be imported lazily gets imported:
+
+$ python scripts/bench.py --import-time
+
+--scaling parses configs of 1k, 10k and 100k keys split in 1, 100 and
+1000 sections and fails (exit code 1) if the time per key grows more
+than linearly with the total number of keys:
+
+$ python scripts/bench.py --scaling
+
+--codegen compares the generic processing code against the functions
+generated for classes registered with compiled=True, measuring reload()
+(the config file is always JSON):
+
+$ python scripts/bench.py --codegen --sections 10 --keys 1000
+
+A fixed set of microbenchmarks can also be compared against a stored
+baseline, failing (exit code 1) if any case got slower than the
+baseline tolerance allows. Timings are normalized against a pure Python
+calibration loop so that the baseline is (mostly) independent from the
+speed of the machine. Both the baseline and the check use the per-case
+median of a few runs, as a single run of sub-millisecond cases is noise:
+
+$ python scripts/bench.py --save-baseline scripts/bench_baseline.json
+$ python scripts/bench.py --check scripts/bench_baseline.json
+"""
+
+from __future__ import print_function
+import argparse
+import functools
+import gc
+import json
+import os
+import random
+import shutil
+import subprocess
+import sys
+import tempfile
+import textwrap
+try:
+    import configparser  # py3
+except ImportError:
+    import ConfigParser as configparser
+try:
+    import tracemalloc  # py3.4+
+except ImportError:
+    tracemalloc = None
+
+HERE = os.path.abspath(os.path.dirname(__file__))
+ROOT = os.path.realpath(os.path.join(HERE, '..'))
+sys.path.insert(0, ROOT)
+
+import confix  # NOQA
+from confix import _timer  # NOQA
+
+
+FORMATS = ('json', 'yaml', 'toml', 'ini')
+SEED = 1234
+BASELINE = os.path.join(HERE, 'bench_baseline.json')
+# --- regression check parameters
+MICRO_SECTIONS = 10
+MICRO_KEYS = 20
+MICRO_REPEAT = 50
+DEFAULT_TOLERANCE = 0.30  # 30%
+BASELINE_RUNS = 3
+# --- scaling parameters
+SCALING_KEYS = (1000, 10000, 100000)
+SCALING_SECTIONS = (1, 100, 1000)
+SCALING_REPEAT = 3
+# max ratio between the time per key of the biggest and the smallest
+# config; 1.0 would be perfectly linear
+SCALING_TOLERANCE = 2.0
+# --- import time parameters
+IMPORT_TIME_BUDGET = 0.015  # secs
+IMPORT_TIME_REPEAT = 10
+# register() + parse() of a small JSON file right after the import
+STARTUP_TIME_BUDGET = 0.002  # secs
+# modules which "import confix" is not supposed to import
+LAZY_MODULES = ('configparser', 'inspect', 'json', 'logging',
+                'multiprocessing', 'pickle', 're', 'socket', 'warnings')
+
+
+# =============================================================================
+# synthetic config generation
+# =============================================================================
+
+
+def _is_positive(value):
+    return value > 0
+
+
+def make_defaults(nsections, nkeys):
+    """Return a {section: {key: default}} dict. Half of the keys are
+    schema()s with one or more validators.
+    """
+    ret = {}
+    for i in range(nsections):
+        section = 'section_%s' % i
+        attrs = {}
+        for j in range(nkeys):
+            key = 's%s_k%s' % (i, j)
+            kind = j % 8
+            if kind == 0:
+                attrs[key] = 1
+            elif kind == 1:
+                attrs[key] = 'value'
+            elif kind == 2:
+                attrs[key] = 1.5
+            elif kind == 3:
+                attrs[key] = False
+            elif kind == 4:
+                attrs[key] = confix.schema(10, validator=_is_positive)
+            elif kind == 5:
+                attrs[key] = confix.schema(
+                    'red', validator=confix.isin(['red', 'green', 'blue']))
+            elif kind == 6:
+                attrs[key] = confix.schema(
+                    'user@domain.com',
+                    validator=[confix.istrue, confix.isemail])
+            else:
+                attrs[key] = confix.schema(
+                    'http://localhost:8080', validator=confix.isurl)
+        ret[section] = attrs
+    return ret
+
+
+def make_conf(defaults, ratio=0.5):
+    """Return a {section: {key: value}} dict overriding a *ratio* of
+    the keys defined in *defaults* with values of the same type.
+    """
+    rand = random.Random(SEED)
+    ret = {}
+    for section, attrs in sorted(defaults.items()):
+        ret[section] = {}
+        for key, default in sorted(attrs.items()):
+            if rand.random() >= ratio:
+                continue
+            if isinstance(default, confix.schema):
+                default = default.default
+            if isinstance(default, bool):
+                value = rand.random() > 0.5
+            elif isinstance(default, int):
+                value = rand.randint(1, 100000)
+            elif isinstance(default, float):
+                value = round(rand.random() * 1000, 3)
+            elif default == 'red':
+                value = rand.choice(['red', 'green', 'blue'])
+            elif '@' in default:
+                value = 'user%s@domain.com' % rand.randint(1, 1000)
+            elif default.startswith('http'):
+                value = 'http://host%s.domain.com' % rand.randint(1, 1000)
+            else:
+                value = 'value-%s' % rand.randint(1, 1000)
+            ret[section][key] = value
+    return ret
+
+
+def register_classes(defaults, compiled=False):
+    for section, attrs in sorted(defaults.items()):
+        confix.register(section, compiled=compiled)(
+            type(section, (object, ), dict(attrs)))
+
+
+# =============================================================================
+# serializers
+# =============================================================================
+
+
+def dump_json(conf, file):
+    json.dump(conf, file)
+
+
+def dump_yaml(conf, file):
+    import yaml  # requires "pip install pyyaml"
+    yaml.safe_dump(conf, file, default_flow_style=False)
+
+
+def dump_toml(conf, file):
+    import toml  # requires "pip install toml"
+    file.write(toml.dumps(conf))
+
+
+def dump_ini(conf, file):
+    config = configparser.RawConfigParser()
+    for section, values in sorted(conf.items()):
+        config.add_section(section)
+        for key, value in sorted(values.items()):
+            if isinstance(value, bool):
+                value = 'true' if value else 'false'
+            config.set(section, key, str(value))
+    config.write(file)
+
+
+DUMPERS = dict(json=dump_json, yaml=dump_yaml, toml=dump_toml, ini=dump_ini)
+
+
+def write_conf_files(conf, formats, tmpdir):
+    """Serialize *conf* in all *formats*; return a {format: path} dict."""
+    ret = {}
+    for fmt in formats:
+        path = os.path.join(tmpdir, 'config.%s' % fmt)
+        with open(path, 'w') as f:
+            DUMPERS[fmt](conf, f)
+        ret[fmt] = path
+    return ret
+
+
+# =============================================================================
+# measurement
+# =============================================================================
+
+
+def measure(fun, setup=None, repeat=10):
+    """Run fun() *repeat* times (calling setup() before each run and
+    excluding it from timing); return a list of timings in seconds.
+    """
+    timings = []
+    gcold = gc.isenabled()
+    gc.disable()  # same as timeit
+    try:
+        for x in range(repeat):
+            if setup is not None:
+                setup()
+            t = _timer()
+            fun()
+            timings.append(_timer() - t)
+    finally:
+        if gcold:
+            gc.enable()
+    return timings
+
+
+def measure_peak_memory(fun, setup=None):
+    """Return the peak memory (in bytes) allocated by fun()."""
+    if tracemalloc is None:
+        return None
+    if setup is not None:
+        setup()
+    tracemalloc.start()
+    try:
+        fun()
+        return tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+
+
+def summarize(name, timings, nkeys, peak_memory=None, phases=None):
+    timings = sorted(timings)
+    ret = dict(name=name,
+               min=timings[0],
+               median=timings[len(timings) // 2],
+               max=timings[-1],
+               keys_per_sec=nkeys / timings[len(timings) // 2],
+               peak_memory=peak_memory)
+    if phases is not None:
+        ret['phases'] = phases
+    return ret
+
+
+def run(nsections, nkeys, formats, repeat, ratio):
+    defaults = make_defaults(nsections, nkeys)
+    conf = make_conf(defaults, ratio=ratio)
+    total_keys = nsections * nkeys
+    results = []
+
+    def reset():
+        confix.discard()
+        register_classes(defaults)
+
+    # register()
+    timings = measure(lambda: register_classes(defaults),
+                      setup=confix.discard, repeat=repeat)
+    results.append(summarize('register', timings, total_keys))
+
+    tmpdir = tempfile.mkdtemp(prefix='confix-bench-')
+    try:
+        paths = write_conf_files(conf, formats, tmpdir)
+
+        # parse() for every format
+        for fmt in formats:
+            path = paths[fmt]
+            timings = measure(lambda: confix.parse(path), setup=reset,
+                              repeat=repeat)
+            phases = confix.get_parse_stats().as_dict()['timings']
+            peak = measure_peak_memory(lambda: confix.parse(path),
+                                       setup=reset)
+            results.append(summarize('parse[%s]' % fmt, timings, total_keys,
+                                     peak_memory=peak, phases=phases))
+
+        # parse_with_envvars(): override the keys of the first section
+        fmt = formats[0]
+        path = paths[fmt]
+        env = {}
+        for key, default in sorted(defaults['section_0'].items()):
+            if isinstance(default, confix.schema):
+                default = default.default
+            if not isinstance(default, bool):
+                env[key.upper()] = str(default)
+        old_environ = os.environ.copy()
+        os.environ.update(env)
+        try:
+            timings = measure(lambda: confix.parse_with_envvars(path),
+                              setup=reset, repeat=repeat)
+        finally:
+            os.environ.clear()
+            os.environ.update(old_environ)
+        phases = confix.get_parse_stats().as_dict()['timings']
+        results.append(summarize('parse_with_envvars[%s]' % fmt, timings,
+                                 total_keys, phases=phases))
+
+        # get_parsed_conf()
+        reset()
+        confix.parse(path)
+        timings = measure(confix.get_parsed_conf, repeat=repeat)
+        results.append(summarize('get_parsed_conf', timings, total_keys))
+    finally:
+        confix.discard()
+        shutil.rmtree(tmpdir)
+    return results
+
+
+# =============================================================================
+# memory
+# =============================================================================
+
+
+PARSERS = dict(json=confix.parse_json, yaml=confix.parse_yaml,
+               toml=confix.parse_toml, ini=confix.parse_ini)
+
+
+def measure_memory(fun, setup=None):
+    """Return a (peak, retained) tuple of the memory (in bytes)
+    allocated by fun(); retained is what is still allocated after fun()
+    returned and a GC run.
+    """
+    if setup is not None:
+        setup()
+    gc.collect()
+    tracemalloc.start()
+    try:
+        fun()
+        gc.collect()
+        retained, peak = tracemalloc.get_traced_memory()
+        return peak, retained
+    finally:
+        tracemalloc.stop()
+
+
+def run_memory(nsections, nkeys, formats, ratio, top=10):
+    if tracemalloc is None:
+        sys.exit("tracemalloc module is not available")
+    defaults = make_defaults(nsections, nkeys)
+    conf = make_conf(defaults, ratio=ratio)
+    results = []
+
+    def reset():
+        confix.discard()
+        register_classes(defaults)
+
+    tmpdir = tempfile.mkdtemp(prefix='confix-bench-')
+    try:
+        paths = write_conf_files(conf, formats, tmpdir)
+        for fmt in formats:
+            path = paths[fmt]
+            with open(path) as f:
+                raw = confix._sizeof(PARSERS[fmt](f), set())
+            peak, retained = measure_memory(
+                lambda: confix.parse(path), setup=reset)
+            usage = confix.get_memory_usage()
+            results.append(dict(name='parse[%s]' % fmt, peak=peak,
+                                retained=retained, raw=raw,
+                                conf=usage['total']))
+        # same as above, deduplicating values
+        path = paths[formats[0]]
+        peak, retained = measure_memory(
+            lambda: confix.parse(path, dedup=True), setup=reset)
+        results.append(dict(name='parse[%s,dedup]' % formats[0], peak=peak,
+                            retained=retained, raw=raw,
+                            conf=confix.get_memory_usage()['total']))
+        usage = confix.get_memory_usage()
+        # the biggest keys of the last parsed configuration
+        keys = []
+        for section, info in usage['sections'].items():
+            for key, size in info['keys'].items():
+                keys.append((size, "%s.%s" % (section, key)))
+        biggest = [dict(key=k, size=size)
+                   for size, k in sorted(keys, reverse=True)[:top]]
+    finally:
+        confix.discard()
+        shutil.rmtree(tmpdir)
+    return results, biggest
+
+
+def print_memory_results(results, biggest, nsections, nkeys):
+    print("%s sections x %s keys = %s keys" % (
+        nsections, nkeys, nsections * nkeys))
+    print()
+    templ = "%-18s %12s %12s %12s %12s"
+    print(templ % ('case', 'peak', 'retained', 'raw-dict', 'parsed-conf'))
+    for res in results:
+        print(templ % (res['name'], fmt_bytes(res['peak']),
+                       fmt_bytes(res['retained']), fmt_bytes(res['raw']),
+                       fmt_bytes(res['conf'])))
+    print()
+    print("biggest setting keys:")
+    for item in biggest:
+        print("  %-40s %10s" % (item['key'], fmt_bytes(item['size'])))
+
+
+# =============================================================================
+# codegen
+# =============================================================================
+
+
+def run_codegen(nsections, nkeys, repeat, ratio):
+    defaults = make_defaults(nsections, nkeys)
+    conf = make_conf(defaults, ratio=ratio)
+    results = []
+    tmpdir = tempfile.mkdtemp(prefix='confix-bench-')
+    try:
+        path = write_conf_files(conf, ['json'], tmpdir)['json']
+        for compiled in (False, True):
+            confix.discard()
+            register_classes(defaults, compiled=compiled)
+            # the first parse() generates the code
+            t = _timer()
+            confix.parse(path)
+            first = _timer() - t
+            process = []
+            timings = measure(
+                lambda: confix.reload(stats_callback=lambda stats: (
+                    process.append(stats.timings['process']))),
+                repeat=repeat)
+            results.append(dict(
+                name='compiled' if compiled else 'generic',
+                first_parse=first,
+                reload=sorted(timings)[len(timings) // 2],
+                process=sorted(process)[len(process) // 2]))
+    finally:
+        confix.discard()
+        shutil.rmtree(tmpdir)
+    return results
+
+
+def print_codegen_results(results, nsections, nkeys, repeat):
+    print("%s sections x %s keys = %s keys, %s runs per case" % (
+        nsections, nkeys, nsections * nkeys, repeat))
+    print()
+    templ = "%-10s %12s %12s %12s"
+    print(templ % ('case', 'first-parse', 'reload', 'process'))
+    for res in results:
+        print(templ % (res['name'], fmt_secs(res['first_parse']),
+                       fmt_secs(res['reload']), fmt_secs(res['process'])))
+    generic, compiled = results
+    print()
+    print("speedup: reload %.2fx, process %.2fx" % (
+        generic['reload'] / compiled['reload'],
+        generic['process'] / compiled['process']))
+
+
+# =============================================================================
+# scaling
+# =============================================================================
+
+
+def run_scaling(repeat=SCALING_REPEAT):
+    """Return a list of dicts with the time per key spent by parse()
+    and get_parsed_conf() for every (total keys, sections) combination.
+    """
+    results = []
+    tmpdir = tempfile.mkdtemp(prefix='confix-bench-')
+    try:
+        for nsections in SCALING_SECTIONS:
+            for total in SCALING_KEYS:
+                if nsections > total:
+                    continue
+                defaults = make_defaults(nsections, total // nsections)
+                conf = make_conf(defaults)
+                path = write_conf_files(conf, ['json'], tmpdir)['json']
+
+                def reset():
+                    confix.discard()
+                    register_classes(defaults)
+
+                parse = min(measure(lambda: confix.parse(path),
+                                    setup=reset, repeat=repeat))
+                get = min(measure(confix.get_parsed_conf, repeat=repeat))
+                results.append(dict(keys=total, sections=nsections,
+                                    parse=parse / total, get=get / total))
+    finally:
+        confix.discard()
+        shutil.rmtree(tmpdir)
+    return results
+
+
+def check_scaling(results, tolerance=SCALING_TOLERANCE):
+    """Return a list of error strings for the section counts whose
+    time per key grew more than *tolerance* times from the smallest to
+    the biggest config.
+    """
+    errors = []
+    for nsections in SCALING_SECTIONS:
+        rows = sorted([x for x in results if x['sections'] == nsections],
+                      key=lambda x: x['keys'])
+        if len(rows) < 2:
+            continue
+        for name in ('parse', 'get'):
+            ratio = rows[-1][name] / rows[0][name]
+            if ratio > tolerance:
+                errors.append(
+                    "%s() with %s sections: time per key grew %.2fx from "
+                    "%s to %s keys (tolerance %.2fx)" % (
+                        name, nsections, ratio, rows[0]['keys'],
+                        rows[-1]['keys'], tolerance))
+    return errors
+
+
+def print_scaling_results(results):
+    templ = "%-10s %10s %16s %16s"
+    print(templ % ('keys', 'sections', 'parse/key', 'get_conf/key'))
+    for res in results:
+        print(templ % (res['keys'], res['sections'], fmt_secs(res['parse']),
+                       fmt_secs(res['get'])))
+
+
+# =============================================================================
+# import time
+# =============================================================================
+
+
+def measure_import_time(repeat=IMPORT_TIME_REPEAT):
+    """Return a (import_secs, startup_secs, imported) tuple where
+    *import_secs* is the min cumulative time spent importing confix as
+    reported by "python -X importtime" in a fresh interpreter,
+    *startup_secs* the min time of a following register() + parse() of
+    a JSON file (what a short-lived CLI tool does) and *imported* the
+    list of LAZY_MODULES which got imported by the two steps. json
+    (and the modules it needs) is imported before the second step.
+    """
+    env = os.environ.copy()
+    env.pop('PYTHONDONTWRITEBYTECODE', None)  # we want a warm .pyc
+    env['PYTHONPATH'] = ROOT
+    code = textwrap.dedent("""
+        import sys
+        before = set(sys.modules)
+        import confix
+        print(' '.join(sorted(set(sys.modules) - before)))
+        import json  # NOQA
+        before = set(sys.modules)
+        t = confix._timer()
+
+        @confix.register()
+        class config:
+            foo = 1
+            bar = 'x'
+
+        confix.parse(sys.argv[1])
+        print(confix._timer() - t)
+        print(' '.join(sorted(set(sys.modules) - before)))
+        """)
+    tmpdir = tempfile.mkdtemp(prefix='confix-bench-')
+    try:
+        path = os.path.join(tmpdir, 'conf.json')
+        with open(path, 'w') as f:
+            json.dump(dict(foo=2, bar='y'), f)
+        import_timings = []
+        startup_timings = []
+        imported = set()
+        for x in range(repeat + 1):
+            p = subprocess.Popen(
+                [sys.executable, '-X', 'importtime', '-c', code, path],
+                stdout=subprocess.PIPE, stderr=subprocess.PIPE,
+                env=env, cwd=ROOT, universal_newlines=True)
+            stdout, stderr = p.communicate()
+            if p.returncode != 0:
+                sys.exit(stderr)
+            if x == 0:
+                continue  # first run writes the .pyc
+            lines = stdout.split('\n')
+            imported.update(lines[0].split())
+            startup_timings.append(float(lines[1]))
+            imported.update(lines[2].split())
+            for line in stderr.splitlines():
+                # "import time: self [us] | cumulative | imported package"
+                fields = [f.strip() for f in line.split(':', 1)[1].split('|')]
+                if fields[2] == 'confix':
+                    import_timings.append(int(fields[1]) / 1000000.0)
+    finally:
+        shutil.rmtree(tmpdir)
+    return (min(import_timings), min(startup_timings),
+            sorted(set(LAZY_MODULES) & imported))
+
+
+def check_import_time(budget=IMPORT_TIME_BUDGET,
+                      startup_budget=STARTUP_TIME_BUDGET):
+    secs, startup_secs, imported = measure_import_time()
+    print("import confix: %s (budget %s)" % (
+        fmt_secs(secs), fmt_secs(budget)))
+    print("register() + parse() JSON: %s (budget %s)" % (
+        fmt_secs(startup_secs), fmt_secs(startup_budget)))
+    errors = []
+    if secs > budget:
+        errors.append("import time exceeds budget")
+    if startup_secs > startup_budget:
+        errors.append("register() + parse() time exceeds budget")
+    if imported:
+        errors.append("modules imported eagerly: %s" % ', '.join(imported))
+    return errors
+
+
+# =============================================================================
+# regression check
+# =============================================================================
+
+
+def calibrate(repeat=MICRO_REPEAT):
+    """Time a fixed pure Python workload (dict / attribute / string
+    operations, i.e. what confix mostly does) used to normalize timings.
+    """
+    def workload():
+        d = {}
+        for x in range(20000):
+            key = 'key_%s' % x
+            d[key] = x
+            isinstance(d[key], int)
+            getattr(d, 'get')
+    return min(measure(workload, repeat=repeat // 5 or 1))
+
+
+def micro_cases(tmpdir):
+    """Return a list of (name, fun, setup) tuples. Cases whose format
+    dependency is not installed are skipped.
+    """
+    defaults = make_defaults(MICRO_SECTIONS, MICRO_KEYS)
+    conf = make_conf(defaults)
+    formats = []
+    for fmt, module in (('json', None), ('yaml', 'yaml'), ('toml', 'toml'),
+                        ('ini', None)):
+        if module is not None:
+            try:
+                __import__(module)
+            except ImportError:
+                continue
+        formats.append(fmt)
+    paths = write_conf_files(conf, formats, tmpdir)
+
+    # schema-only classes: all keys have validators
+    validator_defaults = dict(
+        (section, dict((k, v) for k, v in attrs.items()
+                       if isinstance(v, confix.schema)))
+        for section, attrs in defaults.items())
+    validator_conf = dict(
+        (section, dict((k, v) for k, v in values.items()
+                       if k in validator_defaults[section]))
+        for section, values in conf.items())
+    validator_path = os.path.join(tmpdir, 'validators.json')
+    with open(validator_path, 'w') as f:
+        dump_json(validator_conf, f)
+
+    def reset(dfl=defaults):
+        confix.discard()
+        register_classes(dfl)
+
+    def parsed():
+        reset()
+        confix.parse(paths['json'])
+
+    cases = [('register', lambda: register_classes(defaults), confix.discard)]
+    for fmt in formats:
+        cases.append(('parse[%s]' % fmt,
+                      functools.partial(confix.parse, paths[fmt]), reset))
+    cases.append(('parse_with_envvars',
+                  functools.partial(confix.parse_with_envvars, paths['json']),
+                  reset))
+    cases.append(('validators',
+                  functools.partial(confix.parse, validator_path),
+                  functools.partial(reset, validator_defaults)))
+    cases.append(('get_parsed_conf', confix.get_parsed_conf, parsed))
+    return cases
+
+
+def run_micro(repeat=MICRO_REPEAT):
+    """Run the microbenchmarks; return a {name: normalized_time} dict
+    plus the (fastest) calibration time.
+    """
+    tmpdir = tempfile.mkdtemp(prefix='confix-bench-')
+    env = dict(('S0_K%s' % x, '1') for x in range(0, MICRO_KEYS, 8))
+    old_environ = os.environ.copy()
+    os.environ.update(env)
+    try:
+        ret = {}
+        calibrations = []
+        for name, fun, setup in micro_cases(tmpdir):
+            # Calibrate right before each case in order to compensate
+            # for CPU frequency drifts during the run.
+            calibration = calibrate(repeat)
+            calibrations.append(calibration)
+            ret[name] = min(measure(fun, setup=setup, repeat=repeat)) / \
+                calibration
+        return ret, min(calibrations)
+    finally:
+        os.environ.clear()
+        os.environ.update(old_environ)
+        confix.discard()
+        shutil.rmtree(tmpdir)
+
+
+def run_micro_median(repeat=MICRO_REPEAT, runs=BASELINE_RUNS):
+    """Call run_micro() *runs* times; return the per-case median
+    {name: normalized_time} dict plus the fastest calibration time.
+    A single (min-of-repeat) run of a sub-millisecond case is too noisy
+    to be compared against a tolerance.
+    """
+    results = [run_micro(repeat) for x in range(runs)]
+    calibration = min(x[1] for x in results)
+    ratios = {}
+    for name in results[0][0]:
+        values = sorted(x[0][name] for x in results)
+        ratios[name] = values[len(values) // 2]
+    return ratios, calibration
+
+
+def save_baseline(path, repeat=MICRO_REPEAT, runs=BASELINE_RUNS):
+    # per-case median of a few runs, so that a single lucky (fast) run
+    # does not end up in the baseline
+    ratios, calibration = run_micro_median(repeat, runs)
+    data = dict(
+        tolerance=DEFAULT_TOLERANCE,
+        calibration=calibration,
+        python=sys.version.split()[0],
+        cases=dict((name, dict(ratio=round(ratio, 4)))
+                   for name, ratio in sorted(ratios.items())))
+    with open(path, 'w') as f:
+        json.dump(data, f, indent=4, sort_keys=True)
+        f.write('\n')
+    print("baseline written to %s" % path)
+
+
+def check_baseline(path, repeat=MICRO_REPEAT, tolerance=None,
+                   runs=BASELINE_RUNS):
+    """Compare microbenchmarks (the per-case median of *runs* runs,
+    same as the baseline) against the baseline stored in *path*;
+    return the list of regressed cases.
+    """
+    with open(path) as f:
+        baseline = json.load(f)
+    ratios, calibration = run_micro_median(repeat, runs)
+    regressions = []
+    templ = "%-20s %10s %10s %8s %8s  %s"
+    print(templ % ('case', 'baseline', 'current', 'delta', 'limit', ''))
+    for name, case in sorted(baseline['cases'].items()):
+        tol = case.get('tolerance', tolerance or baseline['tolerance'])
+        if name not in ratios:
+            print(templ % (name, "%.3f" % case['ratio'], '-', '-', '-',
+                           'SKIPPED'))
+            continue
+        current = ratios[name]
+        delta = (current - case['ratio']) / case['ratio']
+        failed = delta > tol
+        if failed:
+            regressions.append(name)
+        print(templ % (name, "%.3f" % case['ratio'], "%.3f" % current,
+                       "%+.1f%%" % (delta * 100), "+%.0f%%" % (tol * 100),
+                       'REGRESSION' if failed else 'ok'))
+    return regressions
+
+
+# =============================================================================
+# output
+# =============================================================================
+
+
+def fmt_secs(secs):
+    if secs < 0.001:
+        return "%.1fus" % (secs * 1000000)
+    if secs < 1:
+        return "%.2fms" % (secs * 1000)
+    return "%.2fs" % secs
+
+
+def fmt_bytes(n):
+    if n is None:
+        return '-'
+    for unit in ('B', 'K', 'M', 'G'):
+        if n < 1024:
+            return "%.1f%s" % (n, unit)
+        n /= 1024.0
+    return "%.1fT" % n
+
+
+def print_results(results, nsections, nkeys, repeat):
+    print("%s sections x %s keys = %s keys, %s runs per case" % (
+        nsections, nkeys, nsections * nkeys, repeat))
+    print()
+    templ = "%-26s %10s %10s %10s %12s %10s %12s"
+    print(templ % ('case', 'min', 'median', 'max', 'keys/sec', 'peak-mem',
+                   'deserialize'))
+    for res in results:
+        phases = res.get('phases')
+        print(templ % (
+            res['name'],
+            fmt_secs(res['min']),
+            fmt_secs(res['median']),
+            fmt_secs(res['max']),
+            "%.0f" % res['keys_per_sec'],
+            fmt_bytes(res['peak_memory']),
+            fmt_secs(phases['deserialize']) if phases else '-'))
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="benchmark confix parse throughput")
+    parser.add_argument('--sections', type=int, default=20,
+                        help="number of config sections (default 20)")
+    parser.add_argument('--keys', type=int, default=50,
+                        help="number of keys per section (default 50)")
+    parser.add_argument('--formats', default=','.join(FORMATS),
+                        help="comma separated list of file formats "
+                             "(default %s)" % ','.join(FORMATS))
+    parser.add_argument('--repeat', type=int, default=10,
+                        help="number of runs per case (default 10)")
+    parser.add_argument('--ratio', type=float, default=0.5,
+                        help="ratio of keys overridden by the config file "
+                             "(default 0.5)")
+    parser.add_argument('--json', action='store_true',
+                        help="print results as JSON")
+    parser.add_argument('--memory', action='store_true',
+                        help="measure peak and retained memory of parse() "
+                             "instead of timings")
+    parser.add_argument('--codegen', action='store_true',
+                        help="compare generic and compiled (generated) "
+                             "processing of conf classes")
+    parser.add_argument('--scaling', action='store_true',
+                        help="check that parse() time grows linearly with "
+                             "the number of keys")
+    parser.add_argument('--import-time', action='store_true',
+                        help="measure 'import confix' time and fail if it "
+                             "exceeds --budget")
+    parser.add_argument('--budget', type=float, default=IMPORT_TIME_BUDGET,
+                        help="import time budget in seconds (default %s)" %
+                             IMPORT_TIME_BUDGET)
+    parser.add_argument('--check', metavar='BASELINE', nargs='?',
+                        const=BASELINE,
+                        help="run microbenchmarks and compare them against "
+                             "a baseline JSON file (default %s); exit with "
+                             "code 1 on regression" % BASELINE)
+    parser.add_argument('--save-baseline', metavar='BASELINE', nargs='?',
+                        const=BASELINE,
+                        help="run microbenchmarks and store results as the "
+                             "new baseline")
+    parser.add_argument('--tolerance', type=float, default=None,
+                        help="override the baseline tolerance (e.g. 0.2 "
+                             "for 20%%)")
+    args = parser.parse_args()
+
+    if args.import_time:
+        errors = check_import_time(args.budget)
+        if errors:
+            sys.exit('; '.join(errors))
+        return
+    if args.scaling:
+        results = run_scaling()
+        if args.json:
+            print(json.dumps(results, indent=4, sort_keys=True))
+        else:
+            print_scaling_results(results)
+        errors = check_scaling(results)
+        if errors:
+            sys.exit('\n'.join(errors))
+        return
+    if args.save_baseline:
+        return save_baseline(args.save_baseline)
+    if args.check:
+        regressions = check_baseline(args.check, tolerance=args.tolerance)
+        if regressions:
+            sys.exit("performance regression in: %s" % ', '.join(regressions))
+        return
+
+    if args.codegen:
+        results = run_codegen(args.sections, args.keys, args.repeat,
+                              args.ratio)
+        if args.json:
+            print(json.dumps(results, indent=4, sort_keys=True))
+        else:
+            print_codegen_results(results, args.sections, args.keys,
+                                  args.repeat)
+        return
+
+    formats = [x.strip() for x in args.formats.split(',') if x.strip()]
+    for fmt in formats:
+        if fmt not in FORMATS:
+            parser.error("unknown format %r" % fmt)
+    if args.memory:
+        results, biggest = run_memory(args.sections, args.keys, formats,
+                                      args.ratio)
+        if args.json:
+            print(json.dumps(dict(results=results, biggest=biggest),
+                             indent=4, sort_keys=True))
+        else:
+            print_memory_results(results, biggest, args.sections, args.keys)
+        return
+    results = run(args.sections, args.keys, formats, args.repeat, args.ratio)
+    if args.json:
+        print(json.dumps(results, indent=4, sort_keys=True))
+    else:
+        print_results(results, args.sections, args.keys, args.repeat)
+
+
+if __name__ == '__main__':
+    main()
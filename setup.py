@@ -47,6 +47,9 @@ def main():
         author_email='g.rodola@gmail.com',
         url='https://pypi.python.org/pypi/confix',
         py_modules=['confix'],
+        entry_points={
+            'console_scripts': ['confix = confix:_main'],
+        },
         keywords=['config', 'yaml', 'toml', 'json', 'ini', 'sensitive',
                   'password'],
         # ...supposed to be installed by user if needed
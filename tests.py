@@ -1,10 +1,20 @@
 import errno
+import functools
 import imp
 import io
 import json
+import math
 import os
+import re
+import shutil
+import socket
+import subprocess
 import sys
+import tempfile
 import textwrap
+import threading
+import time
+import types
 import warnings
 try:
     import configparser  # py3
@@ -669,6 +679,74 @@ class TestIni(BaseTestCase):
             discard()
 
 
+class TestYaml(BaseTestCase):
+    TESTFN = TESTFN + '.yaml'
+    MULTI_DOC = textwrap.dedent("""
+        env: dev
+        port: 8080
+        ---
+        env: prod
+        port: 80
+        ---
+        env: broken: [
+        """)
+
+    def register(self):
+        @register()
+        class config:
+            env = 'dev'
+            port = 0
+
+        return config
+
+    def test_multi_doc_by_index(self):
+        config = self.register()
+        self.write_to_file(self.MULTI_DOC)
+        self.parse(self.TESTFN, file_parser=functools.partial(
+            confix.parse_yaml, document=1))
+        assert config.env == 'prod'
+        assert config.port == 80
+
+    def test_multi_doc_by_key(self):
+        config = self.register()
+        self.write_to_file(self.MULTI_DOC)
+        self.parse(self.TESTFN, file_parser=functools.partial(
+            confix.parse_yaml, document=('env', 'prod')))
+        assert config.env == 'prod'
+        assert config.port == 80
+        discard()
+
+        config = self.register()
+        self.parse(self.TESTFN, file_parser=functools.partial(
+            confix.parse_yaml, document=('port', 8080)))
+        assert config.env == 'dev'
+
+    def test_multi_doc_not_found(self):
+        self.register()
+        self.write_to_file("env: dev\n---\nenv: prod\n")
+        self.assertRaisesRegexp(
+            Error, "no YAML document matching", self.parse, self.TESTFN,
+            file_parser=functools.partial(confix.parse_yaml, document=5))
+        self.assertRaisesRegexp(
+            Error, "no YAML document matching", self.parse, self.TESTFN,
+            file_parser=functools.partial(confix.parse_yaml,
+                                          document=('env', 'test')))
+
+    def test_multi_doc_lazy(self):
+        # the (broken) documents after the selected one are not parsed
+        self.write_to_file(self.MULTI_DOC)
+        with open(self.TESTFN) as f:
+            assert confix.parse_yaml(f, document=0)['env'] == 'dev'
+        with open(self.TESTFN) as f:
+            self.assertRaises(yaml.YAMLError, confix.parse_yaml, f,
+                              document=2)
+
+    def test_multi_doc_invalid_selector(self):
+        file = io.StringIO("a: 1")
+        self.assertRaises(ValueError, confix.parse_yaml, file, document=-1)
+        self.assertRaises(TypeError, confix.parse_yaml, file, document='a')
+
+
 class TestEnvVars(BaseTestCase):
 
     def test_true_type(self):
@@ -876,6 +954,85 @@ class TestSchema(BaseTestCase):
         self.assertRaisesRegexp(
             TypeError, "not callable", schema, default=10, validator=['foo'])
 
+    def test_validate_default_value(self):
+        # Validators of schemas which are not overridden receive the
+        # default value, not the schema itself.
+        values = []
+
+        @register()
+        class config:
+            foo = schema(10, validator=lambda x: values.append(x) or True)
+
+        parse()
+        assert values == [10]
+
+    def test_array(self):
+        import array
+        self.assertRaisesRegexp(
+            ValueError, "invalid array typecode", schema, default=[],
+            array='x')
+
+        values = []
+
+        @register('sub')
+        class config:
+            buckets = schema([], validator=lambda x: values.append(x) or 1,
+                             array='d')
+            weights = schema([1, 2], array='i')
+            nope = schema(None, array='i')
+
+        fname = TESTFN + '.json'
+        self.addCleanup(safe_remove, fname)
+        self.write_to_file(json.dumps(dict(sub=dict(buckets=[0.1, 1, 10]))),
+                           fname=fname)
+        parse(fname)
+        # validators receive the list
+        assert values == [[0.1, 1, 10]]
+        assert config.buckets == array.array('d', [0.1, 1.0, 10.0])
+        # defaults are converted as well
+        assert config.weights == array.array('i', [1, 2])
+        assert config.nope is None
+        # snapshots
+        data = confix.snapshot()
+        confix.restore(data)
+        assert config.buckets == array.array('d', [0.1, 1.0, 10.0])
+
+    def test_array_type_mismatch(self):
+        for compiled in (False, True):
+            for value in ([1, 'foo'], [1.5], [2 ** 70], 'foo', dict(a=1)):
+                @register('sub', compiled=compiled)
+                class config:
+                    weights = schema([], array='i')
+
+                fname = TESTFN + '.json'
+                self.addCleanup(safe_remove, fname)
+                self.write_to_file(json.dumps(dict(sub=dict(weights=value))),
+                                   fname=fname)
+                with self.assertRaises(TypesMismatchError) as cm:
+                    parse(fname)
+                assert cm.exception.key == 'weights'
+                assert cm.exception.new_value == value
+                discard()
+
+                @register('sub', compiled=compiled)
+                class config:  # NOQA
+                    weights = schema([], array='i')
+
+                parse(fname, type_check=False)
+                assert config.weights == value
+                discard()
+
+    def test_array_envvar(self):
+        import array
+
+        @register()
+        class config:
+            weights = schema([1], array='q')
+
+        os.environ['WEIGHTS'] = '1,2,3'
+        parse_with_envvars()
+        assert config.weights == array.array('q', [1, 2, 3])
+
 
 # ===================================================================
 # exception classes tests
@@ -919,6 +1076,10 @@ class TestExceptions(BaseTestCase):
             "config file provides setting key 'foo' with value 'bar' but " \
             "setting key 'foo' is not defined in config class %s.%s" % (
                 config.__module__, config.__name__)
+        # the class is determined when the exception is created
+        discard()
+        assert 'config class %s.%s' % (config.__module__,
+                                       config.__name__) in str(exc)
 
     def test_required_key_error(self):
         exc = RequiredSettingKeyError(None, key="foo")
@@ -1107,53 +1268,2528 @@ class TestRegister(BaseTestCase):
 
 
 # ===================================================================
-# misc tests
+# parse stats tests
 # ===================================================================
 
 
-class TestMisc(BaseTestCase):
+class TestParseStats(BaseTestCase):
+    TESTFN = TESTFN + '.json'
 
-    def test_mro(self):
-        # This method is automatically added by the meta class wrapper:
-        # https://docs.python.org/3/library/stdtypes.html#class.mro
-        # Make sure we can override it.
+    def test_not_parsed(self):
+        self.assertRaises(NotParsedError, confix.get_parse_stats)
+
+    def test_timings_and_counters(self):
         @register()
         class config:
-            mro = 2
+            foo = 1
+            bar = schema(2, validator=[istrue, lambda x: x > 0])
+            apple = schema(3, validator=istrue)
+
+        self.write_to_file(json.dumps(dict(foo=5, bar=6)))
+        parse(self.TESTFN)
+        stats = confix.get_parse_stats()
+        assert isinstance(stats, confix.ParseStats)
+        assert stats.keys_processed == 2
+        # 2 validators for 'bar' + 1 for 'apple' (run_last_schemas())
+        assert stats.validators_run == 3
+        assert list(stats.timings) == list(confix.ParseStats._PHASES)
+        for phase, secs in stats.timings.items():
+            assert secs >= 0, phase
+        assert stats.timings['total'] >= stats.timings['deserialize']
+        assert 'confix.istrue' in stats.validator_timings
+        json.dumps(stats.as_dict())
+
+    def test_envvars_phase(self):
+        @register()
+        class config:
+            foo = 1
 
-        assert config.mro == 2
+        os.environ['FOO'] = '2'
+        parse_with_envvars()
+        stats = confix.get_parse_stats()
+        assert stats.keys_processed == 1
+        assert stats.timings['envvars'] > 0
+
+    def test_dedup(self):
+        def register_classes():
+            classes = []
+            for section in ('a', 'b'):
+                @register(section)
+                class config:
+                    host = 'x'
+                    port = 0
+                    ratio = 0.0
+                    tags = []
+                    extra = {}
+
+                classes.append(config)
+            return classes
+
+        a, b = register_classes()
+        values = dict(host='hostname.domain.com', port=12345, ratio=0.5,
+                      tags=['tag-name', 'tag-name'],
+                      extra=dict(nested_key='hostname.domain.com'))
+        self.write_to_file(json.dumps(dict(a=values, b=values)))
+        parse(self.TESTFN)
+        assert confix.get_parse_stats().dedup_saved_bytes == 0
+        assert a.host is not b.host
+        discard()
+        a, b = register_classes()
+
+        parse(self.TESTFN, dedup=True)
+        stats = confix.get_parse_stats()
+        assert stats.dedup_saved_bytes > 0
+        assert stats.timings['dedup'] > 0
+        assert a.host == 'hostname.domain.com'
+        assert a.host is b.host
+        assert a.port is b.port
+        assert a.ratio is b.ratio
+        assert a.tags[0] is a.tags[1]
+        assert a.extra['nested_key'] is a.host
+        assert a.tags is not b.tags
+        # reload() remembers dedup
+        confix.reload()
+        assert confix.get_parse_stats().dedup_saved_bytes > 0
+
+    def test_dedup_preserves_values(self):
+        # equal but distinct values must not be replaced by each other
+        @register()
+        class config:
+            x = 0.0
+            y = 0.0
+            t = []
+
+        self.write_to_file(json.dumps(dict(x=0.0, y=-0.0, t=[0.0, -0.0])))
+        parse(self.TESTFN, dedup=True)
+        assert math.copysign(1, config.x) == 1
+        assert math.copysign(1, config.y) == -1
+        assert [math.copysign(1, v) for v in config.t] == [1, -1]
+
+        dedup = confix._Deduplicator()
+        dct = dict(a=(1, ), b=(True, ), c=(1.0, ), d=1, e=True)
+        dedup.dedup(dct)
+        assert type(dct['b'][0]) is bool
+        assert type(dct['c'][0]) is float
+        assert dct['e'] is True
+
+    def test_callback(self):
+        @register()
+        class config:
+            foo = 1
 
+        ls = []
+        parse(stats_callback=ls.append)
+        assert ls == [confix.get_parse_stats()]
         discard()
 
+        @register()
+        class config:  # NOQA
+            foo = 1
+
+        parse_with_envvars(stats_callback=ls.append)
+        assert len(ls) == 2
+
+    def test_discard(self):
         @register()
         class config:
-            pass
+            foo = 1
 
-        config.mro
+        parse()
+        confix.get_parse_stats()
+        discard()
+        self.assertRaises(NotParsedError, confix.get_parse_stats)
 
-    def test__all__(self):
-        dir_confix = dir(confix)
-        for name in dir_confix:
-            if name in ('configparser', 'logger', 'basestring', 'unicode'):
-                continue
-            if not name.startswith('_'):
-                try:
-                    __import__(name)
-                except ImportError:
-                    if name not in confix.__all__:
-                        fun = getattr(confix, name)
-                        if fun is None:
-                            continue
-                        if (fun.__doc__ is not None and
-                                'deprecated' not in fun.__doc__.lower()):
-                            self.fail('%r not in confix.__all__' % name)
 
-        # Import 'star' will break if __all__ is inconsistent, see:
-        # https://github.com/giampaolo/psutil/issues/656
-        # Can't do `from confix import *` as it won't work on python 3
-        # so we simply iterate over __all__.
-        for name in confix.__all__:
-            assert name in dir_confix
+# ===================================================================
+# trace events tests
+# ===================================================================
+
+
+class TestTraceEvents(BaseTestCase):
+    TESTFN = TESTFN + '.json'
+
+    def add_listener(self):
+        events = []
+
+        def listener(event, fields):
+            events.append((event, fields))
+
+        confix.add_trace_listener(listener)
+        self.addCleanup(confix.remove_trace_listener, listener)
+        return events
+
+    def test_events(self):
+        events = self.add_listener()
+
+        @register('sec')
+        class config:
+            foo = 1
+            bar = schema(2, validator=istrue)
+
+        self.write_to_file(json.dumps(dict(sec=dict(foo=5, bar=6))))
+        parse(self.TESTFN)
+        names = [x[0] for x in events]
+        assert names[0] == 'register'
+        assert names[1] == 'conf_file'
+        assert names[-1] == 'parse'
+        overrides = dict((f['key'], f) for e, f in events if e == 'override')
+        assert overrides['foo'] == dict(section='sec', key='foo',
+                                        old_value=1, new_value=5)
+        validator = [f for e, f in events if e == 'validator'][0]
+        assert validator['key'] == 'bar'
+        assert validator['value'] == 6
+        assert validator['validator'] is istrue
+        assert validator['ok']
+        assert validator['duration'] >= 0
+
+    def test_envvar_event(self):
+        events = self.add_listener()
+
+        @register()
+        class config:
+            foo = 1
+
+        os.environ['FOO'] = '2'
+        parse_with_envvars()
+        assert ('envvar', dict(section=None, key='foo', value=2)) in events
+
+    def test_disabled(self):
+        # No listener and no debug logging: events are not even built.
+        @register()
+        class config:
+            foo = 1
+
+        def _trace(*args, **kwargs):
+            raise AssertionError("should not be called")
+
+        self.write_to_file(json.dumps(dict(foo=5)))
+        orig = confix._trace
+        confix._trace = _trace
+        try:
+            parse(self.TESTFN)
+        finally:
+            confix._trace = orig
+
+    def test_remove_listener(self):
+        self.assertRaises(TypeError, confix.add_trace_listener, 1)
+        self.assertRaises(ValueError, confix.remove_trace_listener, len)
+
+
+# ===================================================================
+# get_memory_usage() tests
+# ===================================================================
+
+
+class TestGetMemoryUsage(BaseTestCase):
+
+    def test_not_parsed(self):
+        self.assertRaises(NotParsedError, confix.get_memory_usage)
+
+    def test_sections(self):
+        @register()
+        class root_conf:
+            foo = 1
+
+        @register('sub')
+        class sub_conf:
+            bar = list(range(1000))
+            baz = 'x'
+
+        parse()
+        usage = confix.get_memory_usage()
+        assert set(usage['sections']) == set([None, 'sub'])
+        assert set(usage['sections']['sub']['keys']) == set(['bar', 'baz'])
+        bar = usage['sections']['sub']['keys']['bar']
+        assert bar > sys.getsizeof(sub_conf.bar)
+        assert usage['sections']['sub']['total'] == \
+            bar + usage['sections']['sub']['keys']['baz']
+        assert usage['total'] == sum(
+            x['total'] for x in usage['sections'].values())
+
+    def test_shared_objects(self):
+        # Objects shared by more keys are counted once.
+        value = list(range(1000))
+
+        @register()
+        class config:
+            foo = value
+            bar = value
+
+        parse()
+        keys = confix.get_memory_usage()['sections'][None]['keys']
+        assert sorted(keys.values())[0] == 0
+
+
+# ===================================================================
+# reload() and fork tests
+# ===================================================================
+
+
+class TestReload(BaseTestCase):
+    TESTFN = TESTFN + '.json'
+
+    def test_not_parsed(self):
+        self.assertRaises(NotParsedError, confix.reload)
+
+    def test_reload(self):
+        @register()
+        class config:
+            foo = 1
+            bar = 2
+
+        self.write_to_file(json.dumps(dict(foo=5, bar=6)))
+        parse(self.TESTFN)
+        assert config.foo == 5
+        # keys which are no longer overridden get their default back
+        self.write_to_file(json.dumps(dict(foo=10)))
+        confix.reload()
+        assert config.foo == 10
+        assert config.bar == 2
+
+    def test_reload_new_args(self):
+        @register()
+        class config:
+            foo = 1
+
+        parse()
+        self.write_to_file(json.dumps(dict(foo='x')))
+        confix.reload(self.TESTFN, type_check=False)
+        assert config.foo == 'x'
+
+    def test_reload_envvars(self):
+        @register()
+        class config:
+            foo = 1
+
+        os.environ['FOO'] = '2'
+        parse_with_envvars()
+        os.environ['FOO'] = '3'
+        confix.reload()
+        assert config.foo == 3
+
+    def test_reload_invalid(self):
+        # On error the previous configuration is left in place.
+        @register()
+        class config:
+            foo = 1
+            bar = 2
+
+        self.write_to_file(json.dumps(dict(foo=5)))
+        parse(self.TESTFN)
+        self.write_to_file(json.dumps(dict(foo=10, bar='x')))
+        self.assertRaises(TypesMismatchError, confix.reload)
+        assert config.foo == 5
+        assert config.bar == 2
+        assert get_parsed_conf() == dict(foo=5, bar=2)
+
+    def test_reload_atomic(self):
+        # While reloading, readers keep seeing the old configuration.
+        seen = []
+
+        def peek(value):
+            seen.append((config.foo, config.bar))
+            return True
+
+        @register()
+        class config:
+            foo = schema(1, validator=peek)
+            bar = schema(2, validator=peek)
+
+        self.write_to_file(json.dumps(dict(foo=5, bar=6)))
+        parse(self.TESTFN)
+        del seen[:]
+        self.write_to_file(json.dumps(dict(foo=10)))
+        confix.reload()
+        assert seen == [(5, 6), (5, 6)]
+        assert config.foo == 10
+        assert config.bar == 2
+
+
+@unittest.skipIf(not hasattr(os, 'fork'), "fork() not available")
+class TestFork(BaseTestCase):
+    TESTFN = TESTFN + '.json'
+
+    def run_in_child(self, fun):
+        """Run fun() in a forked child process and return its exit code
+        (1 on exception).
+        """
+        pid = os.fork()
+        if pid == 0:
+            code = 1
+            try:
+                code = fun()
+            finally:
+                os._exit(code)
+        return os.waitpid(pid, 0)[1] >> 8
+
+    def test_parse_in_child_reuses_parent_conf(self):
+        @register()
+        class config:
+            foo = 1
+
+        self.write_to_file(json.dumps(dict(foo=5)))
+        parse(self.TESTFN)
+        self.write_to_file(json.dumps(dict(foo=10)))
+
+        def child():
+            parse(self.TESTFN)  # no AlreadyParsedError, no re-parse
+            return 0 if config.foo == 5 else 2
+
+        assert self.run_in_child(child) == 0
+        # ...whereas the parent still can't parse twice
+        self.assertRaises(AlreadyParsedError, parse, self.TESTFN)
+
+    def test_parse_in_child_with_other_args(self):
+        @register()
+        class config:
+            foo = 1
+
+        self.write_to_file(json.dumps(dict(foo=5)))
+        parse(self.TESTFN)
+        parent_stats = confix.get_parse_stats()
+
+        def child():
+            try:
+                parse(self.TESTFN, type_check=False)
+            except AlreadyParsedError:
+                pass
+            else:
+                return 2
+            try:
+                parse()
+            except AlreadyParsedError:
+                pass
+            else:
+                return 3
+            # same args: stats_callback gets the stats of the parse
+            # which produced the inherited configuration
+            calls = []
+            parse(self.TESTFN, stats_callback=calls.append)
+            if len(calls) != 1 or \
+                    calls[0].keys_processed != parent_stats.keys_processed:
+                return 4
+            return 0 if config.foo == 5 else 5
+
+        assert self.run_in_child(child) == 0
+
+    def test_reload_in_child(self):
+        @register()
+        class config:
+            foo = 1
+
+        self.write_to_file(json.dumps(dict(foo=5)))
+        parse(self.TESTFN)
+        self.write_to_file(json.dumps(dict(foo=10)))
+
+        def child():
+            confix.reload()
+            return 0 if config.foo == 10 else 2
+
+        assert self.run_in_child(child) == 0
+        assert config.foo == 5
+
+    def test_locks_are_recreated(self):
+        if not hasattr(os, 'register_at_fork'):
+            raise unittest.SkipTest("os.register_at_fork() not available")
+
+        @register()
+        class config:
+            foo = 1
+
+        parse()
+
+        def child():
+            # The parent holds the lock at fork time: the child must
+            # not deadlock.
+            get_parsed_conf()
+            return 0
+
+        with confix._lock_ctx():
+            assert self.run_in_child(child) == 0
+
+
+# ===================================================================
+# SharedConfStore tests
+# ===================================================================
+
+
+try:
+    from multiprocessing import shared_memory
+except ImportError:
+    shared_memory = None
+
+
+@unittest.skipIf(shared_memory is None, "shared_memory not available")
+class TestSharedConfStore(BaseTestCase):
+    TESTFN = TESTFN + '.json'
+
+    def setUp(self):
+        super(TestSharedConfStore, self).setUp()
+        self.store = confix.SharedConfStore(
+            'confix-test-%s' % os.getpid(), create=True, size=4096)
+
+    def tearDown(self):
+        super(TestSharedConfStore, self).tearDown()
+        self.store.close()
+        self.store.unlink()
+
+    def register(self):
+        @register()
+        class root:
+            foo = 1
+
+        @register('sub')
+        class sub:
+            bar = schema('x', validator=istrue)
+
+        return root, sub
+
+    def test_publish_and_sync(self):
+        self.register()
+        self.write_to_file(json.dumps(dict(foo=5, sub=dict(bar='y'))))
+        parse(self.TESTFN)
+        assert self.store.version == 0
+        self.store.publish()
+        assert self.store.version == 1
+
+        # another process: same classes registered, no parse()
+        discard()
+        root, sub = self.register()
+        reader = confix.SharedConfStore(self.store.name)
+        self.addCleanup(reader.close)
+        assert reader.sync()
+        assert root.foo == 5
+        assert sub.bar == 'y'
+        assert get_parsed_conf() == dict(foo=5, sub=dict(bar='y'))
+        # nothing changed
+        assert not reader.sync()
+
+    def test_new_version(self):
+        root, sub = self.register()
+        parse()
+        self.store.publish()
+        reader = confix.SharedConfStore(self.store.name)
+        self.addCleanup(reader.close)
+        assert reader.sync()
+
+        self.write_to_file(json.dumps(dict(foo=10)))
+        confix.reload(self.TESTFN)
+        self.store.publish()
+        assert self.store.version == 2
+        root.foo = 'stale'
+        assert reader.sync()
+        assert root.foo == 10
+
+    def test_dead_publisher(self):
+        import struct
+        root, sub = self.register()
+        parse()
+        self.store.publish()
+        # publisher died between the two header writes of publish()
+        struct.pack_into('<Q', self.store._shm.buf, 0, 3)
+        reader = confix.SharedConfStore(self.store.name, timeout=0.05)
+        self.addCleanup(reader.close)
+        self.assertRaises(Error, reader.sync)
+        self.assertRaises(Error, reader.read)
+        # the next publish() recovers (the interrupted one counts)
+        self.store.publish()
+        assert self.store.version == 3
+        assert reader.sync()
+
+    def test_not_published(self):
+        self.register()
+        assert self.store.read() == (0, None)
+        assert not self.store.sync()
+        self.assertRaises(NotParsedError, self.store.publish)
+
+    def test_too_big(self):
+        @register()
+        class config:
+            foo = 'x' * 8192
+
+        parse()
+        self.assertRaises(Error, self.store.publish)
+
+    def test_different_conf_classes(self):
+        self.register()
+        parse()
+        self.store.publish()
+        discard()
+
+        @register()
+        class root:
+            foo = 1
+
+        with self.assertRaises(Error) as cm:
+            self.store.sync()
+        assert "different configuration classes" in str(cm.exception)
+
+
+# ===================================================================
+# ConfServer / ConfClient tests
+# ===================================================================
+
+
+@unittest.skipIf(not hasattr(socket, 'AF_UNIX'), "UNIX sockets not available")
+class TestConfServer(BaseTestCase):
+    TESTFN = TESTFN + '.json'
+
+    def setUp(self):
+        super(TestConfServer, self).setUp()
+        self.tmpdir = tempfile.mkdtemp()
+        self.sockpath = os.path.join(self.tmpdir, 's.sock')
+
+        @register()
+        class root:
+            foo = 1
+
+        @register('sub')
+        class sub:
+            bar = 'x'
+
+        self.write_to_file(json.dumps(dict(foo=5)))
+        parse(self.TESTFN)
+        self.server = confix.ConfServer(self.sockpath)
+        self.server.start()
+
+    def tearDown(self):
+        self.server.shutdown()
+        shutil.rmtree(self.tmpdir)
+        super(TestConfServer, self).tearDown()
+
+    def wait_for(self, fun, timeout=3):
+        stop_at = time.time() + timeout
+        while not fun():
+            if time.time() > stop_at:
+                self.fail("timeout")
+            time.sleep(0.01)
+
+    def test_get(self):
+        with confix.ConfClient(self.sockpath, subscribe=False) as client:
+            assert client.version == 0
+            assert client.conf == dict(foo=5, sub=dict(bar='x'))
+
+    def test_subscribe(self):
+        with confix.ConfClient(self.sockpath) as client:
+            assert client.conf['foo'] == 5
+            self.write_to_file(json.dumps(dict(foo=10)))
+            self.server.reload()
+            self.wait_for(lambda: client.version == 1)
+            assert client.conf == dict(foo=10, sub=dict(bar='x'))
+            # a client connecting later gets the new version
+            with confix.ConfClient(self.sockpath, subscribe=False) as c2:
+                assert c2.version == 1
+                assert c2.conf['foo'] == 10
+
+    def test_closed_subscriber(self):
+        client = confix.ConfClient(self.sockpath)
+        client.close()
+        self.wait_for(lambda: not self.server._subscribers)
+        self.server.reload()
+
+    def test_invalid_request(self):
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.addCleanup(sock.close)
+        sock.connect(self.sockpath)
+        sock.sendall(b'foo\n')
+        resp = json.loads(sock.makefile('rb').readline().decode('utf8'))
+        assert 'invalid request' in resp['error']
+
+    def test_socket_removed(self):
+        self.server.shutdown()
+        assert not os.path.exists(self.sockpath)
+
+    def test_not_a_socket(self):
+        path = os.path.join(self.tmpdir, 'important.txt')
+        with open(path, 'w') as f:
+            f.write('data')
+        with self.assertRaises(Error) as cm:
+            confix.ConfServer(path)
+        assert "is not a socket" in str(cm.exception)
+        assert os.path.isfile(path)
+
+    def test_slow_subscriber(self):
+        # a subscriber which doesn't read doesn't block reload() and
+        # other clients, and it's eventually disconnected
+        self.server.shutdown()
+        discard()
+
+        @register()
+        class root:
+            big = ''
+
+        self.write_to_file(json.dumps(dict(big='x' * 1024 * 1024)))
+        parse(self.TESTFN)
+        self.server = confix.ConfServer(self.sockpath, send_timeout=0.2)
+        self.server.start()
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.addCleanup(sock.close)
+        sock.connect(self.sockpath)
+        sock.sendall(b'{"cmd": "subscribe"}\n')
+        self.wait_for(lambda: len(self.server._subscribers) == 1)
+        started = time.time()
+        for x in range(3):
+            self.server.reload()
+        assert time.time() - started < 2
+        with confix.ConfClient(self.sockpath, subscribe=False) as client:
+            assert client.version == 3
+        self.wait_for(lambda: not self.server._subscribers)
+
+
+# ===================================================================
+# snapshot() / restore() tests
+# ===================================================================
+
+
+class TestSnapshot(BaseTestCase):
+    TESTFN = TESTFN + '.json'
+
+    def register(self):
+        @register()
+        class root:
+            foo = 1
+
+        @register('sub')
+        class sub:
+            bar = schema('x', validator=istrue)
+
+        return root, sub
+
+    def test_not_parsed(self):
+        self.register()
+        self.assertRaises(NotParsedError, confix.snapshot)
+
+    def test_restore(self):
+        self.register()
+        self.write_to_file(json.dumps(dict(foo=5, sub=dict(bar='y'))))
+        parse(self.TESTFN)
+        data = confix.snapshot()
+        assert isinstance(data, bytes)
+        # unpickleable meta_wrapper classes are not part of the snapshot
+        assert b'meta_wrapper' not in data
+
+        discard()
+        root, sub = self.register()
+        calls = []
+        sub.bar = schema('x', validator=lambda x: calls.append(x))
+        confix.restore(data)
+        assert not calls  # no validation
+        assert root.foo == 5
+        assert sub.bar == 'y'
+        assert get_parsed_conf() == dict(foo=5, sub=dict(bar='y'))
+        self.assertRaises(AlreadyParsedError, parse)
+
+    def test_reload_after_restore(self):
+        self.register()
+        self.write_to_file(json.dumps(dict(foo=5)))
+        parse(self.TESTFN)
+        data = confix.snapshot()
+        discard()
+
+        root, sub = self.register()
+        confix.restore(data)
+        # nothing to re-parse: don't reset values to their defaults
+        with self.assertRaises(Error) as cm:
+            confix.reload()
+        assert "specify conf_file" in str(cm.exception)
+        assert root.foo == 5
+        self.write_to_file(json.dumps(dict(foo=6)))
+        confix.reload(conf_file=self.TESTFN)
+        assert root.foo == 6
+        confix.reload()
+        assert root.foo == 6
+
+    def test_different_classes(self):
+        self.register()
+        parse()
+        data = confix.snapshot()
+        discard()
+
+        @register()
+        class root:
+            foo = 'not an int'
+
+        with self.assertRaises(Error) as cm:
+            confix.restore(data)
+        assert "different configuration classes" in str(cm.exception)
+
+    def test_invalid_data(self):
+        self.register()
+        self.assertRaises(Error, confix.restore, b'foo')
+
+    @unittest.skipIf(not hasattr(os, 'fork'), "fork() not available")
+    def test_process_pool(self):
+        # restore() used as a multiprocessing initializer
+        import multiprocessing
+        root, sub = self.register()
+        self.write_to_file(json.dumps(dict(foo=5)))
+        parse(self.TESTFN)
+        data = confix.snapshot()
+        root.foo = 1  # the child must get it from the snapshot
+        ctx = multiprocessing.get_context('fork')
+        pool = ctx.Pool(1, initializer=confix.restore, initargs=(data, ))
+        try:
+            assert pool.apply(get_parsed_conf)['foo'] == 5
+        finally:
+            pool.terminate()
+            pool.join()
+
+
+# ===================================================================
+# get() tests
+# ===================================================================
+
+
+class TestGet(BaseTestCase):
+    TESTFN = TESTFN + '.json'
+
+    def register(self):
+        @register()
+        class root:
+            foo = 1
+
+        @register('sub')
+        class sub:
+            bar = 'x'
+            nested = dict(a=dict(b=2))
+
+        return root, sub
+
+    def test_not_parsed(self):
+        self.register()
+        self.assertRaises(NotParsedError, confix.get, 'foo')
+
+    def test_get(self):
+        self.register()
+        self.write_to_file(json.dumps(dict(foo=5, sub=dict(bar='y'))))
+        parse(self.TESTFN)
+        assert confix.get('foo') == 5
+        assert confix.get('sub.bar') == 'y'
+        assert confix.get('sub.nested') == dict(a=dict(b=2))
+        assert confix.get('sub.nested.a.b') == 2
+        assert confix.get('sub') == get_parsed_conf()['sub']
+        # no copies
+        assert confix.get('sub.nested') is confix.get('sub.nested')
+
+    def test_missing(self):
+        self.register()
+        parse()
+        self.assertRaises(KeyError, confix.get, 'sub.apple')
+        assert confix.get('sub.apple', None) is None
+        assert confix.get('sub.apple', 3) == 3
+
+    def test_reload(self):
+        # the index is rebuilt after reload()
+        self.register()
+        parse()
+        assert confix.get('foo') == 1
+        self.write_to_file(json.dumps(dict(foo=5)))
+        confix.reload(self.TESTFN)
+        assert confix.get('foo') == 5
+
+    def test_restore(self):
+        self.register()
+        parse()
+        assert confix.get('foo') == 1
+        self.write_to_file(json.dumps(dict(foo=5)))
+        confix.reload(self.TESTFN)
+        data = confix.snapshot()
+        discard()
+        self.register()
+        confix.restore(data)
+        assert confix.get('foo') == 5
+
+    def test_discard(self):
+        self.register()
+        parse()
+        confix.get('foo')
+        discard()
+        self.assertRaises(NotParsedError, confix.get, 'foo')
+
+
+# ===================================================================
+# coercers tests
+# ===================================================================
+
+
+class TestCoercers(BaseTestCase):
+    TESTFN = TESTFN + '.ini'
+
+    def test_list(self):
+        @register()
+        class config:
+            names = ['a']
+            ports = [80]
+            empty = []
+            tup = (1.0, )
+
+        os.environ['NAMES'] = 'x, y'
+        os.environ['PORTS'] = '1,2,3'
+        os.environ['EMPTY'] = 'foo,bar'
+        os.environ['TUP'] = '0.5,1.5'
+        parse_with_envvars()
+        assert config.names == ['x', 'y']
+        assert config.ports == [1, 2, 3]
+        assert config.empty == ['foo', 'bar']
+        assert config.tup == (0.5, 1.5)
+
+    def test_list_mismatch(self):
+        @register()
+        class config:
+            ports = [80]
+
+        os.environ['PORTS'] = '1,foo'
+        with self.assertRaises(TypesMismatchError) as cm:
+            parse_with_envvars()
+        assert cm.exception.key == 'ports'
+        assert cm.exception.new_value == '1,foo'
+
+    def test_dict(self):
+        @register()
+        class config:
+            opts = {}
+
+        os.environ['OPTS'] = '{"a": 1}'
+        parse_with_envvars()
+        assert config.opts == dict(a=1)
+        discard()
+
+        @register()
+        class config:
+            opts = {}
+
+        os.environ['OPTS'] = '[1]'
+        self.assertRaises(TypesMismatchError, parse_with_envvars)
+
+    def test_decimal(self):
+        import decimal
+
+        @register()
+        class config:
+            price = decimal.Decimal('1.0')
+
+        os.environ['PRICE'] = '3.14'
+        parse_with_envvars()
+        assert config.price == decimal.Decimal('3.14')
+        discard()
+
+        @register()
+        class config:
+            price = decimal.Decimal('1.0')
+
+        os.environ['PRICE'] = 'foo'
+        self.assertRaises(TypesMismatchError, parse_with_envvars)
+
+    def test_datetime(self):
+        import datetime
+
+        @register()
+        class config:
+            since = datetime.date(2000, 1, 1)
+            until = datetime.datetime(2000, 1, 1)
+
+        os.environ['SINCE'] = '2010-02-03'
+        os.environ['UNTIL'] = '2010-02-03T04:05:06'
+        parse_with_envvars()
+        assert config.since == datetime.date(2010, 2, 3)
+        assert config.until == datetime.datetime(2010, 2, 3, 4, 5, 6)
+
+    def test_path(self):
+        import pathlib
+
+        @register()
+        class config:
+            home = pathlib.Path('/')
+
+        os.environ['HOME'] = '/tmp'
+        parse_with_envvars()
+        assert config.home == pathlib.Path('/tmp')
+        assert isinstance(config.home, pathlib.Path)
+
+    def test_class_alias(self):
+        # The coercer key names a class by its public name while its
+        # __module__ is a private one (e.g. pathlib.PurePath, defined
+        # in pathlib._local on Python 3.13).
+        class Base(object):
+            def __init__(self, value):
+                self.value = value
+
+        class Sub(Base):
+            pass
+
+        Base.__module__ = 'confix_test_mod._impl'
+        mod = types.ModuleType('confix_test_mod')
+        mod.Base = Base
+        sys.modules['confix_test_mod'] = mod
+        self.addCleanup(sys.modules.pop, 'confix_test_mod')
+        confix.register_coercer('confix_test_mod.Base',
+                                lambda value, default: Sub(value))
+        self.addCleanup(confix._coercers.pop, 'confix_test_mod.Base')
+        self.addCleanup(confix._coercers_cache.clear)
+
+        @register()
+        class config:
+            foo = Sub('x')
+
+        os.environ['FOO'] = 'y'
+        parse_with_envvars()
+        assert config.foo.value == 'y'
+
+    def test_enum(self):
+        import enum
+
+        class Color(enum.Enum):
+            red = 'r'
+            blue = 'b'
+
+        class Level(enum.IntEnum):
+            low = 1
+            high = 2
+
+        @register()
+        class config:
+            color = Color.red
+            level = Level.low
+
+        os.environ['COLOR'] = 'b'
+        os.environ['LEVEL'] = 'high'
+        parse_with_envvars()
+        assert config.color is Color.blue
+        assert config.level is Level.high
+        discard()
+
+        @register()
+        class config:
+            color = Color.red
+
+        os.environ['COLOR'] = 'green'
+        self.assertRaises(TypesMismatchError, parse_with_envvars)
+
+    def test_schema(self):
+        @register()
+        class config:
+            ports = schema([80], required=False)
+
+        os.environ['PORTS'] = '1,2'
+        parse_with_envvars()
+        assert config.ports == [1, 2]
+
+    def test_no_type_check(self):
+        @register()
+        class config:
+            ports = [80]
+
+        os.environ['PORTS'] = '1,foo'
+        parse_with_envvars(type_check=False)
+        assert config.ports == '1,foo'
+
+    def test_register_coercer(self):
+        class Size(int):
+            pass
+
+        def coerce_size(value, default):
+            units = dict(k=1024, m=1024 ** 2)
+            if value[-1].lower() in units:
+                return Size(int(value[:-1]) * units[value[-1].lower()])
+            return Size(value)
+
+        confix.register_coercer(Size, coerce_size)
+        self.addCleanup(confix._coercers.pop, Size)
+        self.addCleanup(confix._coercers_cache.clear)
+        self.assertRaises(TypeError, confix.register_coercer, Size, None)
+
+        @register()
+        class config:
+            size = Size(10)
+
+        os.environ['SIZE'] = '2k'
+        parse_with_envvars()
+        assert config.size == 2048
+
+    def test_register_coercer_by_name(self):
+        # types can be referenced by name
+        confix.register_coercer('builtins.complex', lambda x, d: complex(x))
+        self.addCleanup(confix._coercers.pop, 'builtins.complex')
+        self.addCleanup(confix._coercers_cache.clear)
+
+        @register()
+        class config:
+            c = 1j
+
+        os.environ['C'] = '2+3j'
+        parse_with_envvars()
+        assert config.c == 2 + 3j
+
+    def test_ini(self):
+        @register('sect')
+        class config:
+            ports = [80]
+
+        self.write_to_file("[sect]\nports = 1, 2\n")
+        parse(self.TESTFN)
+        assert config.ports == [1, 2]
+
+
+# ===================================================================
+# compiled classes tests
+# ===================================================================
+
+
+class TestCompiled(BaseTestCase):
+    TESTFN = TESTFN + '.json'
+
+    def test_override(self):
+        @register(compiled=True)
+        class root:
+            foo = 1
+            bar = 'x'
+
+        @register('sub', compiled=True)
+        class sub:
+            apple = 1.5
+            pear = None
+            ok = True
+
+        self.write_to_file(json.dumps(
+            dict(foo=5, sub=dict(apple=2.5, pear=[1], ok=False))))
+        parse(self.TESTFN)
+        assert root.foo == 5
+        assert root.bar == 'x'
+        assert sub.apple == 2.5
+        assert sub.pear == [1]
+        assert sub.ok is False
+        assert confix.get_parse_stats().keys_processed == 4
+        # the generated function is cached
+        fun = confix._compiled_map['sub']
+        assert 'def process' in fun.source
+        confix.reload()
+        assert confix._compiled_map['sub'] is fun
+
+    def test_reload(self):
+        @register('sub', compiled=True)
+        class sub:
+            foo = 1
+            bar = schema('x', validator=istrue)
+
+        self.write_to_file(json.dumps(dict(sub=dict(foo=5, bar='y'))))
+        parse(self.TESTFN)
+        fun = confix._compiled_map['sub']
+        self.write_to_file(json.dumps(dict(sub=dict(foo=6))))
+        confix.reload()
+        assert confix._compiled_map['sub'] is fun
+        assert sub.foo == 6
+        assert sub.bar == 'x'
+        self.write_to_file(json.dumps(dict(sub=dict(foo='z'))))
+        self.assertRaises(TypesMismatchError, confix.reload)
+        assert sub.foo == 6
+
+    def test_stats(self):
+        def gt0(v):
+            return v > 0
+
+        @register('sub', compiled=True)
+        class sub:
+            foo = schema(1, validator=[gt0, gt0])
+            bar = 'x'
+
+        self.write_to_file(json.dumps(dict(sub=dict(foo=5, bar='y'))))
+        parse(self.TESTFN)
+        stats = confix.get_parse_stats()
+        assert stats.keys_processed == 2
+        assert stats.validators_run == 2
+        name = confix._callable_name(gt0)
+        assert list(stats.validator_timings) == [name]
+        assert stats.timings['validators'] == stats.validator_timings[name]
+
+    def test_type_mismatch(self):
+        @register('sub', compiled=True)
+        class sub:
+            foo = 1
+
+        self.write_to_file(json.dumps(dict(sub=dict(foo='x'))))
+        with self.assertRaises(TypesMismatchError) as cm:
+            parse(self.TESTFN)
+        assert cm.exception.section == 'sub'
+        assert cm.exception.key == 'foo'
+        assert cm.exception.default_value == 1
+        assert cm.exception.new_value == 'x'
+        discard()
+
+        @register('sub', compiled=True)
+        class sub:  # NOQA
+            foo = 1
+
+        parse(self.TESTFN, type_check=False)
+        assert sub.foo == 'x'
+
+    def test_unrecognized_key(self):
+        @register(compiled=True)
+        class root:
+            foo = 1
+
+        self.write_to_file(json.dumps(dict(foo=2, bar=3)))
+        with self.assertRaises(UnrecognizedSettingKeyError) as cm:
+            parse(self.TESTFN)
+        assert cm.exception.section is None
+        assert cm.exception.key == 'bar'
+        assert cm.exception.new_value == 3
+
+    def test_validators(self):
+        def fail(value):
+            raise ValidationError("nope")
+
+        @register('sub', compiled=True)
+        class sub:
+            foo = schema(1, validator=[istrue, lambda x: x > 0])
+            bar = schema(1, validator=fail)
+
+        self.write_to_file(json.dumps(dict(sub=dict(foo=-1))))
+        with self.assertRaises(ValidationError) as cm:
+            parse(self.TESTFN)
+        assert cm.exception.section == 'sub'
+        assert cm.exception.key == 'foo'
+        assert cm.exception.value == -1
+        assert cm.exception.msg is None
+        discard()
+
+        @register('sub', compiled=True)
+        class sub:  # NOQA
+            foo = schema(1, validator=[istrue, lambda x: x > 0])
+            bar = schema(1, validator=fail)
+
+        self.write_to_file(json.dumps(dict(sub=dict(foo=2, bar=3))))
+        with self.assertRaises(ValidationError) as cm:
+            parse(self.TESTFN)
+        assert cm.exception.key == 'bar'
+        assert cm.exception.msg == 'nope'
+
+    def test_required(self):
+        # schemas not overridden by the config file are still checked
+        @register('sub', compiled=True)
+        class sub:
+            foo = schema(None, required=True)
+            bar = 1
+
+        self.write_to_file(json.dumps(dict(sub=dict(bar=2))))
+        self.assertRaises(RequiredSettingKeyError, parse, self.TESTFN)
+
+    def test_envvars(self):
+        @register('sub', compiled=True)
+        class sub:
+            foo = 1
+            bar = [1]
+
+        os.environ['FOO'] = '3'
+        os.environ['BAR'] = '4,5'
+        parse_with_envvars()
+        assert sub.foo == 3
+        assert sub.bar == [4, 5]
+
+    def test_array(self):
+        import array
+
+        @register('sub', compiled=True)
+        class sub:
+            nums = schema([1], array='i')
+
+        self.write_to_file(json.dumps(dict(sub=dict(nums=[2, 3]))))
+        parse(self.TESTFN)
+        assert sub.nums == array.array('i', [2, 3])
+
+    def test_ini(self):
+        @register('sub', compiled=True)
+        class sub:
+            foo = 1
+            bar = 'x'
+
+        fname = TESTFN + '.ini'
+        self.addCleanup(safe_remove, fname)
+        self.write_to_file("[sub]\nfoo = 3\nbar = y\n", fname=fname)
+        parse(fname)
+        assert sub.foo == 3
+        assert sub.bar == 'y'
+
+    def test_tracing(self):
+        # with tracing enabled the generic code is used
+        @register('sub', compiled=True)
+        class sub:
+            foo = 1
+
+        events = []
+        fun = lambda event, fields: events.append(event)  # NOQA
+        confix.add_trace_listener(fun)
+        self.addCleanup(confix.remove_trace_listener, fun)
+        self.write_to_file(json.dumps(dict(sub=dict(foo=2))))
+        parse(self.TESTFN)
+        assert sub.foo == 2
+        assert 'override' in events
+        assert confix._compiled_map['sub'] is None
+
+
+# ===================================================================
+# HTTPSource tests
+# ===================================================================
+
+
+class _ConfHTTPServer(object):
+    """A local HTTP server serving a configuration file which honors
+    If-None-Match; used as a stand-in for a real config endpoint.
+    """
+
+    def __init__(self):
+        try:
+            import http.server as BaseHTTPServer  # py3
+            import socketserver
+        except ImportError:
+            import BaseHTTPServer
+            import SocketServer as socketserver
+        self.body = b''
+        self.content_type = 'application/json'
+        self.etag = None
+        self.requests = []
+        self.connections = 0
+        server = self
+
+        class Handler(BaseHTTPServer.BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+
+            def setup(self):
+                server.connections += 1
+                BaseHTTPServer.BaseHTTPRequestHandler.setup(self)
+
+            def do_GET(self):
+                server.requests.append(dict(self.headers))
+                if server.etag and \
+                        self.headers.get('If-None-Match') == server.etag:
+                    self.send_response(304)
+                    self.send_header('Content-Length', '0')
+                    self.end_headers()
+                    return
+                self.send_response(200)
+                self.send_header('Content-Type', server.content_type)
+                self.send_header('Content-Length', str(len(server.body)))
+                if server.etag:
+                    self.send_header('ETag', server.etag)
+                self.end_headers()
+                self.wfile.write(server.body)
+
+            def log_message(self, *args):
+                pass
+
+        class Server(socketserver.ThreadingMixIn, BaseHTTPServer.HTTPServer):
+            # kept-alive connections must not block shutdown()
+            daemon_threads = True
+            block_on_close = False
+
+        self.httpd = Server(('127.0.0.1', 0), Handler)
+        self.url = 'http://127.0.0.1:%s/conf' % self.httpd.server_port
+        self.thread = threading.Thread(target=self.httpd.serve_forever,
+                                       kwargs=dict(poll_interval=0.01))
+        self.thread.daemon = True
+        self.thread.start()
+
+    def serve(self, conf, etag=None, content_type='application/json'):
+        self.body = json.dumps(conf).encode('utf8') \
+            if content_type == 'application/json' else conf.encode('utf8')
+        self.etag = etag
+        self.content_type = content_type
+
+    def stop(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+        self.thread.join()
+
+
+class TestHTTPSource(BaseTestCase):
+    TESTFN = TESTFN + '.cache'
+
+    def setUp(self):
+        super(TestHTTPSource, self).setUp()
+        self.server = _ConfHTTPServer()
+
+    def tearDown(self):
+        super(TestHTTPSource, self).tearDown()
+        self.server.stop()
+
+    def register(self):
+        @register('sub')
+        class config:
+            foo = 1
+            bar = 'x'
+
+        return config
+
+    def test_parse(self):
+        config = self.register()
+        self.server.serve(dict(sub=dict(foo=2)))
+        source = confix.HTTPSource(self.server.url)
+        self.addCleanup(source.close)
+        parse(source)
+        assert config.foo == 2
+        assert config.bar == 'x'
+
+    def test_content_type(self):
+        config = self.register()
+        self.server.serve("sub:\n  foo: 3\n",
+                          content_type='application/x-yaml; charset=utf-8')
+        source = confix.HTTPSource(self.server.url)
+        self.addCleanup(source.close)
+        parse(source)
+        assert config.foo == 3
+        discard()
+
+        config = self.register()
+        self.server.serve("[sub]\nfoo = 4\n", content_type='text/plain')
+        source = confix.HTTPSource(self.server.url + '.ini')
+        self.addCleanup(source.close)
+        parse(source)
+        assert config.foo == 4
+
+    def test_unknown_content_type(self):
+        # no extension in the URL: look at the content
+        config = self.register()
+        self.server.serve('{"sub": {"foo": 5}}',
+                          content_type='application/octet-stream')
+        source = confix.HTTPSource(self.server.url)
+        self.addCleanup(source.close)
+        parse(source)
+        assert config.foo == 5
+
+    def test_not_modified(self):
+        config = self.register()
+        self.server.serve(dict(sub=dict(foo=2)), etag='"v1"')
+        source = confix.HTTPSource(self.server.url)
+        self.addCleanup(source.close)
+        parse(source)
+        stats = confix.get_parse_stats()
+        # 304: nothing is parsed again
+        events = []
+        fun = lambda event, fields: events.append(event)  # NOQA
+        confix.add_trace_listener(fun)
+        self.addCleanup(confix.remove_trace_listener, fun)
+        confix.reload()
+        assert self.server.requests[-1]['If-None-Match'] == '"v1"'
+        assert confix.get_parse_stats() is stats
+        assert events == ['source_unchanged']
+        assert config.foo == 2
+        # new version
+        self.server.serve(dict(sub=dict(foo=3)), etag='"v2"')
+        confix.reload()
+        assert confix.get_parse_stats() is not stats
+        assert config.foo == 3
+        # the connection is reused
+        assert len(self.server.requests) == 3
+        assert self.server.connections == 1
+
+    @unittest.skipIf(not hasattr(os, 'fork'), "fork() not available")
+    def test_fork(self):
+        # a forked child does not reuse the parent's connection
+        config = self.register()
+        self.server.serve(dict(sub=dict(foo=2)), etag='"v1"')
+        source = confix.HTTPSource(self.server.url)
+        self.addCleanup(source.close)
+        parse(source)
+        self.server.serve(dict(sub=dict(foo=3)), etag='"v2"')
+        pid = os.fork()
+        if pid == 0:
+            code = 1
+            try:
+                confix.reload()
+                code = 0 if config.foo == 3 else 2
+            finally:
+                os._exit(code)
+        assert os.waitpid(pid, 0)[1] >> 8 == 0
+        assert self.server.connections == 2
+        # the parent's connection is still usable
+        confix.reload()
+        assert config.foo == 3
+        assert self.server.connections == 2
+
+    def test_cache_file(self):
+        config = self.register()
+        self.server.serve(dict(sub=dict(foo=2)), etag='"v1"')
+        source = confix.HTTPSource(self.server.url, cache_file=self.TESTFN)
+        parse(source)
+        source.close()
+        assert os.path.isfile(self.TESTFN)
+        discard()
+
+        # server is down: start up from the cache
+        url = self.server.url
+        self.server.stop()
+        self.server = _ConfHTTPServer()
+        config = self.register()
+        source = confix.HTTPSource(url, cache_file=self.TESTFN, timeout=1)
+        self.addCleanup(source.close)
+        parse(source)
+        assert config.foo == 2
+        # no cache
+        discard()
+        self.register()
+        source = confix.HTTPSource(url, timeout=1)
+        self.assertRaises(Error, parse, source)
+
+    def test_cache_file_conditional(self):
+        # the cached ETag is sent on startup
+        config = self.register()
+        self.server.serve(dict(sub=dict(foo=2)), etag='"v1"')
+        source = confix.HTTPSource(self.server.url, cache_file=self.TESTFN)
+        parse(source)
+        source.close()
+        discard()
+
+        config = self.register()
+        source = confix.HTTPSource(self.server.url, cache_file=self.TESTFN)
+        self.addCleanup(source.close)
+        parse(source)
+        assert self.server.requests[-1]['If-None-Match'] == '"v1"'
+        assert config.foo == 2
+
+    def test_http_error(self):
+        self.register()
+        self.server.serve(dict(sub=dict(foo=2)))
+        source = confix.HTTPSource(self.server.url)
+        self.addCleanup(source.close)
+        self.server.httpd.RequestHandlerClass.do_GET = \
+            lambda self: self.send_error(500)
+        self.assertRaisesRegexp(Error, "HTTP status 500", parse, source)
+
+    def test_invalid_url(self):
+        self.assertRaises(ValueError, confix.HTTPSource, 'ftp://foo/bar')
+
+
+# ===================================================================
+# SQLiteSource tests
+# ===================================================================
+
+
+class TestSQLiteSource(BaseTestCase):
+    TESTFN = TESTFN + '.sqlite'
+
+    def setUp(self):
+        super(TestSQLiteSource, self).setUp()
+        safe_remove(self.TESTFN)
+        self.source = confix.SQLiteSource(self.TESTFN)
+
+    def tearDown(self):
+        self.source.close()
+        super(TestSQLiteSource, self).tearDown()
+
+    def register(self):
+        @register()
+        class root:
+            foo = 1
+
+        @register('sub')
+        class sub:
+            bar = 'x'
+            customers = {}
+            ports = schema([], validator=lambda x: len(x) > 0)
+
+        return root, sub
+
+    def test_parse(self):
+        root, sub = self.register()
+        self.source.write(None, dict(foo=2))
+        self.source.write('sub', dict(bar='y', ports=[1, 2]))
+        parse(self.source)
+        assert root.foo == 2
+        assert sub.bar == 'y'
+        assert sub.ports == [1, 2]
+        assert sub.customers == {}
+
+    def test_validation(self):
+        self.register()
+        self.source.write(None, dict(foo='str'))
+        self.assertRaises(TypesMismatchError, parse, self.source)
+        discard()
+
+        self.register()
+        self.source.write(None, dict(foo=1))
+        self.source.write('sub', dict(ports=[]))
+        self.assertRaises(ValidationError, parse, self.source)
+        discard()
+
+        self.register()
+        self.source.write(None, dict(foo=1, apple=2))
+        self.source.write('sub', dict(ports=[1]))
+        self.assertRaises(UnrecognizedSettingKeyError, parse, self.source)
+
+    def test_lazy_mapping(self):
+        root, sub = self.register()
+        customers = dict(('customer-%s' % x, dict(limit=x))
+                         for x in range(100))
+        self.source.write('sub', dict(customers=customers, ports=[1]),
+                          lazy=['customers'])
+        parse(self.source)
+        assert not isinstance(sub.customers, dict)
+        assert sub.customers['customer-10'] == dict(limit=10)
+        assert 'customer-99' in sub.customers
+        assert 'customer-100' not in sub.customers
+        self.assertRaises(KeyError, sub.customers.__getitem__, 'nope')
+        assert len(sub.customers) == 100
+        assert dict(sub.customers) == customers
+        assert sub.customers == customers
+        assert confix.get('sub.customers')['customer-1'] == dict(limit=1)
+        # snapshots contain a plain dict
+        data = confix.snapshot()
+        discard()
+        root, sub = self.register()
+        confix.restore(data)
+        assert sub.customers == customers
+        assert isinstance(sub.customers, dict)
+
+    def test_lazy_mapping_rewrite(self):
+        root, sub = self.register()
+        self.source.write('sub', dict(customers=dict(a=1, b=2), ports=[1]),
+                          lazy=['customers'])
+        self.source.write('sub', dict(customers=dict(a=1)),
+                          lazy=['customers'])
+        parse(self.source)
+        assert dict(sub.customers) == dict(a=1)
+        # switch from lazy to plain and back
+        self.source.write('sub', dict(customers=dict(c=3)))
+        confix.reload()
+        assert sub.customers == dict(c=3)
+        self.source.write('sub', dict(customers=dict(d=4)),
+                          lazy=['customers'])
+        confix.reload()
+        assert dict(sub.customers) == dict(d=4)
+
+    def test_lazy_mapping_type_check(self):
+        @register()
+        class root:
+            foo = 1
+
+        self.source.write(None, dict(foo=dict(a=1)), lazy=['foo'])
+        self.assertRaises(TypesMismatchError, parse, self.source)
+        self.assertRaises(TypeError, self.source.write, None, dict(foo=1),
+                          lazy=['foo'])
+
+    def test_compiled(self):
+        @register('sub', compiled=True)
+        class sub:
+            customers = {}
+
+        self.source.write('sub', dict(customers=dict(a=1)),
+                          lazy=['customers'])
+        parse(self.source)
+        assert sub.customers['a'] == 1
+
+    def test_reload(self):
+        root, sub = self.register()
+        self.source.write(None, dict(foo=2))
+        self.source.write('sub', dict(ports=[1]))
+        parse(self.source)
+        stats = confix.get_parse_stats()
+        # nothing changed
+        confix.reload()
+        assert confix.get_parse_stats() is stats
+        # changed by another connection
+        other = confix.SQLiteSource(self.TESTFN)
+        self.addCleanup(other.close)
+        other.write(None, dict(foo=3))
+        confix.reload()
+        assert confix.get_parse_stats() is not stats
+        assert root.foo == 3
+        # changed by this connection
+        self.source.write(None, dict(foo=4))
+        confix.reload()
+        assert root.foo == 4
+
+    def test_file_parser(self):
+        self.register()
+        self.assertRaises(ValueError, parse, self.source,
+                          file_parser=confix.parse_json)
+
+
+# ===================================================================
+# compile_conf() tests
+# ===================================================================
+
+
+class TestCompileConf(BaseTestCase):
+    TESTFN = TESTFN + '.json'
+    COMPILED = TESTFN + '.confixc'
+
+    def tearDown(self):
+        super(TestCompileConf, self).tearDown()
+        safe_remove(self.COMPILED)
+
+    def register(self, calls=None):
+        @register('ftp')
+        class ftp:
+            port = schema(21, validator=lambda x: calls.append(x) or x > 0)
+            user = 'x'
+            timeout = schema(30, validator=lambda x: calls.append(x) or 1)
+
+        return ftp
+
+    def test_compile(self):
+        calls = []
+        self.register(calls)
+        self.write_to_file(json.dumps(dict(ftp=dict(port=2121))))
+        confix.compile_conf(self.TESTFN, self.COMPILED)
+        assert calls == [2121, 30]
+        assert os.path.isfile(self.COMPILED)
+        discard()
+
+        calls = []
+        ftp = self.register(calls)
+        parse(self.COMPILED)
+        # no validators run
+        assert calls == []
+        assert ftp.port == 2121
+        assert ftp.user == 'x'
+        assert ftp.timeout == 30
+        assert get_parsed_conf() == dict(
+            ftp=dict(port=2121, user='x', timeout=30))
+        confix.reload()
+        assert ftp.port == 2121
+        assert calls == []
+        # file object
+        discard()
+        ftp = self.register(calls)
+        with open(self.COMPILED, 'rb') as f:
+            parse(f)
+        assert ftp.port == 2121
+        assert calls == []
+
+    def test_validation_error(self):
+        self.register([])
+        self.write_to_file(json.dumps(dict(ftp=dict(port=0))))
+        self.assertRaises(ValidationError, confix.compile_conf, self.TESTFN,
+                          self.COMPILED)
+        assert not os.path.exists(self.COMPILED)
+
+    def test_fingerprint_mismatch(self):
+        self.register([])
+        self.write_to_file(json.dumps(dict(ftp=dict(port=2121))))
+        confix.compile_conf(self.TESTFN, self.COMPILED)
+        discard()
+
+        @register('ftp')
+        class ftp:
+            port = 21
+
+        self.assertRaisesRegexp(Error, "different configuration classes",
+                                parse, self.COMPILED)
+
+    def test_envvars(self):
+        calls = []
+        self.register(calls)
+        self.write_to_file(json.dumps(dict(ftp=dict(port=2121))))
+        confix.compile_conf(self.TESTFN, self.COMPILED)
+        discard()
+
+        calls = []
+        ftp = self.register(calls)
+        os.environ['USER'] = 'foo'
+        os.environ['PORT'] = '0'
+        self.assertRaises(ValidationError, parse_with_envvars, self.COMPILED)
+        discard()
+
+        ftp = self.register(calls)
+        del os.environ['PORT']
+        parse_with_envvars(self.COMPILED)
+        assert ftp.user == 'foo'
+        assert ftp.port == 2121
+
+
+# ===================================================================
+# generate_module() tests
+# ===================================================================
+
+
+class TestGenerateModule(BaseTestCase):
+    TESTFN = TESTFN + '.json'
+
+    def setUp(self):
+        super(TestGenerateModule, self).setUp()
+        self.tmpdir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.tmpdir)
+        sys.path.insert(0, self.tmpdir)
+        self.addCleanup(sys.path.remove, self.tmpdir)
+        self.modname = 'confix_generated_%s' % os.getpid()
+        self.addCleanup(sys.modules.pop, self.modname, None)
+        self.out = os.path.join(self.tmpdir, self.modname + '.py')
+
+    def register(self, calls):
+        @register('ftp')
+        class ftp:
+            port = schema(21, validator=lambda x: calls.append(x) or x > 0)
+            user = 'x'
+            hosts = ['a']
+
+        return ftp
+
+    def test_generate(self):
+        calls = []
+        self.register(calls)
+        self.write_to_file(json.dumps(dict(ftp=dict(port=2121))))
+        confix.generate_module(self.TESTFN, self.out)
+        assert calls == [2121]
+        with open(self.out) as f:
+            content = f.read()
+        assert 'CONF = ' in content
+        discard()
+
+        calls = []
+        ftp = self.register(calls)
+        assert confix.import_conf(self.modname) is True
+        # no validators run
+        assert calls == []
+        assert ftp.port == 2121
+        assert ftp.user == 'x'
+        assert ftp.hosts == ['a']
+        assert get_parsed_conf() == dict(
+            ftp=dict(port=2121, user='x', hosts=['a']))
+        self.assertRaises(AlreadyParsedError, confix.import_conf,
+                          self.modname)
+        # module object
+        discard()
+        ftp = self.register(calls)
+        assert confix.import_conf(sys.modules[self.modname]) is True
+        assert ftp.port == 2121
+
+    def test_stale_source(self):
+        calls = []
+        self.register(calls)
+        self.write_to_file(json.dumps(dict(ftp=dict(port=2121))))
+        confix.generate_module(self.TESTFN, self.out)
+        discard()
+
+        self.write_to_file(json.dumps(dict(ftp=dict(port=2222))))
+        calls = []
+        ftp = self.register(calls)
+        assert confix.import_conf(self.modname) is False
+        assert calls == [2222]
+        assert ftp.port == 2222
+
+    def test_reload(self):
+        self.register([])
+        self.write_to_file(json.dumps(dict(ftp=dict(port=2121))))
+        confix.generate_module(self.TESTFN, self.out)
+        discard()
+
+        ftp = self.register([])
+        assert confix.import_conf(self.modname) is True
+        # reload() parses the source config file
+        self.write_to_file(json.dumps(dict(ftp=dict(port=2222))))
+        confix.reload()
+        assert ftp.port == 2222
+
+    def test_parse_kwargs(self):
+        # options passed to generate_module() are used when parsing the
+        # source config file again
+        file_parser = functools.partial(confix.parse_yaml, document=1)
+        self.register([])
+        self.write_to_file("ftp: {port: 1}\n---\nftp: {port: 2121}\n")
+        confix.generate_module(self.TESTFN, self.out,
+                               file_parser=file_parser, type_check=False)
+        discard()
+
+        ftp = self.register([])
+        assert confix.import_conf(self.modname) is True
+        self.write_to_file("ftp: {port: 1}\n---\nftp: {user: 5}\n")
+        confix.reload()
+        assert ftp.port == 21
+        assert ftp.user == 5
+        discard()
+
+        # stale module
+        ftp = self.register([])
+        assert confix.import_conf(self.modname) is False
+        assert ftp.user == 5
+
+    def test_parse_kwargs_not_literal(self):
+        self.register([])
+        self.write_to_file(json.dumps(dict(ftp=dict(port=2121))))
+        with self.assertRaises(Error):
+            confix.generate_module(self.TESTFN, self.out,
+                                   file_parser=lambda f: json.load(f))
+        assert not os.path.exists(self.out)
+
+    def test_missing_source(self):
+        self.register([])
+        self.write_to_file(json.dumps(dict(ftp=dict(port=2121))))
+        confix.generate_module(self.TESTFN, self.out)
+        discard()
+        os.remove(self.TESTFN)
+
+        ftp = self.register([])
+        assert confix.import_conf(self.modname) is True
+        assert ftp.port == 2121
+
+    def test_fingerprint_mismatch(self):
+        self.register([])
+        self.write_to_file(json.dumps(dict(ftp=dict(port=2121))))
+        confix.generate_module(self.TESTFN, self.out)
+        discard()
+
+        @register('ftp')
+        class ftp:
+            port = 21
+            user = 'x'
+
+        self.write_to_file(json.dumps(dict(ftp=dict(port=2222))))
+        assert confix.import_conf(self.modname) is False
+        assert ftp.port == 2222
+
+    def test_not_literal(self):
+        import datetime
+
+        @register()
+        class config:
+            when = datetime.date(2000, 1, 1)
+
+        self.write_to_file(json.dumps({}))
+        self.assertRaisesRegexp(Error, "can't be represented",
+                                confix.generate_module, self.TESTFN,
+                                self.out)
+        assert not os.path.exists(self.out)
+
+    def test_validation_error(self):
+        self.register([])
+        self.write_to_file(json.dumps(dict(ftp=dict(port=0))))
+        self.assertRaises(ValidationError, confix.generate_module,
+                          self.TESTFN, self.out)
+        assert not os.path.exists(self.out)
+
+
+# ===================================================================
+# validate_files() tests
+# ===================================================================
+
+
+class TestValidateFiles(BaseTestCase):
+
+    def setUp(self):
+        super(TestValidateFiles, self).setUp()
+        self.tmpdir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.tmpdir)
+
+    def register(self):
+        @register('ftp')
+        class ftp:
+            port = schema(21, validator=lambda x: x > 0)
+            user = schema(required=True)
+            timeout = 30
+
+        return ftp
+
+    def write_conf(self, name, conf):
+        path = os.path.join(self.tmpdir, name)
+        if not os.path.isdir(os.path.dirname(path)):
+            os.makedirs(os.path.dirname(path))
+        with open(path, 'w') as f:
+            f.write(json.dumps(conf))
+        return path
+
+    def make_files(self):
+        return [
+            self.write_conf('a.json', dict(ftp=dict(user='a'))),
+            self.write_conf('b.json', dict(ftp=dict(user='b', port=0))),
+            self.write_conf('c.json', dict(ftp=dict(port=2121))),
+            self.write_conf('d.json', dict(ftp=dict(user='d', foo=1))),
+            self.write_conf('e.json', dict(ftp=dict(user='e', timeout='x'))),
+        ]
+
+    def check_report(self, report, files):
+        assert [x.file for x in report.results] == files
+        a, b, c, d, e = report.results
+        assert a.ok
+        assert a.error is None
+        assert not b.ok
+        assert b.error_type == 'ValidationError'
+        assert c.error_type == 'RequiredSettingKeyError'
+        assert d.error_type == 'UnrecognizedSettingKeyError'
+        assert e.error_type == 'TypesMismatchError'
+        assert report.failed == [b, c, d, e]
+        assert report.elapsed > 0
+        assert report.files_per_sec > 0
+
+    def test_validate(self):
+        ftp = self.register()
+        files = self.make_files()
+        self.check_report(confix.validate_files(files, processes=1), files)
+        # conf classes and parse state are left untouched
+        assert isinstance(ftp.port, schema)
+        self.assertRaises(NotParsedError, get_parsed_conf)
+
+    def test_process_pool(self):
+        self.register()
+        files = self.make_files()
+        self.check_report(confix.validate_files(files, processes=2), files)
+
+    def test_directory(self):
+        self.register()
+        files = self.make_files()
+        sub = self.write_conf(os.path.join('sub', 'f.json'),
+                              dict(ftp=dict(user='f')))
+        self.write_conf('notes.txt', {})
+        report = confix.validate_files([self.tmpdir], processes=1)
+        self.check_report(
+            confix.ValidationReport(report.results[:-1], report.elapsed),
+            files)
+        assert report.results[-1].file == sub
+        assert report.results[-1].ok
+
+    def test_after_parse(self):
+        ftp = self.register()
+        path = self.write_conf('conf.json', dict(ftp=dict(user='foo')))
+        parse(path)
+        files = self.make_files()
+        self.check_report(confix.validate_files(files, processes=1), files)
+        assert ftp.user == 'foo'
+        assert ftp.port == 21
+
+    def test_no_classes(self):
+        self.assertRaises(Error, confix.validate_files, [], processes=1)
+
+
+# ===================================================================
+# parser registry tests
+# ===================================================================
+
+
+class TestParserRegistry(BaseTestCase):
+
+    def setUp(self):
+        super(TestParserRegistry, self).setUp()
+        self.tmpdir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.tmpdir)
+        sys.path.insert(0, self.tmpdir)
+        self.addCleanup(sys.path.remove, self.tmpdir)
+        # restore the registry
+        parsers = confix._parsers.copy()
+        sniffers = confix._sniffers[:]
+        content_types = confix._content_types.copy()
+        ep_loaded = confix._entry_points_loaded
+
+        def restore():
+            confix._parsers.clear()
+            confix._parsers.update(parsers)
+            confix._sniffers[:] = sniffers
+            confix._content_types.clear()
+            confix._content_types.update(content_types)
+            confix._entry_points_loaded = ep_loaded
+
+        self.addCleanup(restore)
+
+    def write_module(self, name):
+        with open(os.path.join(self.tmpdir, name + '.py'), 'w') as f:
+            f.write(textwrap.dedent("""
+                def parse(file):
+                    return dict(line.split('=') for line in
+                                file.read().split())
+                """))
+        self.addCleanup(sys.modules.pop, name, None)
+
+    def write_conf(self, name, content):
+        path = os.path.join(self.tmpdir, name)
+        with open(path, 'w') as f:
+            f.write(content)
+        return path
+
+    def register(self):
+        @register()
+        class config:
+            foo = 'x'
+            bar = 'y'
+
+        return config
+
+    def test_register_parser(self):
+        config = self.register()
+        confix.register_parser(
+            'kv', lambda file: dict(x.split('=') for x in file.read().split()),
+            content_types=['text/x-kv'])
+        assert confix._content_types['text/x-kv'] == '.kv'
+        parse(self.write_conf('conf.kv', "foo=1\nbar=2"))
+        assert config.foo == '1'
+        assert config.bar == '2'
+
+    def test_lazy(self):
+        modname = 'confix_test_parser_%s' % os.getpid()
+        self.write_module(modname)
+        confix.register_parser('.kv', modname + ':parse')
+        assert modname not in sys.modules
+        config = self.register()
+        parse(self.write_conf('conf.kv', "foo=1"))
+        assert modname in sys.modules
+        assert config.foo == '1'
+        assert confix._parsers['.kv'] is sys.modules[modname].parse
+
+    def test_entry_points(self):
+        modname = 'confix_test_parser_%s' % os.getpid()
+        self.write_module(modname)
+        distinfo = os.path.join(self.tmpdir, 'confix_test_kv-1.0.dist-info')
+        os.mkdir(distinfo)
+        with open(os.path.join(distinfo, 'METADATA'), 'w') as f:
+            f.write("Metadata-Version: 2.1\nName: confix-test-kv\n"
+                    "Version: 1.0\n")
+        with open(os.path.join(distinfo, 'entry_points.txt'), 'w') as f:
+            f.write("[confix.parsers]\nkv = %s:parse\n" % modname)
+        confix._entry_points_loaded = False
+        config = self.register()
+        parse(self.write_conf('conf.kv', "foo=1"))
+        assert config.foo == '1'
+
+    def test_sniff(self):
+        contents = [
+            ('{"foo": "1"}', '.json'),
+            ('\n  [{"foo": "1"}]', '.json'),
+            ('# comment\nfoo: "1"\nbar: "2"', '.yaml'),
+            ('---\nfoo: "1"', '.yaml'),
+            ('foo = "1"\n[section]\nbar = 2\n', '.toml'),
+            ('[section]\nfoo = 1\nbar = some text\n', '.ini'),
+            ('; comment\n[section]\nfoo: 1\n', '.ini'),
+            ('foo', None),
+            ('', None),
+        ]
+        for content, ext in contents:
+            assert confix._sniff(io.StringIO(content))[0] == ext, content
+
+    def test_sniff_parse(self):
+        config = self.register()
+        parse(io.StringIO('# comment\nfoo: "1"\n'))
+        assert config.foo == '1'
+        discard()
+        config = self.register()
+        # bytes
+        parse(io.BytesIO(b'{"foo": "1"}'))
+        assert config.foo == '1'
+        discard()
+
+        # not seekable
+        class Stream(io.StringIO):
+            name = '<stdin>'
+
+            def seekable(self):
+                return False
+
+        config = self.register()
+        parse(Stream('{"foo": "1"}'))
+        assert config.foo == '1'
+        discard()
+        self.register()
+        with self.assertRaises(ValueError) as cm:
+            parse(Stream('foo'))
+        assert "format not recognized" in str(cm.exception)
+
+    def test_sniff_file_name(self):
+        # no or unknown extension: look at the content
+        for name in (TESTFN, TESTFN + '.conf'):
+            self.addCleanup(safe_remove, name)
+            with open(name, 'w') as f:
+                f.write('{"foo": "1"}')
+            config = self.register()
+            parse(name)
+            assert config.foo == '1'
+            discard()
+
+    def test_custom_sniff(self):
+        config = self.register()
+        confix.register_parser(
+            'kv', lambda file: dict(x.split('=') for x in file.read().split()),
+            sniff=lambda head: '=' in head.split()[0])
+        parse(io.StringIO("foo=1"))
+        assert config.foo == '1'
+
+
+# ===================================================================
+# interpolation tests
+# ===================================================================
+
+
+class TestInterpolation(BaseTestCase):
+    TESTFN = TESTFN + '.json'
+
+    def parse_conf(self, conf, **kwargs):
+        self.write_to_file(json.dumps(conf))
+        parse(self.TESTFN, interpolate=True, **kwargs)
+
+    def test_interpolate(self):
+        @register()
+        class config:
+            host = 'localhost'
+            port = 80
+            url = ''
+
+        self.parse_conf(dict(port=8080, url="http://${host}:${port}/$$x"))
+        assert config.url == "http://localhost:8080/$x"
+        assert config.port == 8080
+
+    def test_disabled(self):
+        @register()
+        class config:
+            host = 'localhost'
+            url = ''
+
+        self.write_to_file(json.dumps(dict(url="http://${host}")))
+        parse(self.TESTFN)
+        assert config.url == "http://${host}"
+
+    def test_sections(self):
+        @register()
+        class root:
+            domain = 'example.com'
+
+        @register('db')
+        class db:
+            host = 'db.${domain}'
+            port = 5432
+
+        @register('app')
+        class app:
+            host = 'app'
+            db_url = ''
+            port = 0
+
+        self.parse_conf(dict(app=dict(db_url="${db.host}:${db.port}@${host}",
+                                      port="${db.port}")))
+        # default values are interpolated as well
+        assert db.host == 'db.example.com'
+        assert app.db_url == 'db.example.com:5432@app'
+        # a single reference keeps the type of the referenced value
+        assert app.port == 5432
+
+    def test_compiled(self):
+        # values loaded from a compiled file replace the defaults
+        compiled = TESTFN + '.confixc'
+        self.addCleanup(safe_remove, compiled)
+
+        @register()
+        class config:
+            host = 'localhost'
+            url = 'http://${host}/'
+
+        self.write_to_file(json.dumps(
+            dict(host='example.com', url='https://${host}/x')))
+        confix.compile_conf(self.TESTFN, compiled)
+        assert config.url == 'https://${host}/x'
+        discard()
+
+        @register()
+        class config:  # NOQA
+            host = 'localhost'
+            url = 'http://${host}/'
+
+        parse(compiled, interpolate=True)
+        assert config.url == 'https://example.com/x'
+
+    def test_envvars(self):
+        @register()
+        class config:
+            path = '${CONFIX_TEST_HOME}/data'
+
+        os.environ['CONFIX_TEST_HOME'] = '/home/foo'
+        self.parse_conf({})
+        assert config.path == '/home/foo/data'
+
+    def test_validators(self):
+        @register()
+        class config:
+            port = 21
+            url = schema('', validator=lambda x: x.endswith(':21'))
+
+        self.parse_conf(dict(url="ftp://host:${port}"))
+        assert config.url == "ftp://host:21"
+        discard()
+
+        @register()
+        class config:
+            port = 21
+            url = schema('', validator=lambda x: x.endswith(':21'))
+
+        self.assertRaises(ValidationError, self.parse_conf,
+                          dict(port=22, url="ftp://host:${port}"))
+
+    def test_cycle(self):
+        @register()
+        class config:
+            a = ''
+            b = ''
+            c = ''
+
+        with self.assertRaises(confix.InterpolationError) as cm:
+            self.parse_conf(dict(a="${b}", b="x${c}", c="${a}"))
+        assert "circular reference" in str(cm.exception)
+        assert "a -> b -> c -> a" in str(cm.exception) or \
+            "b -> c -> a -> b" in str(cm.exception) or \
+            "c -> a -> b -> c" in str(cm.exception)
+        self.assertRaises(NotParsedError, get_parsed_conf)
+
+    def test_errors(self):
+        @register()
+        class config:
+            a = ''
+            b = schema(required=True)
+
+        with self.assertRaises(confix.InterpolationError) as cm:
+            self.parse_conf(dict(a="${nope}"))
+        assert str(cm.exception) == (
+            "can't interpolate setting key 'a': 'nope' is neither a setting "
+            "key nor an env var")
+        self.assertRaises(confix.InterpolationError, self.parse_conf,
+                          dict(a="${}"))
+        self.assertRaises(RequiredSettingKeyError, self.parse_conf,
+                          dict(a="${b}"))
+
+    def test_memo(self):
+        @register()
+        class config:
+            host = 'localhost'
+            port = 80
+            url = 'http://${host}:${port}'
+            other = '${host}'
+
+        events = []
+
+        def listener(event, fields):
+            events.append((event, fields))
+
+        confix.add_trace_listener(listener)
+        self.addCleanup(confix.remove_trace_listener, listener)
+        self.parse_conf(dict(port=8080))
+        assert ('interpolate', dict(rendered=2)) in events
+        assert confix.get_parse_stats().timings['interpolate'] > 0
+        url = config.url
+        assert url == 'http://localhost:8080'
+
+        del events[:]
+        confix.reload()
+        assert ('interpolate', dict(rendered=0)) in events
+        assert config.url is url
+
+        del events[:]
+        self.write_to_file(json.dumps(dict(port=8081)))
+        confix.reload()
+        assert ('interpolate', dict(rendered=1)) in events
+        assert config.url == 'http://localhost:8081'
+        assert config.other == 'localhost'
+
+
+# ===================================================================
+# command line interface tests
+# ===================================================================
+
+
+class TestCLI(BaseTestCase):
+
+    def setUp(self):
+        super(TestCLI, self).setUp()
+        self.tmpdir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.tmpdir)
+        with open(os.path.join(self.tmpdir, 'myconf.py'), 'w') as f:
+            f.write(textwrap.dedent("""
+                from confix import register, schema
+
+                @register('ftp')
+                class ftp:
+                    port = schema(21, validator=lambda x: x > 0)
+                    user = 'x'
+                """))
+
+    def write_conf(self, name, conf):
+        path = os.path.join(self.tmpdir, name)
+        with open(path, 'w') as f:
+            f.write(json.dumps(conf))
+        return path
+
+    def run_cli(self, *args):
+        """Run "python -m confix *args" from the temp dir; return
+        (exit code, stdout, stderr).
+        """
+        env = os.environ.copy()
+        env['PYTHONPATH'] = os.path.abspath(os.path.dirname(__file__))
+        proc = subprocess.Popen(
+            [sys.executable, '-m', 'confix'] + list(args), cwd=self.tmpdir,
+            env=env, stdout=subprocess.PIPE, stderr=subprocess.PIPE,
+            universal_newlines=True)
+        out, err = proc.communicate()
+        return proc.returncode, out, err
+
+    def test_compile(self):
+        self.write_conf('conf.json', dict(ftp=dict(port=2121)))
+        code, out, err = self.run_cli('compile', '-m', 'myconf', 'conf.json')
+        assert code == 0, err
+        compiled = os.path.join(self.tmpdir, 'conf.confixc')
+        assert os.path.isfile(compiled)
+        assert out.strip() == 'written conf.confixc'
+
+        @register('ftp')
+        class ftp:
+            port = schema(21, validator=lambda x: x > 0)
+            user = 'x'
+
+        parse(compiled)
+        assert ftp.port == 2121
+
+    def test_compile_invalid(self):
+        self.write_conf('conf.json', dict(ftp=dict(port=0)))
+        code, out, err = self.run_cli('compile', '-m', 'myconf', 'conf.json',
+                                      '-o', 'out.confixc')
+        assert code == 1
+        assert 'confix: error:' in err
+        assert 'ftp.port' in err or 'port' in err
+        assert not os.path.exists(os.path.join(self.tmpdir, 'out.confixc'))
+
+    def test_generate(self):
+        self.write_conf('conf.json', dict(ftp=dict(port=2121)))
+        code, out, err = self.run_cli('generate', '-m', 'myconf',
+                                      'conf.json', '-o', 'myconf_gen.py')
+        assert code == 0, err
+        assert out.strip() == 'written myconf_gen.py'
+        mod = {}
+        with open(os.path.join(self.tmpdir, 'myconf_gen.py')) as f:
+            exec(f.read(), mod)
+        assert mod['CONF'] == dict(ftp=dict(port=2121, user='x'))
+
+    def test_validate(self):
+        self.write_conf('a.json', dict(ftp=dict(port=2121)))
+        self.write_conf('b.json', dict(ftp=dict(port=0)))
+        code, out, err = self.run_cli('validate', '-m', 'myconf', '.')
+        assert code == 1, err
+        assert 'b.json: ValidationError' in out
+        assert 'a.json' not in out
+        assert 'validated 2 files (1 failed)' in out
+        code, out, err = self.run_cli('validate', '-m', 'myconf', '-j', '1',
+                                      '-v', 'a.json')
+        assert code == 0, err
+        assert 'a.json: ok' in out
+        assert 'validated 1 files (0 failed)' in out
+
+    def test_dump(self):
+        self.write_conf('conf.json', dict(ftp=dict(port=2121)))
+        code, out, err = self.run_cli('dump', '-m', 'myconf', 'conf.json')
+        assert code == 0, err
+        assert json.loads(out) == dict(ftp=dict(port=2121, user='x'))
+
+    def test_dump_envvars(self):
+        self.write_conf('conf.json', dict(ftp=dict(port=2121)))
+        os.environ['USER'] = 'foo'
+        code, out, err = self.run_cli('dump', '-m', 'myconf', '-e',
+                                      'conf.json')
+        assert code == 0, err
+        assert json.loads(out) == dict(ftp=dict(port=2121, user='foo'))
+
+    def test_dump_interpolate(self):
+        self.write_conf('conf.json', dict(ftp=dict(user='${CONFIX_USER}')))
+        os.environ['CONFIX_USER'] = 'foo'
+        code, out, err = self.run_cli('dump', '-m', 'myconf', '-i',
+                                      'conf.json')
+        assert code == 0, err
+        assert json.loads(out) == dict(ftp=dict(port=21, user='foo'))
+
+    def test_timing(self):
+        self.write_conf('conf.json', dict(ftp=dict(port=2121)))
+        code, out, err = self.run_cli('timing', '-m', 'myconf', 'conf.json')
+        assert code == 0, err
+        for phase in confix.ParseStats._PHASES:
+            assert re.search(r"^%s\s+\d+\.\d+$" % phase, out, re.M), out
+        assert 'keys processed: 1' in out
+        assert 'validators run: 1' in out
+        assert 'myconf.<lambda>' in out
+
+    def test_bench(self):
+        self.write_conf('conf.json', dict(ftp=dict(port=2121)))
+        code, out, err = self.run_cli('bench', '-m', 'myconf', '-n', '5',
+                                      'conf.json')
+        assert code == 0, err
+        assert 'parsed conf.json 5 times' in out
+        assert re.search(r"^total(\s+\d+\.\d+){3}$", out, re.M), out
+        code, out, err = self.run_cli('bench', '-m', 'myconf', 'conf.json',
+                                      '--foo')
+        assert code == 1
+        assert 'unrecognized arguments: --foo' in err
+
+    def test_invalid(self):
+        self.write_conf('conf.json', dict(ftp=dict(port=0)))
+        for cmd in ('dump', 'timing', 'bench'):
+            code, out, err = self.run_cli(cmd, '-m', 'myconf', 'conf.json')
+            assert code == 1
+            assert 'ValidationError' in err or 'port' in err, err
+        code, out, err = self.run_cli('dump', '-m', 'myconf', 'conf.json',
+                                      '--foo')
+        assert code == 2
+        assert 'unrecognized arguments: --foo' in err
+
+    def test_no_classes(self):
+        self.write_conf('conf.json', {})
+        code, out, err = self.run_cli('compile', 'conf.json')
+        assert code == 1
+        assert 'no configuration classes' in err
+
+
+# ===================================================================
+# misc tests
+# ===================================================================
+
+
+class TestMisc(BaseTestCase):
+
+    def test_mro(self):
+        # This method is automatically added by the meta class wrapper:
+        # https://docs.python.org/3/library/stdtypes.html#class.mro
+        # Make sure we can override it.
+        @register()
+        class config:
+            mro = 2
+
+        assert config.mro == 2
+
+        discard()
+
+        @register()
+        class config:
+            pass
+
+        config.mro
+
+    def test__all__(self):
+        dir_confix = dir(confix)
+        for name in dir_confix:
+            if name in ('configparser', 'logger', 'basestring', 'unicode'):
+                continue
+            if not name.startswith('_'):
+                try:
+                    __import__(name)
+                except ImportError:
+                    if name not in confix.__all__:
+                        fun = getattr(confix, name)
+                        if fun is None:
+                            continue
+                        if (fun.__doc__ is not None and
+                                'deprecated' not in fun.__doc__.lower()):
+                            self.fail('%r not in confix.__all__' % name)
+
+        # Import 'star' will break if __all__ is inconsistent, see:
+        # https://github.com/giampaolo/psutil/issues/656
+        # Can't do `from confix import *` as it won't work on python 3
+        # so we simply iterate over __all__.
+        for name in confix.__all__:
+            assert name in dir_confix
+
+    def test_lazy_imports(self):
+        # "import confix" is not supposed to import heavy modules.
+        code = textwrap.dedent("""
+            import sys
+            before = set(sys.modules)
+            import confix
+            print(' '.join(sorted(set(sys.modules) - before)))
+            """)
+        here = os.path.abspath(os.path.dirname(__file__))
+        out = subprocess.check_output([sys.executable, '-c', code], cwd=here)
+        imported = set(out.decode().split())
+        for name in ('configparser', 'inspect', 'json', 'logging',
+                     'multiprocessing', 're', 'warnings'):
+            assert name not in imported, name
+
+    def test_logger(self):
+        import logging
+        assert confix.logger is logging.getLogger('confix')
 
     def test_version(self):
         assert '.'.join([str(x) for x in confix.version_info]) == \